@@ -0,0 +1,75 @@
+"""Listing what is in zip and tar archives without extracting anything.
+
+A zip file is listed from its central directory, the index at the end of the
+file, so listing it reads only that. A tar file has no index, so its headers
+are read one after another: an uncompressed tar file is read by seeking past
+the data of each member, and a compressed one has to be decompressed as it is
+streamed through, but nothing is written anywhere or kept in memory.
+"""
+from __future__ import annotations
+
+import tarfile
+import time
+import zipfile
+from typing import List, Tuple
+
+# The endings of the names of the archives that can be listed.
+ZIP_EXTENSIONS = ('.zip', '.jar', '.war', '.ear', '.whl', '.apk', '.nupkg')
+TAR_EXTENSIONS = ('.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz', '.tbz2',
+                  '.tar.xz', '.txz')
+
+# A member of an archive: its path in the archive, separated by /, whether it
+# is a folder, its size and when it was last modified, in nanoseconds since
+# the epoch.
+Member = Tuple[str, bool, int, int]
+
+
+def is_archive(name: str) -> bool:
+    """Return whether the file called <name> is an archive that can be
+    listed, going by its name.
+    >>> is_archive('build.tar.gz'), is_archive('App.JAR'), is_archive('a.gz')
+    (True, True, False)
+    """
+    name = name.lower()
+    return name.endswith(ZIP_EXTENSIONS) or name.endswith(TAR_EXTENSIONS)
+
+
+def list_members(path: str) -> List[Member]:
+    """Return the members of the archive at <path>, in the order they are
+    stored in it.
+
+    The size of a member of a zip file is its compressed size, the space it
+    takes in the archive; a tar file does not record that, so the size of a
+    member of a tar file is its size once extracted. Links and other special
+    files are listed with size 0.
+
+    An archive that cannot be read, or is not an archive after all, has no
+    members.
+    """
+    try:
+        if path.lower().endswith(ZIP_EXTENSIONS):
+            return _list_zip(path)
+        return _list_tar(path)
+    except (OSError, EOFError, zipfile.BadZipFile, tarfile.TarError):
+        return []
+
+
+def _list_zip(path: str) -> List[Member]:
+    with zipfile.ZipFile(path) as archive:
+        return [(info.filename, info.is_dir(), info.compress_size,
+                 int(time.mktime(info.date_time + (0, 0, -1))) * 10 ** 9)
+                for info in archive.infolist()]
+
+
+def _list_tar(path: str) -> List[Member]:
+    # Streaming ('r|*') never seeks backwards, which compressed files cannot
+    # do cheaply; an uncompressed file is opened for seeking instead, so the
+    # data of each member is skipped rather than read.
+    mode = 'r:' if path.lower().endswith('.tar') else 'r|*'
+    members = []
+    with tarfile.open(path, mode) as archive:
+        for info in archive:
+            members.append((info.name, info.isdir(),
+                            info.size if info.isfile() else 0,
+                            int(info.mtime) * 10 ** 9))
+    return members
@@ -0,0 +1,435 @@
+"""Benchmarks of building, laying out, hit-testing, editing and drawing trees.
+
+Every benchmark runs on synthetic trees made from a fixed seed, so two runs
+with the same options time exactly the same work:
+    - wide: a few folders, each holding a great many files;
+    - deep: chains of folders DEEP_LEVELS deep, each holding a couple of
+      files and the next folder down, like nested packages;
+    - skewed: folders with a heavy-tailed number of children and files with
+      heavy-tailed sizes, like a real disk;
+    - papers: a CSV file in the format of papers.DATA_FILE, loaded as a
+      PaperTree;
+    - files: a real folder of files in a temporary directory, scanned as a
+      FileSystemTree (one file for every SCAN_RATIO nodes asked for);
+    - records: a listing of files in the format of du -ab, built into a
+      FileSystemTree with records.build_tree.
+
+Run it from the command line:
+
+    python benchmarks.py --nodes 1000000 --save baseline.json
+    python benchmarks.py --nodes 1000000 --compare baseline.json
+
+With --compare, any benchmark more than --threshold slower than in the
+baseline is reported, and the exit status is 1.
+
+With --names, nothing is timed; instead, the papers and records trees are
+built and the memory their names, authors and dois take is reported, against
+what it would be if every tree kept its own copy of each. The papers share
+their years, categories and authors; every name in the records listing is
+different, so it shows what sharing costs when nothing repeats:
+
+    python benchmarks.py --nodes 1000000 --names
+"""
+from __future__ import annotations
+
+import argparse
+import csv
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+from contextlib import nullcontext
+from typing import Callable, Dict, List, Optional, Tuple
+
+from papers import PaperTree
+from records import load_records
+from tm_trees import TMTree, FileSystemTree
+
+# The size of the treemap laid out and drawn.
+SCREEN = (0, 0, 1200, 670)
+
+# How many more nodes there are in the synthetic trees than files in the
+# scanned folder, which has to be written to disk first.
+SCAN_RATIO = 10
+
+# How many levels of folders each chain of the deep tree goes down.
+DEEP_LEVELS = 200
+
+# How many positions are hit-tested, how many edits are made in one batch,
+# and how many are made one at a time, each laid out as a key press would be.
+HIT_TESTS = 100
+EDITS = 1000
+SINGLE_EDITS = 10
+
+# Differences smaller than this, in seconds, are never taken as regressions,
+# however big they are relative to the baseline.
+MIN_DIFFERENCE = 0.005
+
+Results = Dict[str, float]
+
+_NO_BATCH = nullcontext()
+
+
+def wide_tree(nodes: int, rng: random.Random) -> FileSystemTree:
+    """Return a tree of about <nodes> nodes: ten folders of files.
+    >>> len(_leaves(wide_tree(1000, random.Random(0))))
+    980
+    """
+    per_folder = max(1, (nodes - 11) // 10)
+    return FileSystemTree.from_parts('wide', [
+        FileSystemTree.from_parts(f'folder{i}', [
+            FileSystemTree.from_parts(f'file{j}.dat', [],
+                                      rng.randint(1, 1 << 20))
+            for j in range(per_folder)])
+        for i in range(10)])
+
+
+def deep_tree(nodes: int, rng: random.Random) -> FileSystemTree:
+    """Return a tree of about <nodes> nodes: chains of folders up to
+    DEEP_LEVELS deep, each folder holding two files and the next folder down.
+    >>> tree = deep_tree(1000, random.Random(0))
+    >>> len(_leaves(tree)), len(tree._subtrees)
+    (400, 1)
+    """
+    levels = max(1, min(DEEP_LEVELS, nodes // 3))
+    chains = []
+    for chain in range(max(1, nodes // (3 * levels))):
+        # Built from the bottom up, so each folder has the one below it.
+        folder = None
+        for level in reversed(range(levels)):
+            subtrees = [FileSystemTree.from_parts(f'file{i}.dat', [],
+                                                  rng.randint(1, 1 << 20))
+                        for i in range(2)]
+            if folder is not None:
+                subtrees.append(folder)
+            folder = FileSystemTree.from_parts(f'chain{chain}.{level}',
+                                               subtrees)
+        chains.append(folder)
+    return FileSystemTree.from_parts('deep', chains)
+
+
+def skewed_tree(nodes: int, rng: random.Random) -> FileSystemTree:
+    """Return a tree of about <nodes> nodes, where both the number of
+    children of each folder and the size of each file are heavy-tailed.
+    """
+    def build(name: str, count: int) -> FileSystemTree:
+        if count < 3:
+            return FileSystemTree.from_parts(
+                name, [], int(rng.paretovariate(1.2) * 1000))
+        fanout = min(count - 1, 1 + int(rng.paretovariate(0.8)))
+        weights = [rng.paretovariate(1.0) for _ in range(fanout)]
+        total = sum(weights)
+        return FileSystemTree.from_parts(name, [
+            build(f'{name}.{i}', max(1, int((count - 1) * w / total)))
+            for i, w in enumerate(weights)])
+    return build('s', nodes)
+
+
+def write_papers(filename: str, papers: int, rng: random.Random) -> None:
+    """Write a CSV file of <papers> made-up papers to <filename>, in the
+    format of papers.DATA_FILE.
+    """
+    with open(filename, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(['Author', 'Title', 'Year', 'Category', 'Url',
+                         'Citations'])
+        for i in range(papers):
+            category = ': '.join(f'topic{rng.randint(0, 9)}'
+                                 for _ in range(rng.randint(1, 4)))
+            writer.writerow([f'Author {i % 997}', f'Paper {i}',
+                             1970 + i % 50, category,
+                             f'http://example.org/{i}',
+                             int(rng.paretovariate(1.5))])
+
+
+def write_files(path: str, files: int, rng: random.Random) -> None:
+    """Write <files> small files into a tree of folders under <path>.
+    """
+    per_folder = 100
+    for i in range(files):
+        folder = os.path.join(path, f'folder{i // per_folder // per_folder}',
+                              f'folder{i // per_folder}')
+        if i % per_folder == 0:
+            os.makedirs(folder, exist_ok=True)
+        with open(os.path.join(folder, f'file{i}.dat'), 'wb') as file:
+            file.write(b'x' * rng.randint(0, 100))
+
+
+def write_du_listing(filename: str, files: int, rng: random.Random) -> None:
+    """Write a listing of <files> files in a tree of folders, in the format
+    of du -ab, to <filename>.
+    """
+    per_folder = 100
+    with open(filename, 'w') as file:
+        for i in range(files):
+            folder = f'listing/folder{i // per_folder // per_folder}/' \
+                     f'folder{i // per_folder}'
+            file.write(f'{rng.randint(0, 1 << 20)}\t{folder}/file{i}.dat\n')
+            if i % per_folder == per_folder - 1:
+                file.write(f'0\t{folder}\n')
+
+
+SHAPES: Dict[str, Callable[[int, random.Random], FileSystemTree]] = {
+    'wide': wide_tree, 'deep': deep_tree, 'skewed': skewed_tree}
+
+
+def run_benchmarks(nodes: int = 100000, repeat: int = 3, seed: int = 0,
+                   only: Optional[str] = None) -> Results:
+    """Return the time, in seconds, taken by every benchmark on trees of
+    about <nodes> nodes: the fastest of <repeat> runs. Only the benchmarks
+    whose names contain <only> are run, if it is given.
+    """
+    results = {}
+
+    def measure(name: str, setup: Callable[[], object],
+                work: Callable[[object], object]) -> None:
+        if only is not None and only not in name:
+            return
+        best = None
+        for _ in range(repeat):
+            state = setup()
+            start = time.perf_counter()
+            work(state)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        results[name] = best
+
+    for shape, make in SHAPES.items():
+        def build(shape_make=make) -> FileSystemTree:
+            return shape_make(nodes, random.Random(seed))
+
+        def laid_out(shape_make=make) -> FileSystemTree:
+            tree = shape_make(nodes, random.Random(seed))
+            tree.expand_all()
+            tree.update_rectangles(SCREEN)
+            return tree
+
+        measure(f'build/{shape}', lambda: None, lambda _, b=build: b())
+        measure(f'layout/{shape}', laid_out,
+                lambda tree: tree.update_rectangles(SCREEN))
+        measure(f'rectangles/{shape}', laid_out,
+                lambda tree: tree.get_rectangles())
+        measure(f'hit_test/{shape}', laid_out, _hit_test)
+        measure(f'expand_collapse/{shape}', build, _expand_collapse)
+        measure(f'edit/{shape}', laid_out, _edit)
+        measure(f'edit_and_layout/{shape}', laid_out,
+                lambda tree: _edit(tree, SINGLE_EDITS, batched=False))
+        measure(f'render/{shape}', laid_out, _render)
+
+    with tempfile.TemporaryDirectory() as path:
+        filename = os.path.join(path, 'papers.csv')
+        measure('build/papers',
+                lambda: write_papers(filename, nodes // 2,
+                                     random.Random(seed)),
+                lambda _: PaperTree('papers', [], all_papers=True,
+                                    by_year=True, data_file=filename))
+        folder = os.path.join(path, 'files')
+        if only is None or only in 'scan/files':
+            write_files(folder, max(1, nodes // SCAN_RATIO),
+                        random.Random(seed))
+        measure('scan/files', lambda: None,
+                lambda _: FileSystemTree(folder))
+        listing = os.path.join(path, 'listing.txt')
+        measure('build/records',
+                lambda: write_du_listing(listing, nodes, random.Random(seed)),
+                lambda _: load_records(listing, 'du'))
+    return results
+
+
+def name_report(nodes: int = 100000, seed: int = 0
+                ) -> Dict[str, Tuple[int, int]]:
+    """Return, for the papers and records trees of about <nodes> nodes, the
+    bytes taken by their strings and the bytes they would take unshared, as
+    for name_memory.
+    """
+    report = {}
+    with tempfile.TemporaryDirectory() as path:
+        filename = os.path.join(path, 'papers.csv')
+        write_papers(filename, nodes // 2, random.Random(seed))
+        report['papers'] = name_memory(PaperTree(
+            'papers', [], all_papers=True, by_year=True, data_file=filename))
+        listing = os.path.join(path, 'listing.txt')
+        write_du_listing(listing, nodes, random.Random(seed))
+        report['records'] = name_memory(load_records(listing, 'du'))
+    return report
+
+
+def name_memory(tree: TMTree) -> Tuple[int, int]:
+    """Return the bytes taken by the names, authors and dois of the trees in
+    <tree>, counting each string once however many trees share it, and the
+    bytes they would take if every tree had its own copy.
+    >>> name = 'notes.txt'
+    >>> tree = FileSystemTree.from_parts('root', [
+    ...     FileSystemTree.from_parts(name, [], 1),
+    ...     FileSystemTree.from_parts(name, [], 1)])
+    >>> shared, unshared = name_memory(tree)
+    >>> unshared - shared == sys.getsizeof(name)
+    True
+    """
+    shared = unshared = 0
+    seen = set()
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        stack.extend(node._subtrees)
+        for text in (node._name, getattr(node, 'authors', None),
+                     getattr(node, 'doi', None)):
+            if text:
+                size = sys.getsizeof(text)
+                unshared += size
+                if id(text) not in seen:
+                    seen.add(id(text))
+                    shared += size
+    return shared, unshared
+
+
+def _leaves(tree: TMTree) -> List[TMTree]:
+    leaves = []
+    stack = [tree]
+    while stack:
+        tree = stack.pop()
+        if tree._subtrees:
+            stack.extend(tree._subtrees)
+        else:
+            leaves.append(tree)
+    return leaves
+
+
+def _hit_test(tree: TMTree) -> None:
+    rng = random.Random(0)
+    for _ in range(HIT_TESTS):
+        tree.get_tree_at_position((rng.randrange(SCREEN[2]),
+                                   rng.randrange(SCREEN[3])))
+
+
+def _expand_collapse(tree: TMTree) -> None:
+    tree.expand_all()
+    tree.collapse_all()
+
+
+def _edit(tree: TMTree, edits: int = EDITS, batched: bool = True) -> None:
+    """Make <edits> random changes of size, moves and deletions to the files
+    in <tree>. If <batched>, make them in one batch; otherwise, lay the tree
+    out again after each one, as the visualiser does.
+    """
+    rng = random.Random(0)
+    leaves = _leaves(tree)
+    folders = [leaf._parent_tree
+               for leaf in rng.sample(leaves, min(10, len(leaves)))]
+    with tree.batch() if batched else _NO_BATCH:
+        for leaf in rng.sample(leaves, min(len(leaves), edits)):
+            edit = rng.randrange(3)
+            if edit == 0:
+                leaf.change_size(0.01)
+            elif edit == 1:
+                leaf.move(rng.choice(folders))
+            elif leaf._parent_tree is not tree:
+                leaf.delete_self()
+            if not batched:
+                tree.update_rectangles(SCREEN)
+
+
+def _render(tree: TMTree) -> None:
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    import pygame
+    from treemap_visualiser import Visualiser
+    pygame.font.init()
+    visualiser = Visualiser()
+    visualiser.screen = pygame.Surface((visualiser.width, visualiser.height))
+    visualiser.tree = tree
+    visualiser.render_display()
+
+
+def compare_results(baseline: Results, results: Results,
+                    threshold: float = 0.25) -> List[str]:
+    """Return a description of every benchmark in <results> that took more
+    than <threshold> longer than it did in <baseline>, as a fraction of the
+    baseline time, and at least MIN_DIFFERENCE longer.
+    >>> compare_results({'a': 1.0, 'b': 1.0}, {'a': 1.1, 'b': 1.5})
+    ['b: 1.500s, 50% slower than 1.000s']
+    """
+    regressions = []
+    for name, seconds in results.items():
+        before = baseline.get(name)
+        if before is None:
+            continue
+        if seconds > before * (1 + threshold) and \
+                seconds - before >= MIN_DIFFERENCE:
+            regressions.append(f'{name}: {seconds:.3f}s, '
+                               f'{seconds / before - 1:.0%} slower than '
+                               f'{before:.3f}s')
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Entry point for the command line. Return the exit status: 1 if there
+    were regressions, and 0 otherwise.
+    """
+    parser = argparse.ArgumentParser(
+        description='Time tree building, layout, hit-testing, editing and '
+                    'drawing on synthetic trees.')
+    parser.add_argument('--nodes', type=int, default=100000,
+                        help='nodes in each synthetic tree (default 100000)')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='runs of each benchmark; the fastest is kept '
+                             '(default 3)')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='seed for the synthetic trees (default 0)')
+    parser.add_argument('--only', metavar='TEXT',
+                        help='run only the benchmarks whose names contain '
+                             'TEXT')
+    parser.add_argument('--save', metavar='FILE',
+                        help='save the results as a JSON baseline')
+    parser.add_argument('--compare', metavar='FILE',
+                        help='compare the results with a saved baseline')
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='the slowdown, as a fraction, counted as a '
+                             'regression (default 0.25)')
+    parser.add_argument('--names', action='store_true',
+                        help='report the memory saved by sharing names '
+                             'instead of timing anything')
+    args = parser.parse_args(argv)
+
+    if args.names:
+        for name, (shared, unshared) in name_report(args.nodes,
+                                                    args.seed).items():
+            print(f'{name:24} {shared / 2 ** 20:9.1f} MiB of strings, '
+                  f'{unshared / 2 ** 20:.1f} MiB unshared, '
+                  f'{1 - shared / unshared:.0%} saved')
+        return 0
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+        if baseline['nodes'] != args.nodes or baseline['seed'] != args.seed:
+            parser.error(f'{args.compare} was made with --nodes '
+                         f'{baseline["nodes"]} --seed {baseline["seed"]}')
+
+    results = run_benchmarks(args.nodes, args.repeat, args.seed, args.only)
+    for name, seconds in results.items():
+        line = f'{name:24} {seconds:9.4f}s'
+        if baseline is not None and name in baseline['results']:
+            before = baseline['results'][name]
+            line += f' {before:9.4f}s {seconds / before - 1:+6.0%}'
+        print(line)
+
+    if args.save:
+        with open(args.save, 'w') as file:
+            json.dump({'nodes': args.nodes, 'seed': args.seed,
+                       'python': platform.python_version(),
+                       'results': results}, file, indent=1)
+    if baseline is not None:
+        regressions = compare_results(baseline['results'], results,
+                                      args.threshold)
+        for regression in regressions:
+            print('Regression:', regression)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
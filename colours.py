@@ -0,0 +1,169 @@
+"""Colour policies: the rules that decide the colour of each tree in a
+treemap.
+
+Every policy gives a tree the same colour on every run, so images of the same
+tree can be compared. A policy is set on a whole tree with
+TMTree.set_colour_policy, which either colours every tree at once or leaves
+each tree to be coloured the first time it is drawn.
+"""
+from __future__ import annotations
+
+import os
+from typing import TYPE_CHECKING, Callable, Tuple
+from zlib import crc32
+
+if TYPE_CHECKING:
+    from tm_trees import TMTree
+
+
+class ColourPolicy:
+    """A rule for colouring the trees in a treemap.
+
+    This is an abstract class that should not be instantiated directly.
+
+    === Public Attributes ===
+    uses_size:
+        Whether colours depend on data_size, and so must be worked out again
+        when a tree changes size.
+    """
+    uses_size: bool = False
+
+    def colour(self, tree: TMTree) -> Tuple[int, int, int]:
+        """Return the colour of <tree>.
+        """
+        raise NotImplementedError
+
+    def assign(self, tree: TMTree) -> None:
+        """Colour <tree> and all of its descendants.
+        """
+        stack = [tree]
+        while stack:
+            tree = stack.pop()
+            tree._colour = self.colour(tree)
+            stack.extend(tree._subtrees)
+
+
+class PathColours(ColourPolicy):
+    """Colours each tree by a hash of the names on its path from the root, so
+    that every tree keeps its colour from one run to the next.
+    >>> from tm_trees import TMTree
+    >>> leaf = TMTree("a.txt", [], 5)
+    >>> root = TMTree("root", [leaf])
+    >>> PathColours().colour(leaf) == _hash_colour(crc32(b'root/a.txt'))
+    True
+    """
+
+    def colour(self, tree: TMTree) -> Tuple[int, int, int]:
+        return _hash_colour(crc32(_encode(self._path(tree))))
+
+    def assign(self, tree: TMTree) -> None:
+        # Each path's hash carries on from its parent's, so the whole tree is
+        # hashed in one pass from the top.
+        parent = tree._parent_tree
+        start = 0 if parent is None else crc32(
+            _encode(self._path(parent) + '/'))
+        stack = [(tree, start)]
+        while stack:
+            tree, value = stack.pop()
+            value = crc32(_encode(tree._name or ''), value)
+            tree._colour = _hash_colour(value)
+            value = crc32(b'/', value)
+            stack.extend((sub, value) for sub in tree._subtrees)
+
+    @staticmethod
+    def _path(tree: TMTree) -> str:
+        names = []
+        while tree is not None:
+            names.append(tree._name or '')
+            tree = tree._parent_tree
+        return '/'.join(reversed(names))
+
+
+def file_category(tree: TMTree) -> str:
+    """Return the extension of <tree>'s name if it is a leaf that has one, so
+    files are grouped by type, and the name of its parent otherwise, so papers
+    are grouped by their category.
+    >>> from tm_trees import TMTree
+    >>> file_category(TMTree("Cats.PDF", [], 5))
+    '.pdf'
+    """
+    extension = os.path.splitext(tree._name or '')[1]
+    if extension and not tree._subtrees:
+        return extension.lower()
+    if tree._parent_tree is not None:
+        return tree._parent_tree._name or ''
+    return tree._name or ''
+
+
+class CategoryColours(ColourPolicy):
+    """Colours each tree by its category, so that all of the trees in one
+    category share a colour.
+
+    === Public Attributes ===
+    category:
+        Returns the category of a tree; file_category by default.
+    """
+    category: Callable[[TMTree], str]
+
+    def __init__(self, category: Callable[[TMTree], str] = file_category
+                 ) -> None:
+        self.category = category
+
+    def colour(self, tree: TMTree) -> Tuple[int, int, int]:
+        return _hash_colour(crc32(_encode(self.category(tree))))
+
+
+class SizeColours(ColourPolicy):
+    """Colours each tree by the power of two its data_size falls in, from
+    blue for the smallest to red for sizes of 2 ** max_bits and above.
+
+    === Public Attributes ===
+    max_bits:
+        The number of bits in the smallest size coloured fully red.
+    >>> from tm_trees import TMTree
+    >>> SizeColours(10).colour(TMTree("big", [], 5000))
+    (255, 64, 0)
+    """
+    uses_size = True
+    max_bits: int
+
+    def __init__(self, max_bits: int = 40) -> None:
+        self.max_bits = max_bits
+
+    def colour(self, tree: TMTree) -> Tuple[int, int, int]:
+        heat = min(tree.data_size.bit_length(), self.max_bits) / self.max_bits
+        return int(255 * heat), 64, int(255 * (1 - heat))
+
+
+class DiffColours(ColourPolicy):
+    """Colours each tree of a DiffTree (see diffs.py) green if it grew and
+    red if it shrank, brightest for whole trees that were added or removed,
+    and grey if its size did not change.
+    >>> from diffs import DiffTree, REMOVED
+    >>> DiffColours().colour(DiffTree('b.txt', [], -2, REMOVED))
+    (220, 40, 40)
+    """
+
+    def colour(self, tree: TMTree) -> Tuple[int, int, int]:
+        growth = tree.growth
+        sign = (growth > 0) - (growth < 0)
+        return _DIFF_COLOURS.get((tree.status, sign), _UNCHANGED_COLOUR)
+
+
+# The colours of DiffTrees that grew and shrank, by status and the sign of
+# their growth.
+_DIFF_COLOURS = {('added', 1): (40, 200, 80), ('changed', 1): (70, 140, 80),
+                 ('removed', -1): (220, 40, 40),
+                 ('changed', -1): (160, 80, 70)}
+_UNCHANGED_COLOUR = (128, 128, 128)
+
+
+def _hash_colour(value: int) -> Tuple[int, int, int]:
+    """Return a colour made from the low 24 bits of the hash <value>.
+    """
+    return value & 0xFF, value >> 8 & 0xFF, value >> 16 & 0xFF
+
+
+def _encode(text: str) -> bytes:
+    # File names that are not valid UTF-8 are kept as surrogates by os.
+    return text.encode('utf-8', 'surrogateescape')
@@ -0,0 +1,195 @@
+"""Treemaps of what changed between two scans of the same folder.
+
+Either scan may be a FileSystemTree or a Snapshot. The two are walked
+together from the top, matching children by name after sorting them, and a
+folder whose size and modification time are the same in both scans is taken
+to be unchanged and not looked into. Only the changed parts of the scans are
+read, so comparing two large snapshots with few differences is quick.
+"""
+from __future__ import annotations
+
+import os
+from typing import List, Optional, Tuple, Union
+
+from colours import DiffColours
+from snapshots import Snapshot
+from tm_trees import TMTree, ViewTree, format_size
+
+ADDED = 'added'
+REMOVED = 'removed'
+CHANGED = 'changed'
+
+_DIFF_COLOURS = DiffColours()
+
+Scan = Union[TMTree, Snapshot]
+
+
+class DiffTree(ViewTree):
+    """A tree of the files and folders that changed between two scans, each
+    sized by how much it grew or shrank, and coloured by DiffColours: green
+    if it grew and red if it shrank. Another colour policy can be set with
+    set_colour_policy, and DiffColours set again the same way.
+
+    Files and folders that were added or removed are leaves; so are files
+    that changed size. A folder's data_size is the total change of the
+    leaves in it, counting growth and shrinkage alike.
+
+    === Public Attributes ===
+    growth:
+        The size in the new scan minus the size in the old one.
+    status:
+        ADDED, REMOVED or CHANGED.
+    """
+    growth: int
+    status: str
+
+    def __init__(self, name: str, subtrees: List[DiffTree], growth: int,
+                 status: str = CHANGED) -> None:
+        """Initialize a new DiffTree called <name> that grew by <growth>.
+        >>> tree = DiffTree('docs', [DiffTree('a.txt', [], 5, ADDED),
+        ...                          DiffTree('b.txt', [], -2, REMOVED)], 3)
+        >>> tree.data_size, tree.growth
+        (7, 3)
+        >>> tree._subtrees[1]._colour
+        (220, 40, 40)
+        """
+        TMTree.__init__(self, name, subtrees, abs(growth))
+        self.growth = growth
+        self.status = status
+        # Every tree is the root of its own tree until it is put in another,
+        # so this is the policy of whichever DiffTree ends up the root.
+        self._colour_policy = _DIFF_COLOURS
+
+    def get_separator(self) -> str:
+        """Return the file separator for this OS.
+        """
+        return os.sep
+
+    def get_suffix(self) -> str:
+        """Return how this tree changed.
+        """
+        sign = '-' if self.growth < 0 else '+'
+        return f' ({self.status}, {sign}{format_size(abs(self.growth))})'
+
+
+def diff_trees(old: Scan, new: Scan) -> DiffTree:
+    """Return a DiffTree of what changed from the scan <old> to the scan
+    <new>, each a FileSystemTree or a Snapshot of one.
+    >>> from tm_trees import FileSystemTree
+    >>> def scan(sizes):
+    ...     return FileSystemTree.from_parts('root', [
+    ...         FileSystemTree.from_parts(name, [], size)
+    ...         for name, size in sizes.items()])
+    >>> diff = diff_trees(scan({'a': 5, 'b': 7, 'c': 1}),
+    ...                   scan({'a': 5, 'b': 4, 'd': 2}))
+    >>> [(sub._name, sub.status, sub.growth) for sub in diff._subtrees]
+    [('b', 'changed', -3), ('c', 'removed', -1), ('d', 'added', 2)]
+    """
+    old_side, new_side = _side(old), _side(new)
+    old_root, new_root = old_side.root(), new_side.root()
+    new_info = new_side.describe(new_root)
+    diff = _diff(old_side, old_root, old_side.describe(old_root),
+                 new_side, new_root, new_info)
+    if diff is None:
+        diff = DiffTree(new_info[0], [], 0)
+    return diff
+
+
+def _diff(old_side: _Side, old: object, old_info: Tuple[str, int, int],
+          new_side: _Side, new: object, new_info: Tuple[str, int, int]
+          ) -> Optional[DiffTree]:
+    """Return the DiffTree of the changes from <old> to <new>, the same file
+    or folder in two scans, or None if nothing changed.
+    """
+    name, old_size, old_mtime = old_info
+    name, new_size, new_mtime = new_info
+    if old_size == new_size and old_mtime == new_mtime:
+        return None
+    old_children = old_side.sorted_children(old)
+    new_children = new_side.sorted_children(new)
+    if not old_children or not new_children:
+        growth = new_size - old_size
+        return DiffTree(name, [], growth) if growth else None
+
+    subtrees = []
+    i = j = 0
+    while i < len(old_children) or j < len(new_children):
+        if j == len(new_children) or i < len(old_children) and \
+                old_children[i][0][0] < new_children[j][0][0]:
+            (child_name, size, _), _ = old_children[i]
+            sub = DiffTree(child_name, [], -size, REMOVED) if size else None
+            i += 1
+        elif i == len(old_children) or \
+                new_children[j][0][0] < old_children[i][0][0]:
+            (child_name, size, _), _ = new_children[j]
+            sub = DiffTree(child_name, [], size, ADDED) if size else None
+            j += 1
+        else:
+            sub = _diff(old_side, old_children[i][1], old_children[i][0],
+                        new_side, new_children[j][1], new_children[j][0])
+            i += 1
+            j += 1
+        if sub is not None:
+            subtrees.append(sub)
+    if not subtrees:
+        return None
+    return DiffTree(name, subtrees, new_size - old_size)
+
+
+class _Side:
+    """One of the two scans being compared, giving the name, size and
+    modification time of its files and folders, however they are stored.
+    """
+
+    def root(self) -> object:
+        raise NotImplementedError
+
+    def describe(self, node: object) -> Tuple[str, int, int]:
+        raise NotImplementedError
+
+    def children(self, node: object) -> List[object]:
+        raise NotImplementedError
+
+    def sorted_children(self, node: object
+                        ) -> List[Tuple[Tuple[str, int, int], object]]:
+        """Return the (name, size, mtime) of each child of <node> with the
+        child itself, sorted by name.
+        """
+        children = [(self.describe(child), child)
+                    for child in self.children(node)]
+        children.sort(key=lambda child: child[0][0])
+        return children
+
+
+class _TreeSide(_Side):
+    def __init__(self, tree: TMTree) -> None:
+        self._tree = tree
+
+    def root(self) -> TMTree:
+        return self._tree
+
+    def describe(self, node: TMTree) -> Tuple[str, int, int]:
+        return node._name, node.data_size, getattr(node, '_mtime', 0)
+
+    def children(self, node: TMTree) -> List[TMTree]:
+        return node._subtrees
+
+
+class _SnapshotSide(_Side):
+    def __init__(self, snapshot: Snapshot) -> None:
+        self._snapshot = snapshot
+
+    def root(self) -> int:
+        return 0
+
+    def describe(self, node: int) -> Tuple[str, int, int]:
+        return self._snapshot.describe(node)
+
+    def children(self, node: int) -> List[int]:
+        return list(self._snapshot.children(node))
+
+
+def _side(scan: Scan) -> _Side:
+    if isinstance(scan, Snapshot):
+        return _SnapshotSide(scan)
+    return _TreeSide(scan)
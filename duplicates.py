@@ -0,0 +1,203 @@
+"""Finding files with the same contents in a scanned folder.
+
+Only files of the same size can have the same contents, and the sizes are
+already in the tree, so most files are ruled out without being read. The rest
+are narrowed down by hashing their first and last blocks, and only files that
+still match are hashed in full. Files are read by a small pool of threads,
+with only a few reads queued at a time, so a search neither floods the disk
+nor holds more than a few blocks in memory per thread.
+
+Hard links to the same file are counted once: deleting one of them frees
+nothing. Files are compared by their sizes in bytes, whichever metric the
+tree is sized by.
+"""
+from __future__ import annotations
+
+import hashlib
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, \
+    Tuple, TypeVar
+
+from tm_trees import ArchiveTree, FileSystemTree
+
+# How many bytes at each end of a file the first pass hashes.
+BLOCK_SIZE = 64 * 1024
+
+# How many bytes are read at a time when hashing a whole file.
+CHUNK_SIZE = 1024 * 1024
+
+# How many files are read at once.
+WORKERS = 4
+
+# Files smaller than this are never reported; empty files are all alike.
+MIN_SIZE = 1
+
+# A file to hash: its tree, and its path.
+Candidate = Tuple[FileSystemTree, str]
+
+T = TypeVar('T')
+R = TypeVar('R')
+
+
+def find_duplicates(tree: FileSystemTree, path: str, workers: int = WORKERS,
+                    min_size: int = MIN_SIZE, block_size: int = BLOCK_SIZE
+                    ) -> List[List[FileSystemTree]]:
+    """Return the groups of files in <tree>, the scan of the folder at
+    <path>, that have the same contents, largest reclaimable space first.
+    Files are read by <workers> threads, and files smaller than <min_size>
+    are left out.
+
+    Files that were not scanned one by one, or are in an archive, are left
+    out, as are files that cannot be read.
+    """
+    return hash_candidates(size_candidates(tree, path, min_size), workers,
+                           block_size)
+
+
+def size_candidates(tree: FileSystemTree, path: str,
+                    min_size: int = MIN_SIZE) -> List[List[Candidate]]:
+    """Return the files in <tree>, the scan of the folder at <path>, grouped
+    by size, leaving out the sizes only one file has, and the files smaller
+    than <min_size>.
+
+    This only reads the tree, so it can be done before hashing the files in
+    another thread.
+    >>> tree = FileSystemTree.from_parts('root', [
+    ...     FileSystemTree.from_parts('a', [], 5),
+    ...     FileSystemTree.from_parts('b', [], 5),
+    ...     FileSystemTree.from_parts('c', [], 7)])
+    >>> [[name for _, name in group]
+    ...  for group in size_candidates(tree, 'root')]
+    [['root/a', 'root/b']]
+    """
+    by_size: Dict[int, List[Candidate]] = {}
+    active = tree._root()._metric
+    stack = [(tree, path)]
+    while stack:
+        node, node_path = stack.pop()
+        if node._subtrees and not isinstance(node, ArchiveTree):
+            # Reversed so the files come out in the order of the tree.
+            stack.extend((sub, os.path.join(node_path, sub._name))
+                         for sub in reversed(node._subtrees))
+        elif not node._skipped:
+            size = node._metrics[0] if active else node.data_size
+            if size >= min_size:
+                by_size.setdefault(size, []).append((node, node_path))
+    return [group for group in by_size.values() if len(group) > 1]
+
+
+def hash_candidates(candidates: List[List[Candidate]],
+                    workers: int = WORKERS, block_size: int = BLOCK_SIZE
+                    ) -> List[List[FileSystemTree]]:
+    """Return the groups of files in <candidates>, files grouped by size,
+    that have the same contents, largest reclaimable space first, reading
+    them with <workers> threads.
+    """
+    # First pass: the first and last <block_size> bytes of every file, which
+    # is all of a file of up to twice that. Files are grouped by their size
+    # as they are read, since they may have changed since the scan.
+    firsts = [file for group in candidates for file in group]
+    partial: Dict[Tuple[int, bytes], List[Candidate]] = {}
+    inodes = set()
+    for file, result in zip(firsts, _map_bounded(
+            lambda file: _hash_ends(file[1], block_size), firsts, workers)):
+        if result is not None and result[0] not in inodes:
+            inodes.add(result[0])
+            partial.setdefault(result[1:], []).append(file)
+
+    groups = []
+    seconds = []
+    for (size, _), files in partial.items():
+        if len(files) < 2:
+            continue
+        if size <= 2 * block_size:
+            groups.append([tree for tree, _ in files])
+        else:
+            seconds.extend((size, file) for file in files)
+
+    # Second pass: the whole of each file that is still a candidate.
+    full: Dict[Tuple[int, bytes], List[FileSystemTree]] = {}
+    for (size, file), digest in zip(seconds, _map_bounded(
+            lambda second: _hash_all(second[1][1]), seconds, workers)):
+        if digest is not None:
+            full.setdefault((size, digest), []).append(file[0])
+    groups.extend(files for files in full.values() if len(files) > 1)
+
+    groups.sort(key=lambda files: file_size(files[0]) * (len(files) - 1),
+                reverse=True)
+    return groups
+
+
+def reclaimable(groups: Iterable[List[FileSystemTree]]) -> int:
+    """Return how many bytes deleting all but one file of each group in
+    <groups> would free.
+    >>> a = FileSystemTree.from_parts('a', [], 10)
+    >>> b = FileSystemTree.from_parts('b', [], 10)
+    >>> c = FileSystemTree.from_parts('c', [], 10)
+    >>> reclaimable([[a, b, c]])
+    20
+    """
+    return sum(file_size(files[0]) * (len(files) - 1) for files in groups)
+
+
+def file_size(tree: FileSystemTree) -> int:
+    """Return the size in bytes of the file <tree>, whichever metric the tree
+    containing it is sized by.
+    >>> tree = FileSystemTree.from_parts('root', [
+    ...     FileSystemTree.from_parts('a', [], 10)])
+    >>> tree.set_metric('files')
+    >>> file_size(tree._subtrees[0])
+    10
+    """
+    if tree._root()._metric:
+        return tree._metrics[0]
+    return tree.data_size
+
+
+def _hash_ends(path: str, block_size: int
+               ) -> Optional[Tuple[Tuple[int, int], int, bytes]]:
+    """Return the device and inode of the file at <path>, its size in bytes,
+    and the hash of its first and last <block_size> bytes, or None if it
+    cannot be read.
+    """
+    try:
+        with open(path, 'rb') as file:
+            info = os.fstat(file.fileno())
+            digest = hashlib.blake2b(file.read(block_size), digest_size=16)
+            if info.st_size > block_size:
+                file.seek(max(block_size, info.st_size - block_size))
+                digest.update(file.read(block_size))
+    except OSError:
+        return None
+    return (info.st_dev, info.st_ino), info.st_size, digest.digest()
+
+
+def _hash_all(path: str) -> Optional[bytes]:
+    """Return the hash of the whole file at <path>, or None if it cannot be
+    read.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    try:
+        with open(path, 'rb') as file:
+            for chunk in iter(lambda: file.read(CHUNK_SIZE), b''):
+                digest.update(chunk)
+    except OSError:
+        return None
+    return digest.digest()
+
+
+def _map_bounded(function: Callable[[T], R], items: List[T],
+                 workers: int) -> Iterator[R]:
+    """Yield <function> of each of <items>, in order, computed by <workers>
+    threads, with at most twice that many calls waiting at once.
+    """
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for item in items:
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+            pending.append(pool.submit(function, item))
+        while pending:
+            yield pending.popleft().result()
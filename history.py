@@ -0,0 +1,253 @@
+"""A store of scans of the same folder taken over time, such as one a day.
+
+Every so often a scan is kept whole, as a snapshot; each scan in between is
+kept as a delta against the scan before it, recording only the files and
+folders whose size or modification time changed and the ones that were added
+or removed. A store is a folder holding these files and an index of them:
+
+    index.json                  the dates in order, and each date's file
+    2026-10-01.snap             a whole scan, saved with save_snapshot
+    2026-10-02.delta.json.gz    the changes since the scan before
+
+The tree of any date is rebuilt from the whole scan at or before it and the
+deltas after that, so at most keyframe_interval - 1 deltas are ever applied.
+"""
+from __future__ import annotations
+
+import datetime
+import gzip
+import json
+import os
+from typing import Dict, List, Optional, Tuple
+
+from snapshots import load_snapshot, save_snapshot
+from tm_trees import TMTree, FileSystemTree
+
+INDEX_FILE = 'index.json'
+
+
+class SnapshotStore:
+    """The scans of one folder, saved by date in the folder <path>.
+
+    === Public Attributes ===
+    path:
+        The folder the store is saved in.
+    keyframe_interval:
+        How many scans there are from one whole scan to the next.
+
+    === Private Attributes ===
+    _entries:
+        The date and file name of every scan, oldest first.
+    """
+    path: str
+    keyframe_interval: int
+    _entries: List[Dict[str, str]]
+
+    def __init__(self, path: str, keyframe_interval: int = 7) -> None:
+        """Open the store in the folder <path>, creating it if it does not
+        exist. New stores save a whole scan every <keyframe_interval> scans;
+        existing ones keep the interval they were created with.
+        """
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        try:
+            with open(os.path.join(path, INDEX_FILE)) as file:
+                index = json.load(file)
+        except FileNotFoundError:
+            index = {'keyframe_interval': keyframe_interval, 'entries': []}
+        self.keyframe_interval = index['keyframe_interval']
+        self._entries = index['entries']
+
+    def get_dates(self) -> List[str]:
+        """Return the dates of the scans in the store, oldest first.
+        """
+        return [entry['date'] for entry in self._entries]
+
+    def add(self, tree: FileSystemTree, date: Optional[str] = None) -> None:
+        """Add the scan <tree>, taken on <date> (today by default), after the
+        scans already in the store.
+
+        Raise ValueError if the store already has a scan from <date> or
+        later, or if <tree> is not sized in bytes.
+        """
+        if tree._root()._metric:
+            raise ValueError(f'{tree._name} is sized by {tree.get_metric()}, '
+                             f'not {tree.METRICS[0]}')
+        if date is None:
+            date = datetime.date.today().isoformat()
+        if self._entries and date <= self._entries[-1]['date']:
+            raise ValueError(f'the store already has a scan from {date} '
+                             f'or later')
+
+        if len(self._entries) % self.keyframe_interval == 0:
+            filename = date + '.snap'
+            save_snapshot(tree, os.path.join(self.path, filename))
+        else:
+            edits = []
+            _delta(self.get_tree(self._entries[-1]['date']), tree, [], edits)
+            filename = date + '.delta.json.gz'
+            with gzip.open(os.path.join(self.path, filename), 'wt',
+                           encoding='ascii') as file:
+                json.dump({'edits': edits}, file, separators=(',', ':'))
+
+        self._entries.append({'date': date, 'file': filename})
+        with open(os.path.join(self.path, INDEX_FILE), 'w') as file:
+            json.dump({'keyframe_interval': self.keyframe_interval,
+                       'entries': self._entries}, file, indent=1)
+
+    def get_tree(self, date: str) -> FileSystemTree:
+        """Return the scan taken on <date>, rebuilt from the store.
+
+        Raise KeyError if there is no scan from <date>.
+        """
+        dates = self.get_dates()
+        if date not in dates:
+            raise KeyError(date)
+        end = dates.index(date)
+        start = end
+        while not self._entries[start]['file'].endswith('.snap'):
+            start -= 1
+
+        with load_snapshot(os.path.join(self.path,
+                                        self._entries[start]['file'])) as snap:
+            tree = snap.to_tree()
+        for entry in self._entries[start + 1:end + 1]:
+            with gzip.open(os.path.join(self.path, entry['file']), 'rt',
+                           encoding='ascii') as file:
+                _apply(tree, json.load(file)['edits'])
+        return tree
+
+
+def _delta(old: TMTree, new: TMTree, path: List[str],
+           edits: List[list]) -> None:
+    """Append to <edits> the edits that turn <old> into <new>, the same file
+    or folder at <path> in two scans. Trees with the same size and
+    modification time are taken to be the same and not looked into.
+
+    Each edit is one of:
+        ['set', path, data_size, mtime]
+        ['add', path of the parent, the new tree as from _encode]
+        ['remove', path]
+    """
+    if old.data_size == new.data_size and old._mtime == new._mtime:
+        return
+    edits.append(['set', path, new.data_size, new._mtime])
+    if not old._subtrees or not new._subtrees:
+        if old._subtrees or new._subtrees:
+            # A file became a folder, or the other way around.
+            edits.extend(['remove', path + [sub._name]]
+                         for sub in old._subtrees)
+            edits.extend(['add', path, _encode(sub)] for sub in new._subtrees)
+        return
+
+    old_children = {sub._name: sub for sub in old._subtrees}
+    for sub in new._subtrees:
+        match = old_children.pop(sub._name, None)
+        if match is None:
+            edits.append(['add', path, _encode(sub)])
+        else:
+            _delta(match, sub, path + [sub._name], edits)
+    edits.extend(['remove', path + [name]] for name in old_children)
+
+
+def _encode(tree: TMTree) -> list:
+    """Return <tree> as nested lists of [name, data_size, mtime, subtrees].
+    """
+    return [tree._name, tree.data_size, tree._mtime,
+            [_encode(sub) for sub in tree._subtrees]]
+
+
+def _decode(encoded: list) -> FileSystemTree:
+    name, size, mtime, subtrees = encoded
+    return FileSystemTree.from_parts(name, [_decode(sub) for sub in subtrees],
+                                     size, mtime)
+
+
+def _apply(tree: FileSystemTree, edits: List[list]) -> None:
+    """Make the <edits> made by _delta to <tree>.
+    """
+    # The children of each folder looked into, by name. The folder itself is
+    # kept with them, so its id is not reused while it is in the cache.
+    children: Dict[int, Tuple[TMTree, Dict[str, TMTree]]] = {}
+
+    def named(node: TMTree) -> Dict[str, TMTree]:
+        if id(node) not in children:
+            children[id(node)] = \
+                node, {sub._name: sub for sub in node._subtrees}
+        return children[id(node)][1]
+
+    def find(path: List[str]) -> TMTree:
+        node = tree
+        for name in path:
+            node = named(node)[name]
+        return node
+
+    for edit in edits:
+        if edit[0] == 'set':
+            node = find(edit[1])
+            node.data_size, node._mtime = edit[2], edit[3]
+        elif edit[0] == 'add':
+            parent = find(edit[1])
+            child = _decode(edit[2])
+            child._parent_tree = parent
+            parent._subtrees.append(child)
+            named(parent)[child._name] = child
+        else:
+            child = find(edit[1])
+            parent = child._parent_tree
+            parent._subtrees.discard(child)
+            child._parent_tree = None
+            del named(parent)[child._name]
+
+
+def blend(old: Optional[TMTree], new: Optional[TMTree], t: float
+          ) -> FileSystemTree:
+    """Return a tree part of the way, <t> from 0 to 1, from <old> to <new>,
+    two scans of the same folder, for animating from one to the other.
+
+    Files and folders are matched by name. Each is sized in proportion
+    between its sizes in the two scans, counting as 0 in the scan it is
+    missing from, and is expanded if it is expanded in the scan it is in,
+    preferring <new>. Only expanded folders are looked into, so the result is
+    about as big as what is on display.
+    >>> old = FileSystemTree.from_parts('root', [
+    ...     FileSystemTree.from_parts('a', [], 10),
+    ...     FileSystemTree.from_parts('b', [], 4)])
+    >>> new = FileSystemTree.from_parts('root', [
+    ...     FileSystemTree.from_parts('a', [], 20),
+    ...     FileSystemTree.from_parts('c', [], 8)])
+    >>> new.expand()
+    >>> halfway = blend(old, new, 0.5)
+    >>> [(sub._name, sub.data_size) for sub in halfway._subtrees]
+    [('a', 15), ('c', 4), ('b', 2)]
+    """
+    shown = new if new is not None else old
+    if not shown._expanded:
+        old_size = 0 if old is None else old.data_size
+        new_size = 0 if new is None else new.data_size
+        return FileSystemTree.from_parts(
+            shown._name, [], round(old_size + (new_size - old_size) * t))
+
+    old_children = {} if old is None else \
+        {sub._name: sub for sub in old._subtrees}
+    subtrees = []
+    for sub in new._subtrees if new is not None else []:
+        subtrees.append(blend(old_children.pop(sub._name, None), sub, t))
+    for sub in old_children.values():
+        subtrees.append(blend(sub, None, t))
+    tree = FileSystemTree.from_parts(shown._name, subtrees)
+    tree._expanded = True
+    return tree
+
+
+def copy_expansion(old: TMTree, new: TMTree) -> None:
+    """Expand the files and folders in <new> that are expanded in <old>, a
+    scan of the same folder, matching them by name.
+    """
+    if not old._expanded or not new._subtrees:
+        return
+    new._expanded = True
+    old_children = {sub._name: sub for sub in old._subtrees}
+    for sub in new._subtrees:
+        if sub._name in old_children:
+            copy_expansion(old_children[sub._name], sub)
@@ -0,0 +1,218 @@
+"""How much memory trees take, and where it goes.
+
+memory_report measures a random sample of the trees in a whole tree with
+sys.getsizeof, attribute by attribute, and scales it up, so it costs about the
+same on a tree of ten million files as on one of ten thousand. Objects shared
+between trees, such as names that are the same string, are counted only once
+in the sample. Colours are only kept once a tree has been drawn, so the colour
+of a tree not drawn yet is counted as what it will take once it is. Each kind of tree is also compared with its size in a snapshot
+file, the most compact form trees are kept in.
+
+trace_build checks the estimate against what was actually allocated while
+building a tree, using tracemalloc; give it something small to build, such as
+one folder of a big disk, since tracing slows every allocation down.
+
+From the command line:
+
+    python memory.py PATH [--sample N] [--trace]
+"""
+from __future__ import annotations
+
+import argparse
+import random
+import sys
+import tracemalloc
+from typing import Callable, Dict, Iterator, List, Optional, Set, Tuple
+
+from colours import ColourPolicy, PathColours
+from papers import PaperTree
+from snapshots import RECORD_SIZE, STRING_OFFSET_SIZE
+from tm_trees import TMTree, FileSystemTree
+
+# The parts of a tree memory is reported for, in the order they are shown.
+# 'object' is the tree object and its attribute dictionary, and 'other' is
+# every attribute not listed.
+PARTS = ['object', 'rect', 'colour', 'name', 'subtrees', 'authors', 'doi',
+         'metrics', 'other']
+
+# The attribute behind each part that is one attribute.
+_ATTRIBUTES = {'rect': 'rect', '_colour': 'colour', '_name': 'name',
+               '_subtrees': 'subtrees', 'authors': 'authors', 'doi': 'doi',
+               '_metrics': 'metrics'}
+
+Report = Dict[str, Dict[str, float]]
+
+
+def memory_report(tree: TMTree, sample: int = 10000, seed: int = 0) -> Report:
+    """Return the memory taken by the trees in <tree>, by kind of tree: for
+    each, how many there are ('count'), the bytes per tree for each part in
+    PARTS and in all ('total'), and the bytes per tree in a snapshot
+    ('compact').
+
+    Only <sample> trees, picked at random with <seed>, are measured.
+    >>> tree = TMTree('root', [TMTree('a.txt', [], 10), TMTree('b', [], 5)])
+    >>> report = memory_report(tree)
+    >>> report['TMTree']['count']
+    3
+    >>> report['TMTree']['total'] > report['TMTree']['compact'] > 0
+    True
+    """
+    count = sum(1 for _ in _walk(tree))
+    rng = random.Random(seed)
+    chosen = set(rng.sample(range(count), min(sample, count)))
+    measured: Dict[str, Dict[str, float]] = {}
+    counts: Dict[str, int] = {}
+    seen: Set[int] = set()
+    policy = tree._root()._colour_policy or PathColours()
+    # The colours worked out for the report, kept so that no other object
+    # measured can take the id of one in <seen>.
+    colours: List[Tuple[int, int, int]] = []
+    for i, node in enumerate(_walk(tree)):
+        kind = type(node).__name__
+        counts[kind] = counts.get(kind, 0) + 1
+        if i in chosen:
+            parts = measured.setdefault(
+                kind, dict.fromkeys(PARTS + ['compact', 'sampled'], 0.0))
+            _measure(node, parts, seen, policy, colours)
+            parts['sampled'] += 1
+
+    report = {}
+    for kind, parts in sorted(measured.items()):
+        sampled = parts.pop('sampled')
+        report[kind] = {part: size / sampled for part, size in parts.items()}
+        report[kind]['total'] = sum(report[kind][part] for part in PARTS)
+        report[kind]['count'] = counts[kind]
+    return report
+
+
+def _walk(tree: TMTree) -> Iterator[TMTree]:
+    stack = [tree]
+    while stack:
+        tree = stack.pop()
+        yield tree
+        stack.extend(tree._subtrees)
+
+
+def _measure(node: TMTree, parts: Dict[str, float], seen: Set[int],
+             policy: ColourPolicy, colours: List[Tuple[int, int, int]]
+             ) -> None:
+    """Add the bytes taken by <node>, and by each of its attributes that is
+    not in <seen>, to <parts>, and add the attributes to <seen>.
+
+    If <node> has no colour yet, add what the colour <policy> gives it will
+    take instead, without giving it to <node>, and add that to <colours>.
+    """
+    attributes = vars(node)
+    if '_colour' not in attributes:
+        colour = policy.colour(node)
+        colours.append(colour)
+        parts['colour'] += _deep_size(colour, seen)
+    parts['object'] += sys.getsizeof(node) + sys.getsizeof(attributes)
+    for attribute, value in attributes.items():
+        part = _ATTRIBUTES.get(attribute, 'other')
+        parts[part] += _deep_size(value, seen)
+        if attribute == '_subtrees':
+            positions = getattr(value, '_positions', None)
+            parts[part] += _deep_size(positions, seen)
+
+    strings = [node._name or '', getattr(node, 'authors', ''),
+               getattr(node, 'doi', '')]
+    parts['compact'] += RECORD_SIZE + sum(
+        len(string.encode('utf-8', 'surrogateescape')) + STRING_OFFSET_SIZE
+        for string in strings if string)
+
+
+def _deep_size(value: object, seen: Set[int]) -> int:
+    """Return the bytes taken by <value>, and by the numbers and strings in
+    it if it is a tuple, not counting anything in <seen> or shared by the
+    whole program, and add what was counted to <seen>.
+
+    Trees are never counted here, since each is measured in its own right.
+    """
+    if value is None or isinstance(value, (bool, TMTree)) or id(value) in seen:
+        return 0
+    if isinstance(value, int) and -5 <= value <= 256:
+        return 0  # Python keeps one copy of each small int
+    seen.add(id(value))
+    size = sys.getsizeof(value)
+    if isinstance(value, tuple):
+        size += sum(_deep_size(item, seen) for item in value)
+    return size
+
+
+def trace_build(build: Callable[[], TMTree], limit: int = 10
+                ) -> Tuple[int, int, List[Tuple[str, int]]]:
+    """Return how many trees <build> makes, the bytes allocated while it ran
+    and still in use afterwards, and the <limit> lines of code that allocated
+    the most of them, with how much each allocated.
+    >>> nodes, allocated, lines = trace_build(
+    ...     lambda: TMTree('root', [TMTree(str(i), [], i) for i in range(9)]))
+    >>> nodes, allocated > 0, len(lines) > 0
+    (10, True, True)
+    """
+    was_tracing = tracemalloc.is_tracing()
+    if not was_tracing:
+        tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        tree = build()
+        after = tracemalloc.take_snapshot()
+    finally:
+        if not was_tracing:
+            tracemalloc.stop()
+    statistics = after.compare_to(before, 'lineno')
+    allocated = sum(stat.size_diff for stat in statistics)
+    lines = [(f'{stat.traceback[0].filename}:{stat.traceback[0].lineno}',
+              stat.size_diff) for stat in statistics[:limit]]
+    return sum(1 for _ in _walk(tree)), allocated, lines
+
+
+def format_report(report: Report) -> str:
+    """Return <report> as a table, one row for each kind of tree.
+    """
+    columns = PARTS + ['total', 'compact']
+    rows = [f"{'':16} {'count':>10} " +
+            ' '.join(f'{column:>8}' for column in columns)]
+    for kind, parts in report.items():
+        rows.append(f"{kind:16} {parts['count']:10d} " +
+                    ' '.join(f'{parts[column]:8.1f}' for column in columns))
+        rows.append(f"{'':16} {'':>10} about "
+                    f"{parts['total'] * parts['count'] / 2 ** 20:.1f} MiB, "
+                    f"{parts['compact'] * parts['count'] / 2 ** 20:.1f} MiB "
+                    f"as a snapshot")
+    return '\n'.join(rows)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """Entry point for the command line.
+    """
+    parser = argparse.ArgumentParser(
+        description='Report how much memory the tree of a folder or papers '
+                    'CSV file takes, in bytes per tree.')
+    parser.add_argument('source', help='a folder, or a papers CSV file')
+    parser.add_argument('--sample', type=int, default=10000,
+                        help='trees to measure (default 10000)')
+    parser.add_argument('--trace', action='store_true',
+                        help='also trace the allocations made while '
+                             'building the tree, which is much slower')
+    args = parser.parse_args(argv)
+
+    if args.source.lower().endswith('.csv'):
+        def build() -> TMTree:
+            return PaperTree('papers', [], all_papers=True, by_year=False,
+                             data_file=args.source)
+    else:
+        def build() -> TMTree:
+            return FileSystemTree(args.source)
+
+    if args.trace:
+        nodes, allocated, lines = trace_build(build)
+        print(f'{allocated / nodes:.1f} bytes allocated per tree while '
+              f'building {nodes} trees, most of them by:')
+        for line, size in lines:
+            print(f'  {size:12d}  {line}')
+    print(format_report(memory_report(build(), args.sample)))
+
+
+if __name__ == '__main__':
+    main()
@@ -32,7 +32,11 @@ class PaperTree(TMTree):
 
     === Representation Invariants ===
     - All TMTree RIs are inherited.
+
+    A tree can be sized by the citations of its papers, or by the number of
+    papers in it; see set_metric.
     """
+    METRICS = ('citations', 'papers')
 
     name: str
     subtrees: List[TMTree]
@@ -42,13 +46,13 @@ class PaperTree(TMTree):
 
     def __init__(self, name: str, subtrees: List[TMTree], authors: str = '',
                  doi: str = '', citations: int = 0, by_year: bool = True,
-                 all_papers: bool = False) -> None:
+                 all_papers: bool = False, data_file: str = DATA_FILE) -> None:
         """Initialize a new PaperTree with the given <name> and <subtrees>,
         <authors> and <doi>, and with <citations> as the size of the data.
 
         If <all_papers> is True, then this tree is to be the root of the paper
-        tree. In that case, load data about papers from DATA_FILE to build the
-        tree.
+        tree. In that case, load data about papers from <data_file> to build
+        the tree.
 
         If <all_papers> is False, Do NOT load new data.
 
@@ -58,7 +62,7 @@ class PaperTree(TMTree):
         """
         if all_papers:
             subtrees = _build_tree_from_dict(
-                ([], _load_papers_to_dict(by_year)))
+                ([], _load_papers_to_dict(by_year, data_file)))
 
         TMTree.__init__(self, name, subtrees, citations)
         self.authors = authors
@@ -82,7 +86,7 @@ class PaperTree(TMTree):
         else:
             components.append('category')
             components.append(f'{len(self._subtrees)} items')
-        components.append(f'{self.data_size} citations')
+        components.append(f'{self.data_size} {self.get_metric()}')
         return f' ({", ".join(components)})'
 
 
@@ -98,11 +102,16 @@ def _build_tree_from_dict(subtrees: tuple[list, dict]) -> list[PaperTree]:
     return tree
 
 
-def _load_papers_to_dict(by_year: bool = True) -> Dict:
-    """Return a nested dictionary of the data read from the papers dataset file.
+def _load_papers_to_dict(by_year: bool = True,
+                         data_file: str = DATA_FILE) -> Dict:
+    """Return a nested dictionary of the data read from the papers dataset file
+    <data_file>.
 
     If <by_year>, then use years as the roots of the subtrees of the root of
     the whole tree. Otherwise, ignore years and use categories only.
+
+    Years, categories and authors that appear on many lines are shared, so
+    the trees built from the dictionary share them too.
     """
 
     def _load_papers_helper(diction: dict[str, tuple], lst: list[str]) -> None:
@@ -114,12 +123,18 @@ def _load_papers_to_dict(by_year: bool = True) -> Dict:
                 diction[lst[0]][0].append(lst[1])
 
     dic = {}
-    with open(DATA_FILE, newline="") as file:
+    # Each year, category and author read, so one that turns up on many
+    # lines is kept once. Titles and urls are each paper's own.
+    names = {}
+    with open(data_file, newline="") as file:
         file.readline()
         rows = csv.reader(file)  # a nested list containing lists of each line
         for line in rows:
             author, title, year, categories, url, cite = line
-            categories = categories.split(": ")
+            author = names.setdefault(author, author)
+            year = names.setdefault(year, year)
+            categories = [names.setdefault(category, category)
+                          for category in categories.split(": ")]
             if by_year:
                 _load_papers_helper(dic, [year] + categories + [
                     (author, title, url, cite)])
@@ -135,5 +150,5 @@ if __name__ == '__main__':
     python_ta.check_all(config={
         'allowed-import-modules': ['python_ta', 'typing', 'csv', 'tm_trees'],
         'allowed-io': ['_load_papers_to_dict'],
-        'max-args': 8
+        'max-args': 9
     })
@@ -0,0 +1,230 @@
+"""Timers and counters for finding out where the time of each frame goes.
+
+A Profiler times named stages of each frame, such as laying the treemap out,
+hit-testing the mouse position and drawing, and counts things such as the
+trees visited and the rectangles drawn. It keeps averages over the last few
+frames for display, and every stage it timed as a trace that can be saved as
+JSON in the Trace Event Format, to be opened in chrome://tracing or Perfetto.
+
+Nothing is timed or counted until a Profiler is made and used: TMTree only
+reports to one after Profiler.instrument has been called, and stops when
+Profiler.uninstrument is.
+"""
+from __future__ import annotations
+
+import functools
+import json
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable, Deque, Dict, Iterator, List, Tuple
+
+from tm_trees import TMTree
+
+# The TMTree methods timed by instrument, with the stage each one is timed as.
+TIMED_METHODS = {'update_rectangles': 'layout',
+                 'get_tree_at_position': 'hit_test',
+                 'get_rectangles': 'rectangles',
+                 'get_rectangle_arrays': 'rectangles'}
+
+# The TMTree methods called once for every tree visited, with the counter
+# each call adds to.
+COUNTED_METHODS = {'_update_rectangles': 'layout_nodes',
+                   '_get_tree_at_position': 'hit_test_nodes'}
+
+# The most stage timings kept for the trace; older ones are dropped first.
+MAX_TRACE_EVENTS = 200000
+
+
+class Profiler:
+    """Times the stages of each frame, and counts what was done in them.
+
+    === Public Attributes ===
+    window:
+        How many of the latest frames are averaged by get_summary.
+
+    === Private Attributes ===
+    _frames:
+        For each of the latest frames: its length in seconds, the seconds
+        spent in each stage, and the counters.
+    _stages:
+        The seconds spent in each stage so far in this frame.
+    _counters:
+        The counters so far in this frame.
+    _events:
+        When each of the latest events happened, by time.perf_counter.
+    _frame_start:
+        When this frame started, by time.perf_counter.
+    _depth:
+        How many stages are running inside one another. Only the outermost
+        call of a stage is timed, so recursive methods count once.
+    _trace:
+        The trace events of the stages timed so far.
+    _originals:
+        The methods replaced by instrument, by class and name, so that
+        uninstrument can put them back.
+    """
+    window: int
+    _frames: Deque[Tuple[float, Dict[str, float], Dict[str, int]]]
+    _stages: Dict[str, float]
+    _counters: Dict[str, int]
+    _events: Deque[float]
+    _frame_start: float
+    _depth: Dict[str, int]
+    _trace: Deque[dict]
+    _originals: Dict[Tuple[type, str], Callable]
+
+    def __init__(self, window: int = 60) -> None:
+        self.window = window
+        self._frames = deque(maxlen=window)
+        self._stages = {}
+        self._counters = {}
+        self._events = deque()
+        self._frame_start = time.perf_counter()
+        self._depth = {}
+        self._trace = deque(maxlen=MAX_TRACE_EVENTS)
+        self._originals = {}
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """Return a context manager that adds the time spent inside it to the
+        stage called <name> in this frame.
+        """
+        depth = self._depth.get(name, 0)
+        self._depth[name] = depth + 1
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._depth[name] = depth
+            if depth == 0:
+                end = time.perf_counter()
+                self._stages[name] = self._stages.get(name, 0.0) + end - start
+                self._trace.append({'name': name, 'ph': 'X', 'pid': 0,
+                                    'tid': 0, 'ts': start * 1e6,
+                                    'dur': (end - start) * 1e6})
+
+    def count(self, name: str, amount: int = 1) -> None:
+        """Add <amount> to the counter called <name> in this frame.
+        """
+        self._counters[name] = self._counters.get(name, 0) + amount
+
+    def event(self) -> None:
+        """Record that an input event was handled now.
+        """
+        now = time.perf_counter()
+        self._events.append(now)
+        while now - self._events[0] > 1:
+            self._events.popleft()
+
+    def end_frame(self) -> None:
+        """End this frame, and start the next one.
+        """
+        now = time.perf_counter()
+        self._frames.append((now - self._frame_start, self._stages,
+                             self._counters))
+        self._trace.append({'name': 'frame', 'ph': 'C', 'pid': 0, 'tid': 0,
+                            'ts': now * 1e6, 'args': dict(self._counters)})
+        self._frame_start = now
+        self._stages = {}
+        self._counters = {}
+
+    def get_summary(self) -> Dict[str, float]:
+        """Return, averaged over the latest frames: the length of a frame and
+        the time spent in each stage, in milliseconds, as 'frame_ms' and
+        '<stage>_ms'; and every counter per frame. Also return the number of
+        frames per second, as 'fps', and the number of input events in the
+        last second, as 'events_per_second'.
+        >>> profiler = Profiler()
+        >>> with profiler.stage('layout'):
+        ...     profiler.count('layout_nodes', 10)
+        >>> profiler.end_frame()
+        >>> summary = profiler.get_summary()
+        >>> summary['layout_nodes'], summary['layout_ms'] <= summary['frame_ms']
+        (10.0, True)
+        """
+        frames = len(self._frames)
+        if not frames:
+            return {}
+        summary = {'frame_ms': 1000 * sum(f[0] for f in self._frames)
+                   / frames}
+        for _, stages, counters in self._frames:
+            for name, seconds in stages.items():
+                key = name + '_ms'
+                summary[key] = summary.get(key, 0.0) + 1000 * seconds / frames
+            for name, amount in counters.items():
+                summary[name] = summary.get(name, 0.0) + amount / frames
+        summary['fps'] = 1000 / summary['frame_ms'] \
+            if summary['frame_ms'] else 0.0
+        now = time.perf_counter()
+        summary['events_per_second'] = sum(1 for t in self._events
+                                           if now - t <= 1)
+        return summary
+
+    def get_lines(self) -> List[str]:
+        """Return get_summary as lines of text for an overlay: the frame
+        first, then the stages, then the counters.
+        """
+        summary = self.get_summary()
+        if not summary:
+            return []
+        lines = [f"frame {summary.pop('frame_ms'):7.1f} ms  "
+                 f"{summary.pop('fps'):3.0f} fps  "
+                 f"{summary.pop('events_per_second'):3.0f} events/s"]
+        stages = sorted(name for name in summary if name.endswith('_ms'))
+        lines.extend(f'{name[:-3]:16} {summary.pop(name):7.2f} ms'
+                     for name in stages)
+        lines.extend(f'{name:16} {value:9.0f}'
+                     for name, value in sorted(summary.items()))
+        return lines
+
+    def save_trace(self, filename: str) -> None:
+        """Save every stage timed so far, and the counters of every frame, to
+        <filename> as JSON in the Trace Event Format.
+        """
+        with open(filename, 'w') as file:
+            json.dump({'traceEvents': list(self._trace),
+                       'displayTimeUnit': 'ms'}, file)
+
+    def instrument(self, cls: type = TMTree) -> None:
+        """Time the TIMED_METHODS and count calls to the COUNTED_METHODS of
+        <cls> and its subclasses with this profiler, until uninstrument is
+        called.
+
+        Counting slows the counted methods down, and so the stages they are
+        called in, but methods are only ever replaced while profiling.
+        """
+        for name, stage in TIMED_METHODS.items():
+            self._replace(cls, name, functools.partial(_timed, self, stage))
+        for name, counter in COUNTED_METHODS.items():
+            self._replace(cls, name,
+                          functools.partial(_counted, self, counter))
+
+    def uninstrument(self) -> None:
+        """Put back the methods replaced by instrument.
+        """
+        for (cls, name), method in self._originals.items():
+            setattr(cls, name, method)
+        self._originals = {}
+
+    def _replace(self, cls: type, name: str,
+                 wrap: Callable[[Callable], Callable]) -> None:
+        if (cls, name) not in self._originals:
+            self._originals[cls, name] = getattr(cls, name)
+            setattr(cls, name, wrap(getattr(cls, name)))
+
+
+def _timed(profiler: Profiler, stage: str, method: Callable) -> Callable:
+    @functools.wraps(method)
+    def timed(*args: object, **kwargs: object) -> object:
+        with profiler.stage(stage):
+            return method(*args, **kwargs)
+    return timed
+
+
+def _counted(profiler: Profiler, counter: str, method: Callable) -> Callable:
+    @functools.wraps(method)
+    def counted(*args: object, **kwargs: object) -> object:
+        profiler.count(counter)
+        return method(*args, **kwargs)
+    return counted
@@ -0,0 +1,246 @@
+"""Building trees from listings of files, instead of scanning them.
+
+A listing is any iterable of (path, size) or (path, size, mtime) records,
+with paths separated by / and mtime in nanoseconds since the epoch. A path
+ending in / is a folder, which may be empty. Records are read one at a time,
+so a listing can be streamed from a file, a pipe or a database cursor, and
+can be in any order.
+
+The parsers here turn the usual listings into records:
+
+    du -ab PATH                                    parse_du
+    find PATH -printf '%y\\t%s\\t%T@\\t%p\\n'         parse_find
+    a CSV file with a header row                   parse_csv
+    an S3 inventory CSV file                       parse_s3_inventory
+
+From the command line of the visualiser:
+
+    python treemap_visualiser.py LISTING --records du
+"""
+from __future__ import annotations
+
+import csv
+import datetime
+import gzip
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, \
+    Tuple, Union
+from urllib.parse import unquote_plus
+
+from tm_trees import TMTree, FileSystemTree
+
+# A file or folder: its path, its size and optionally when it was last
+# modified, in nanoseconds since the epoch.
+Record = Union[Tuple[str, int], Tuple[str, int, int]]
+
+# The fields of each line of an S3 inventory CSV file, as listed by the
+# fileSchema of its manifest, when only the size and modification time were
+# asked for besides the bucket and key.
+S3_INVENTORY_FIELDS = ['Bucket', 'Key', 'Size', 'LastModifiedDate']
+
+
+def build_tree(records: Iterable[Record], name: Optional[str] = None,
+               separator: str = '/', cls: type = FileSystemTree) -> TMTree:
+    """Return the tree of the files and folders in <records>, made of trees
+    of class <cls>, with the paths separated by <separator>.
+
+    The root is called <name>. If <name> is None, the root is the folder
+    every record is in, if there is one such folder, or else a folder called
+    ''.
+
+    Every folder is made once, the first time a path in it is read, and
+    found again by its path after that. Trees with the same name share one
+    copy of it. The sizes of the folders are added up
+    in one pass at the end. A record for a folder that already has files in
+    it, such as du lists after them, is skipped; a file must not also be the
+    folder of another record.
+
+    <cls> must be a subclass of TMTree whose trees need nothing more than
+    TMTree.__init__ gives them, and _mtime if it is a FileSystemTree.
+    >>> tree = build_tree([('data/a/x.txt', 5), ('data/b.txt', 7),
+    ...                    ('data/a/y.txt', 1, 10 ** 9), ('data/empty/', 0),
+    ...                    ('data/a', 4096)])
+    >>> tree._name, tree.data_size
+    ('data', 13)
+    >>> [(sub._name, sub.data_size) for sub in tree._subtrees]
+    [('a', 6), ('b.txt', 7), ('empty', 0)]
+    >>> tree._mtime
+    1000000000
+    """
+    with_mtime = issubclass(cls, FileSystemTree)
+    # Each name read, so a name in many folders is kept once.
+    names: Dict[str, str] = {}
+
+    def new(tree_name: str, size: int, mtime: int) -> TMTree:
+        # Made with no subtrees, so there is nothing to add up yet.
+        tree = cls.__new__(cls)
+        TMTree.__init__(tree, names.setdefault(tree_name, tree_name), [],
+                        size)
+        if with_mtime:
+            tree._mtime = mtime
+        return tree
+
+    root = new('' if name is None else name, 0, 0)
+    # Every folder made so far, by its path; insertion order puts every
+    # folder after the folder it is in.
+    folders: Dict[str, TMTree] = {'': root}
+
+    def folder(path: str) -> TMTree:
+        missing = []
+        tree = folders.get(path)
+        while tree is None:
+            missing.append(path)
+            path = path.rpartition(separator)[0]
+            tree = folders.get(path)
+        for path in reversed(missing):
+            child = new(path.rpartition(separator)[2], 0, 0)
+            child._parent_tree = tree
+            tree._subtrees.append(child)
+            folders[path] = child
+            tree = child
+        return tree
+
+    for record in records:
+        path, size = record[0], record[1]
+        mtime = record[2] if len(record) > 2 else 0
+        if path.startswith('./'):
+            path = path[2:]
+        is_folder = path.endswith(separator)
+        path = path.strip(separator)
+        if not path or path == '.':
+            continue
+        if is_folder:
+            folder(path)
+            continue
+        if path in folders:
+            continue
+        head, _, tail = path.rpartition(separator)
+        parent = folders.get(head)
+        if parent is None:
+            parent = folder(head)
+        leaf = new(tail, size, mtime)
+        leaf._parent_tree = parent
+        parent._subtrees.append(leaf)
+        parent.data_size += size
+        if with_mtime and mtime > parent._mtime:
+            parent._mtime = mtime
+
+    # Every folder comes before the folders in it, so going backwards adds
+    # up each folder before the folder it is in.
+    for tree in reversed(folders.values()):
+        parent = tree._parent_tree
+        if parent is not None:
+            parent.data_size += tree.data_size
+            if with_mtime and tree._mtime > parent._mtime:
+                parent._mtime = tree._mtime
+
+    if name is None and len(root._subtrees) == 1 and \
+            root._subtrees[0]._subtrees:
+        root = root._subtrees[0]
+        root._parent_tree = None
+    return root
+
+
+def parse_du(lines: Iterable[str], unit: int = 1) -> Iterator[Record]:
+    """Yield the records listed in <lines> of the output of du -a, where each
+    size is in units of <unit> bytes: 1 for du -ab, and 1024 for du -ak.
+    >>> list(parse_du(['12\\tdata/a.txt\\n', '4108\\tdata\\n']))
+    [('data/a.txt', 12), ('data', 4108)]
+    """
+    for line in lines:
+        size, _, path = line.rstrip('\n').partition('\t')
+        if path:
+            yield path, int(size) * unit
+
+
+def parse_find(lines: Iterable[str]) -> Iterator[Record]:
+    """Yield the records listed in <lines> of the output of
+    find PATH -printf '%y\\t%s\\t%T@\\t%p\\n', which gives the type, size,
+    modification time and path of every file and folder. Anything that is
+    neither a regular file nor a folder, such as a link, is skipped.
+    >>> list(parse_find(['d\\t4096\\t1.5\\tdata\\n', 'f\\t12\\t2.0\\tdata/a\\n']))
+    [('data/', 0, 1500000000), ('data/a', 12, 2000000000)]
+    """
+    for line in lines:
+        fields = line.rstrip('\n').split('\t', 3)
+        if len(fields) < 4:
+            continue
+        kind, size, mtime, path = fields
+        if kind == 'f':
+            yield path, int(size), _parse_time(mtime)
+        elif kind == 'd':
+            yield path + '/', 0, _parse_time(mtime)
+
+
+def parse_csv(lines: Iterable[str], path: Union[str, Sequence[str]] = 'path',
+              size: str = 'size', mtime: Optional[str] = None,
+              fieldnames: Optional[List[str]] = None, unquote: bool = False
+              ) -> Iterator[Record]:
+    """Yield the records in the CSV file with the given <lines>, such as an
+    export from a database.
+
+    Each record's path is in the field called <path>, or is the fields in
+    <path> joined by /; its size is in the field <size>; and its
+    modification time, if <mtime> is given, is in the field <mtime>, in
+    seconds since the epoch or as an ISO 8601 date. The first line names the
+    fields, unless <fieldnames> are given. If <unquote>, the paths are
+    URL-encoded.
+    >>> list(parse_csv(['name,bytes\\n', 'a/b.txt,10\\n'], 'name', 'bytes'))
+    [('a/b.txt', 10)]
+    """
+    fields = [path] if isinstance(path, str) else list(path)
+    for row in csv.DictReader(lines, fieldnames):
+        record_path = '/'.join(row[field] for field in fields)
+        if unquote:
+            record_path = unquote_plus(record_path)
+        if mtime is None:
+            yield record_path, int(row[size] or 0)
+        else:
+            yield record_path, int(row[size] or 0), _parse_time(row[mtime])
+
+
+def parse_s3_inventory(lines: Iterable[str],
+                       fieldnames: Optional[List[str]] = None
+                       ) -> Iterator[Record]:
+    """Yield the objects in the lines of an S3 inventory CSV file, with paths
+    starting with their bucket. The file has no header row, so its fields are
+    <fieldnames>, as listed in its manifest, or S3_INVENTORY_FIELDS.
+    >>> list(parse_s3_inventory(
+    ...     ['"logs","2024/a+b.gz","5","1970-01-01T00:00:01.000Z"\\n']))
+    [('logs/2024/a b.gz', 5, 1000000000)]
+    """
+    return parse_csv(lines, ('Bucket', 'Key'), 'Size', 'LastModifiedDate',
+                     fieldnames or S3_INVENTORY_FIELDS, unquote=True)
+
+
+# The parsers load_records can use, by the name of the format they read.
+FORMATS = {'du': parse_du, 'find': parse_find, 'csv': parse_csv,
+           's3': parse_s3_inventory}
+
+
+def load_records(filename: str, kind: str, name: Optional[str] = None
+                 ) -> TMTree:
+    """Return the tree of the listing in the file <filename>, which is in
+    the format <kind>, one of FORMATS, and may be compressed with gzip. The
+    root is called <name>, as for build_tree.
+    """
+    opener = gzip.open if filename.endswith('.gz') else open
+    with opener(filename, 'rt', newline='', encoding='utf-8',
+                errors='surrogateescape') as file:
+        return build_tree(FORMATS[kind](file), name)
+
+
+def _parse_time(text: str) -> int:
+    """Return the time <text>, in seconds since the epoch or as an ISO 8601
+    date, in nanoseconds since the epoch, or 0 if it is empty.
+    >>> _parse_time('1.25'), _parse_time('1970-01-01T00:00:02Z')
+    (1250000000, 2000000000)
+    """
+    if not text:
+        return 0
+    try:
+        return round(float(text) * 10 ** 9)
+    except ValueError:
+        date = datetime.datetime.fromisoformat(text)
+        if date.tzinfo is None:
+            date = date.replace(tzinfo=datetime.timezone.utc)
+        return round(date.timestamp() * 10 ** 9)
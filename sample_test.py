@@ -1,9 +1,32 @@
+import io
+import json
 import os
-
+import pickle
+import sys
+import tarfile
+import threading
+import time
+import zipfile
+from urllib.error import HTTPError
+from urllib.request import urlopen
+
+import pytest
 from hypothesis import given
 from hypothesis.strategies import integers
+from benchmarks import compare_results, name_memory, run_benchmarks
+from colours import CategoryColours, DiffColours, PathColours, SizeColours
+from diffs import diff_trees
+from duplicates import find_duplicates, reclaimable
+from history import SnapshotStore
+from memory import PARTS, memory_report
 from papers import PaperTree
-from tm_trees import TMTree, FileSystemTree
+from profiling import Profiler
+from records import build_tree, parse_du, parse_find, parse_s3_inventory
+from scan_rules import COMMON_EXCLUDES, SKIPPED_NAME, ScanRules
+from shards import merge_shards, merge_trees
+from snapshots import load_snapshot, save_snapshot
+from tm_trees import TMTree, FileSystemTree, ArchiveTree, BackgroundScan, \
+    replay_journal
 
 # This should be the path to the "workshop" folder in the sample data.
 # You may need to modify this, depending on where you downloaded and
@@ -718,6 +741,1048 @@ def test_change_size_low(x: int) -> None:
     assert tree.data_size == 1
 
 
+def test_iter_rectangles_paper() -> None:
+    tree = PaperTree('CS1', [], all_papers=True, by_year=True)
+    tree.expand_all()
+    tree.update_rectangles((0, 0, 1500, 900))
+    assert list(tree.iter_rectangles()) == tree.get_rectangles()
+
+
+def test_iter_rectangles_clip() -> None:
+    tree = PaperTree('CS1', [], all_papers=True, by_year=True)
+    tree.expand_all()
+    tree.update_rectangles((0, 0, 1500, 900))
+    clip = (0, 0, 300, 200)
+    clipped = list(tree.iter_rectangles(clip))
+    expected = [(rect, colour) for rect, colour in tree.get_rectangles()
+                if rect[0] < 300 and rect[1] < 200
+                and rect[2] > 0 and rect[3] > 0]
+    assert clipped == expected
+    assert 0 < len(clipped) < 428
+
+
+def test_get_rectangle_arrays_paper() -> None:
+    np = pytest.importorskip('numpy')
+    tree = PaperTree('CS1', [], all_papers=True, by_year=True)
+    tree.expand_all()
+    tree.update_rectangles((0, 0, 1500, 900))
+    rects, colours = tree.get_rectangle_arrays()
+    assert rects.shape == (428, 4) and rects.dtype == np.int32
+    assert colours.shape == (428, 3) and colours.dtype == np.uint8
+    assert [(tuple(r), tuple(c)) for r, c in
+            zip(rects.tolist(), colours.tolist())] == tree.get_rectangles()
+
+
+def test_fill_rectangles_matches_draw(monkeypatch) -> None:
+    pytest.importorskip('numpy')
+    pygame = pytest.importorskip('pygame')
+    import treemap_visualiser
+    from treemap_visualiser import draw_rectangle_stream, fill_rectangles
+    tree = PaperTree('CS1', [], all_papers=True, by_year=True)
+    tree.expand_all()
+    tree.update_rectangles((0, 0, 300, 200))
+    drawn = pygame.Surface((300, 200))
+    for rect, colour in tree.get_rectangles():
+        pygame.draw.rect(drawn, colour, rect)
+    filled = pygame.Surface((300, 200))
+    fill_rectangles(filled, *tree.get_rectangle_arrays())
+    assert (pygame.surfarray.array3d(drawn)
+            == pygame.surfarray.array3d(filled)).all()
+
+    # Streamed frames look the same whether they are small enough to draw
+    # one at a time or not.
+    for threshold in (1000, 100):
+        monkeypatch.setattr(treemap_visualiser, 'BULK_FILL_THRESHOLD',
+                            threshold)
+        streamed = pygame.Surface((300, 200))
+        assert draw_rectangle_stream(streamed, tree.iter_rectangles()) == \
+            len(tree.get_rectangles())
+        assert (pygame.surfarray.array3d(drawn)
+                == pygame.surfarray.array3d(streamed)).all()
+
+
+def test_render_batch(tmp_path) -> None:
+    pygame = pytest.importorskip('pygame')
+    from treemap_visualiser import main, render_batch
+    folder = tmp_path / 'folder'
+    (folder / 'sub').mkdir(parents=True)
+    (folder / 'a.txt').write_bytes(b'a' * 30)
+    (folder / 'sub' / 'b.txt').write_bytes(b'b' * 10)
+    out = tmp_path / 'out'
+    images = render_batch([str(folder), 'cs1_papers.csv', str(folder)],
+                          str(out), (320, 240), 2, workers=2)
+    assert [os.path.basename(p) for p in images] == \
+        ['folder.png', 'cs1_papers.png', 'folder-1.png']
+    for image in images:
+        assert pygame.image.load(image).get_size() == (320, 240)
+
+    # Rendering from the command line needs no Visualiser made beforehand,
+    # and draws no selection frame around the treemap.
+    main([str(folder), '--out', str(tmp_path / 'main'), '--size', '320x240'])
+    image = pygame.image.load(str(tmp_path / 'main' / 'folder.png'))
+    assert tuple(image.get_at((1, 1)))[:3] != (255, 255, 255)
+
+
+def test_tile_server() -> None:
+    pytest.importorskip('pygame')
+    from tile_server import TileServer
+    tree = PaperTree('CS1', [], all_papers=True, by_year=True)
+    server = TileServer(tree, cache_size=2)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    url = 'http://%s:%d' % server.server_address
+    try:
+        for tile in ['/0/0/0.png', '/1/1/0.png', '/2/3/3.png']:
+            with urlopen(url + tile) as response:
+                assert response.headers['Content-Type'] == 'image/png'
+                assert response.read().startswith(b'\x89PNG')
+        assert len(server.cache) == 2
+        with pytest.raises(HTTPError):
+            urlopen(url + '/1/2/0.png')
+
+        leaf = tree
+        while leaf._subtrees:
+            leaf = leaf._subtrees[0]
+        leaf.change_size(1000)
+        assert server.cache.get((2, 3, 3), server.get_version()) is None
+        assert len(server.cache) == 0
+
+        # Colouring the tree differently renders the tiles again.
+        before = server.get_tile(0, 0, 0)
+        tree.set_colour_policy(SizeColours(tree.data_size))
+        assert server.get_tile(0, 0, 0) != before
+        assert len(server.cache) == 1
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_snapshot_file_system(tmp_path) -> None:
+    folder = tmp_path / 'folder'
+    (folder / 'sub' / 'empty').mkdir(parents=True)
+    (folder / 'a.txt').write_bytes(b'a' * 30)
+    (folder / 'sub' / 'b.txt').write_bytes(b'b' * 10)
+    tree = FileSystemTree(str(folder))
+    _sort_subtrees(tree)
+    save_snapshot(tree, str(tmp_path / 'scan.snap'))
+
+    with load_snapshot(str(tmp_path / 'scan.snap')) as snapshot:
+        assert len(snapshot) == 5
+        assert snapshot.name(0) == 'folder' and snapshot.size(0) == 40
+        assert [snapshot.name(i) for i in snapshot.children(0)] == \
+            ['a.txt', 'sub']
+        sub = snapshot.to_tree(2)
+        assert isinstance(sub, FileSystemTree)
+        assert _describe(sub) == _describe(tree._subtrees[1])
+        assert _describe(snapshot.to_tree()) == _describe(tree)
+
+
+def test_snapshot_papers(tmp_path) -> None:
+    tree = PaperTree('CS1', [], all_papers=True, by_year=True)
+    save_snapshot(tree, str(tmp_path / 'papers.snap'))
+    with load_snapshot(str(tmp_path / 'papers.snap')) as snapshot:
+        copy = snapshot.to_tree()
+    assert isinstance(copy, PaperTree)
+    assert _describe(copy) == _describe(tree)
+
+
+def test_background_scan(tmp_path) -> None:
+    folder = tmp_path / 'folder'
+    (folder / 'sub' / 'deeper').mkdir(parents=True)
+    (folder / 'empty').mkdir()
+    (folder / 'a.txt').write_bytes(b'a' * 30)
+    (folder / 'sub' / 'b.txt').write_bytes(b'b' * 10)
+    (folder / 'sub' / 'deeper' / 'c.txt').write_bytes(b'c' * 5)
+    scan = BackgroundScan(str(folder))
+    assert scan.tree.data_size == 0 and not scan.is_done()
+    scan.start()
+    scan.join()
+    assert scan.apply_updates()
+    assert scan.is_done()
+    assert scan.items_found == 6
+    _sort_subtrees(scan.tree)
+    expected = FileSystemTree(str(folder))
+    _sort_subtrees(expected)
+    assert _describe(scan.tree) == _describe(expected)
+    assert scan.tree._subtrees[2]._parent_tree is scan.tree
+
+
+def test_background_scan_file() -> None:
+    scan = BackgroundScan('cs1_papers.csv')
+    scan.start()
+    assert scan.is_done()
+    assert scan.tree.data_size == os.path.getsize('cs1_papers.csv')
+
+
+def test_concurrent_edits_and_reads() -> None:
+    tree = PaperTree('CS1', [], all_papers=True, by_year=True)
+    tree.enable_concurrency()
+    tree.expand_all()
+    leaves = [leaf for leaf in _leaves(tree)]
+    stop = threading.Event()
+    errors = []
+
+    def edit() -> None:
+        i = 0
+        while not stop.is_set():
+            leaves[i % len(leaves)].change_size(1 if i % 2 else -1)
+            i += 1
+
+    def read() -> None:
+        while not stop.is_set():
+            # Laying out writes every rect, so it is not done while reading.
+            tree.update_rectangles((0, 0, 800, 600))
+            with tree.reading():
+                if not _sizes_consistent(tree):
+                    errors.append('sizes changed while reading')
+            tree.get_tree_at_position((400, 300))
+
+    threads = [threading.Thread(target=edit)] + \
+        [threading.Thread(target=read) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.5)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert _sizes_consistent(tree)
+
+
+def test_edit_while_reading() -> None:
+    tree = TMTree('root', [TMTree('leaf', [], 5)])
+    tree.enable_concurrency()
+    with tree.writing():
+        with tree.reading():
+            tree.update_rectangles((0, 0, 10, 10))
+    with tree.reading():
+        with pytest.raises(RuntimeError):
+            tree._subtrees[0].change_size(1)
+        with pytest.raises(RuntimeError):
+            tree.update_rectangles((0, 0, 20, 20))
+
+
+def _scripted_edits(tree: TMTree) -> None:
+    """Resize, move and delete a spread of trees in <tree>.
+    """
+    leaves = _leaves(tree)
+    for leaf in leaves[::3]:
+        leaf.change_size(7)
+    for leaf in leaves[1::5]:
+        leaf.move(tree._subtrees[-1])
+    for leaf in leaves[2::7]:
+        leaf.delete_self()
+    tree._subtrees[3].delete_self()
+    leaves[0].change_size(-3)
+
+
+def test_batch_matches_single_edits() -> None:
+    expected = PaperTree('CS1', [], all_papers=True, by_year=True)
+    _scripted_edits(expected)
+
+    tree = PaperTree('CS1', [], all_papers=True, by_year=True)
+    tree.expand_all()
+    tree.update_rectangles((0, 0, 800, 600))
+    version = tree.get_version()
+    with tree.batch():
+        with tree.batch():
+            _scripted_edits(tree)
+        assert tree.get_version() == version
+    assert tree.get_version() != version
+    assert _sizes_consistent(tree)
+    assert _describe(tree) == _describe(expected)
+    rects = tree.get_rectangles()
+    tree.update_rectangles((0, 0, 800, 600))
+    assert rects == tree.get_rectangles()
+
+
+def test_subtrees_keep_order_through_many_edits() -> None:
+    leaves = [FileSystemTree.from_parts(str(i), [], i + 1) for i in range(200)]
+    folder = FileSystemTree.from_parts('a', leaves)
+    other = FileSystemTree.from_parts('b', [FileSystemTree.from_parts(
+        'x', [], 1)])
+    root = FileSystemTree.from_parts('root', [folder, other])
+    expected = {'a': [str(i) for i in range(200)], 'b': ['x']}
+
+    for i, leaf in enumerate(leaves):
+        if i % 3 == 0:
+            leaf.delete_self()
+            expected['a'].remove(leaf._name)
+        elif i % 3 == 1:
+            leaf.move(other)
+            expected['a'].remove(leaf._name)
+            expected['b'].append(leaf._name)
+        elif i % 5 == 0:
+            leaf.move(folder)  # to the end of the same folder
+            expected['a'].remove(leaf._name)
+            expected['a'].append(leaf._name)
+        if i % 7 == 0:
+            assert [sub._name for sub in folder._subtrees] == expected['a']
+        assert len(folder._subtrees) == len(expected['a'])
+
+    assert [sub._name for sub in folder._subtrees] == expected['a']
+    assert [sub._name for sub in other._subtrees] == expected['b']
+    assert folder._subtrees[-1]._name == expected['a'][-1]
+    assert folder._subtrees.index(leaves[2]) == expected['a'].index('2')
+    assert leaves[0] not in folder._subtrees
+    assert _sizes_consistent(root)
+
+    # Moving a leaf out of a folder and straight back appends it there.
+    moved = folder._subtrees[0]
+    moved.move(other)
+    moved.move(folder)
+    assert folder._subtrees[-1] is moved
+    with pytest.raises(ValueError):
+        folder._subtrees.discard(leaves[0])
+
+    # Reading skips the placeholders without dropping them, so reads never
+    # change the list.
+    first = folder._subtrees[0]
+    first.delete_self()
+    slots = list.__len__(folder._subtrees)
+    assert first not in folder._subtrees
+    assert [sub._name for sub in reversed(folder._subtrees)][-1] != first._name
+    assert list.__len__(folder._subtrees) == slots
+    # Later reads share one list of the subtrees left.
+    assert folder._subtrees[0] is folder._subtrees._live()[0]
+    assert folder._subtrees._live() is folder._subtrees._live()
+
+    copy = pickle.loads(pickle.dumps(root))
+    assert _describe(copy) == _describe(root)
+    assert [sub._name for sub in copy._subtrees[0]._subtrees] == \
+        [sub._name for sub in folder._subtrees]
+
+
+def test_journal_undo_redo_and_replay(tmp_path) -> None:
+    tree = PaperTree('CS1', [], all_papers=True, by_year=True)
+    before = _describe(tree)
+    journal = tree.start_journal()
+    _scripted_edits(tree)
+    after = _describe(tree)
+    assert after != before
+
+    while journal.undo():
+        assert _sizes_consistent(tree)
+    assert _describe(tree) == before
+    assert not journal.can_undo() and journal.can_redo()
+    while journal.redo():
+        pass
+    assert _describe(tree) == after
+
+    # Undo one edit, so only the rest are saved.
+    journal.undo()
+    partial = _describe(tree)
+    filename = str(tmp_path / 'edits.json')
+    version = tree.get_version()
+    journal.save(filename)
+    assert _describe(tree) == partial
+    assert journal.can_redo()
+    # Saving reads the paths kept with the edits, without redoing them.
+    assert tree.get_version() == version
+
+    fresh = PaperTree('CS1', [], all_papers=True, by_year=True)
+    assert replay_journal(fresh, filename) == len(journal)
+    assert _sizes_consistent(fresh)
+    assert _describe(fresh) == partial
+
+
+def test_colour_policies() -> None:
+    def build() -> FileSystemTree:
+        return FileSystemTree.from_parts('root', [
+            FileSystemTree.from_parts('docs', [
+                FileSystemTree.from_parts('a.pdf', [], 10),
+                FileSystemTree.from_parts('b.PDF', [], 3000)]),
+            FileSystemTree.from_parts('c.txt', [], 5)])
+
+    tree = build()
+    lazy = [leaf._colour for leaf in _leaves(tree)]
+    other = build()
+    other.set_colour_policy(PathColours())
+    assert [leaf._colour for leaf in _leaves(other)] == lazy
+    assert len(set(lazy)) == 3
+
+    tree.set_colour_policy(CategoryColours())
+    a, b, c = _leaves(tree)
+    assert a._colour == b._colour != c._colour
+
+    tree.set_colour_policy(SizeColours(), lazy=True)
+    assert '_colour' not in a.__dict__
+    small, big = a._colour, b._colour
+    assert all(is_valid_colour(colour) for colour in (small, big))
+    assert small != big
+    a.change_size(3000)
+    assert a._colour == big
+
+    # Path colours follow a tree that is moved, and moved back by undo.
+    journal = other.start_journal()
+    a, b, c = _leaves(other)
+    before = c._colour
+    c.move(a._parent_tree)
+    assert c._colour == PathColours().colour(c) != before
+    journal.undo()
+    assert c._colour == before
+
+
+def test_largest_and_threshold_queries() -> None:
+    tree = PaperTree('CS1', [], all_papers=True, by_year=True)
+    sizes = sorted((leaf.data_size for leaf in _leaves(tree)), reverse=True)
+    nodes = []
+    stack = list(tree._subtrees)
+    while stack:
+        node = stack.pop()
+        nodes.append(node.data_size)
+        stack.extend(node._subtrees)
+    nodes.sort(reverse=True)
+
+    for k in (1, 10, 100, len(sizes) + 5):
+        largest = tree.get_largest(k)
+        assert [leaf.data_size for leaf in largest] == sizes[:k]
+        assert all(not leaf._subtrees for leaf in largest)
+        assert [node.data_size for node in
+                tree.get_largest(k, leaves=False)] == nodes[:k]
+    assert tree.get_largest(0) == []
+
+    threshold = sizes[20]
+    at_least = tree.get_at_least(threshold)
+    assert [leaf.data_size for leaf in at_least] == \
+        [size for size in sizes if size >= threshold]
+    assert [node.data_size for node in tree.get_at_least(threshold, False)] \
+        == [size for size in nodes if size >= threshold]
+
+    top = tree.get_above_percentile(99)
+    assert len(top) == len(sizes) - len(sizes) * 99 // 100
+    assert [leaf.data_size for leaf in top] == sizes[:len(top)]
+
+
+def test_extension_view_follows_edits(tmp_path) -> None:
+    for name, size in [('a/x.txt', 10), ('a/b/y.TXT', 20), ('a/z.pdf', 30),
+                       ('c/w.pdf', 40), ('top.txt', 50), ('c/d/a/v.txt', 60)]:
+        path = tmp_path / 'root' / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(b'-' * size)
+
+    tree = FileSystemTree(str(tmp_path / 'root'))
+    assert _groups(tree.get_extension_view()) == {
+        ('.txt', 'a'): 30, ('.pdf', 'a'): 30, ('.pdf', 'c'): 40,
+        ('.txt', 'top.txt'): 50, ('.txt', 'c'): 60}
+    scan = BackgroundScan(str(tmp_path / 'root'))
+    scan.start()
+    scan.join()
+    scan.apply_updates()
+    assert _groups(scan.tree.get_extension_view()) == \
+        _groups(tree.get_extension_view())
+
+    journal = tree.start_journal()
+    by_name = {leaf._name: leaf for leaf in _leaves(tree)}
+    folder_c = by_name['w.pdf'].get_parent()
+    by_name['x.txt'].change_size(5)
+    by_name['y.TXT'].move(folder_c)
+    by_name['top.txt'].move(folder_c)
+    by_name['z.pdf'].get_parent().delete_self()
+    expected = {('.txt', 'c'): 130, ('.pdf', 'c'): 40}
+    assert _groups(tree.get_extension_view()) == expected
+
+    while journal.undo():
+        pass
+    assert _groups(tree.get_extension_view()) == _groups(
+        FileSystemTree(str(tmp_path / 'root')).get_extension_view())
+    while journal.redo():
+        pass
+    assert _groups(tree.get_extension_view()) == expected
+    view = tree.get_extension_view()
+    assert view.data_size == tree.data_size
+    assert _sizes_consistent(view)
+
+
+def test_diff_snapshots(tmp_path) -> None:
+    folder = tmp_path / 'folder'
+    (folder / 'docs').mkdir(parents=True)
+    (folder / 'docs' / 'a.txt').write_bytes(b'a' * 10)
+    (folder / 'docs' / 'b.txt').write_bytes(b'b' * 20)
+    (folder / 'old.txt').write_bytes(b'o' * 5)
+    (folder / 'same').mkdir()
+    (folder / 'same' / 'c.txt').write_bytes(b'c' * 7)
+    save_snapshot(FileSystemTree(str(folder)), str(tmp_path / 'old.snap'))
+
+    (folder / 'docs' / 'b.txt').write_bytes(b'b' * 8)
+    (folder / 'old.txt').unlink()
+    (folder / 'new.txt').write_bytes(b'n' * 3)
+    new = FileSystemTree(str(folder))
+    with load_snapshot(str(tmp_path / 'old.snap')) as old:
+        diff = diff_trees(old, new)
+        assert diff.growth == -14 and diff.data_size == 20
+        assert [(sub._name, sub.status, sub.growth)
+                for sub in diff._subtrees] == [
+            ('docs', 'changed', -12), ('new.txt', 'added', 3),
+            ('old.txt', 'removed', -5)]
+        assert [sub._name for sub in diff._subtrees[0]._subtrees] == ['b.txt']
+        assert not diff_trees(old, old)._subtrees
+
+    # Diff colours are a colour policy, so they come back after another.
+    removed = diff._subtrees[2]
+    assert removed._colour == (220, 40, 40)
+    diff.set_colour_policy(PathColours(), lazy=True)
+    assert removed._colour == PathColours().colour(removed)
+    diff.set_colour_policy(DiffColours(), lazy=True)
+    assert removed._colour == (220, 40, 40)
+
+
+def test_snapshot_store(tmp_path) -> None:
+    folder = tmp_path / 'folder'
+    (folder / 'docs').mkdir(parents=True)
+    (folder / 'docs' / 'a.txt').write_bytes(b'a' * 10)
+    (folder / 'b.txt').write_bytes(b'b' * 20)
+    store = SnapshotStore(str(tmp_path / 'store'), keyframe_interval=2)
+    scans = [FileSystemTree(str(folder))]
+    store.add(scans[-1], '2026-10-01')
+
+    (folder / 'docs' / 'a.txt').write_bytes(b'a' * 15)
+    (folder / 'b.txt').unlink()
+    (folder / 'docs' / 'more').mkdir()
+    (folder / 'docs' / 'more' / 'c.txt').write_bytes(b'c' * 4)
+    scans.append(FileSystemTree(str(folder)))
+    store.add(scans[-1], '2026-10-02')
+
+    (folder / 'docs' / 'more' / 'c.txt').write_bytes(b'c' * 40)
+    scans.append(FileSystemTree(str(folder)))
+    store.add(scans[-1], '2026-10-03')
+    with pytest.raises(ValueError):
+        store.add(scans[-1], '2026-10-03')
+
+    assert sorted(os.listdir(tmp_path / 'store')) == [
+        '2026-10-01.snap', '2026-10-02.delta.json.gz', '2026-10-03.snap',
+        'index.json']
+    reopened = SnapshotStore(str(tmp_path / 'store'))
+    assert reopened.get_dates() == ['2026-10-01', '2026-10-02', '2026-10-03']
+    for date, scan in zip(reopened.get_dates(), scans):
+        tree = reopened.get_tree(date)
+        _sort_subtrees(tree)
+        _sort_subtrees(scan)
+        assert _describe(tree) == _describe(scan)
+        assert tree._mtime == scan._mtime
+
+
+def test_benchmarks_report_regressions() -> None:
+    # One of the benchmarks draws the treemap.
+    pytest.importorskip('pygame')
+    results = run_benchmarks(nodes=300, repeat=1, only='wide')
+    assert set(results) == {'build/wide', 'layout/wide', 'rectangles/wide',
+                            'hit_test/wide', 'expand_collapse/wide',
+                            'edit/wide', 'edit_and_layout/wide',
+                            'render/wide'}
+    assert all(seconds >= 0 for seconds in results.values())
+    assert compare_results(results, results) == []
+    slower = {name: seconds * 2 + 1 for name, seconds in results.items()}
+    assert len(compare_results(results, slower, threshold=0.5)) == \
+        len(results)
+
+
+def test_profiler_counts_and_traces(tmp_path) -> None:
+    leaves = [TMTree(str(i), [], i + 1) for i in range(4)]
+    tree = TMTree('root', [TMTree('a', leaves[:2]), TMTree('b', leaves[2:])])
+    tree.expand_all()
+    profiler = Profiler()
+    profiler.instrument()
+    try:
+        tree.update_rectangles((0, 0, 100, 100))
+        tree.get_tree_at_position((99, 99))
+        profiler.end_frame()
+    finally:
+        profiler.uninstrument()
+    tree.update_rectangles((0, 0, 100, 100))
+    profiler.end_frame()
+
+    summary = profiler.get_summary()
+    assert summary['layout_nodes'] == 7 / 2
+    assert summary['hit_test_nodes'] == 7 / 2
+    assert summary['layout_ms'] > 0 and summary['hit_test_ms'] > 0
+    profiler.save_trace(str(tmp_path / 'trace.json'))
+    with open(tmp_path / 'trace.json') as file:
+        events = json.load(file)['traceEvents']
+    assert [e['name'] for e in events if e['ph'] == 'X'] == \
+        ['layout', 'hit_test']
+
+
+def test_memory_report_by_tree_type() -> None:
+    name = 'shared-name.txt'
+    files = [FileSystemTree.from_parts(name, [], i + 1) for i in range(50)]
+    tree = FileSystemTree.from_parts('root', files)
+    tree.expand()
+    tree.update_rectangles((0, 0, 1000, 1000))
+    report = memory_report(tree)
+    parts = report['FileSystemTree']
+    assert parts['count'] == 51
+    # The name is one string, so it is only counted once in the sample.
+    assert parts['name'] < sys.getsizeof(name)
+    assert parts['rect'] > 0
+    assert parts['total'] == pytest.approx(sum(parts[p] for p in PARTS))
+    # Colours not worked out yet are counted as what they will take.
+    assert parts['colour'] >= sys.getsizeof((0, 0, 0))
+    assert '_colour' not in vars(files[0])
+
+    papers = PaperTree('CS1', [], all_papers=True, by_year=False)
+    report = memory_report(papers, sample=100)
+    assert report['PaperTree']['authors'] > 0
+    assert report['PaperTree']['doi'] > 0
+    assert report['PaperTree']['compact'] < report['PaperTree']['total']
+
+
+def test_scan_rules(tmp_path) -> None:
+    folder = tmp_path / 'folder'
+    (folder / '.git').mkdir(parents=True)
+    (folder / 'src' / 'deep' / 'deeper').mkdir(parents=True)
+    (folder / '.git' / 'HEAD').write_bytes(b'h' * 7)
+    (folder / 'debug.log').write_bytes(b'l' * 20)
+    (folder / 'keep.log').write_bytes(b'k' * 3)
+    (folder / 'src' / 'main.py').write_bytes(b'm' * 10)
+    (folder / 'src' / 'deep' / 'a.py').write_bytes(b'a' * 4)
+    (folder / 'src' / 'deep' / 'deeper' / 'b.py').write_bytes(b'b' * 2)
+    rules = ScanRules(['.git/', '*.log', '!keep.log'], max_depth=2)
+    tree = FileSystemTree(str(folder), rules)
+    _sort_subtrees(tree)
+    names = [sub._name for sub in tree._subtrees]
+    assert names == ['keep.log', 'src']
+    deep = tree._subtrees[1]._subtrees[0]
+    assert deep._name == 'deep' and not deep._subtrees and deep._skipped
+    assert deep.data_size == 6
+    assert 'not scanned' in deep.get_suffix()
+    assert tree.data_size == 3 + 10 + 6
+
+    collapsed = FileSystemTree(str(folder), ScanRules(
+        COMMON_EXCLUDES + ['*.log'], collapse=True))
+    _sort_subtrees(collapsed)
+    skipped = collapsed._subtrees[0]
+    assert skipped._name == SKIPPED_NAME and skipped.data_size == 7 + 20 + 3
+    assert collapsed.data_size == 7 + 20 + 3 + 10 + 4 + 2
+
+    scan = BackgroundScan(str(folder), rules)
+    scan.start()
+    scan.join()
+    scan.apply_updates()
+    _sort_subtrees(scan.tree)
+    assert _describe(scan.tree) == _describe(tree)
+    assert scan.tree._subtrees[1]._subtrees[0]._skipped
+
+
+def test_archives_expand_lazily(tmp_path) -> None:
+    folder = tmp_path / 'folder'
+    (folder / 'src').mkdir(parents=True)
+    (folder / 'src' / 'main.py').write_bytes(b'm' * 10)
+    with zipfile.ZipFile(folder / 'bundle.zip', 'w') as archive:
+        archive.writestr('lib/a.py', 'a' * 300)
+        archive.writestr('lib/b.txt', 'b' * 100)
+        archive.writestr('empty/', '')
+    with tarfile.open(folder / 'logs.tar.gz', 'w:gz') as archive:
+        for name, size in [('x/1.log', 30), ('2.log', 10)]:
+            info = tarfile.TarInfo(name)
+            info.size = size
+            archive.addfile(info, io.BytesIO(b'l' * size))
+    total = sum(os.path.getsize(folder / name)
+                for name in ('bundle.zip', 'logs.tar.gz', 'src/main.py'))
+
+    tree = FileSystemTree(str(folder), archives=True)
+    _sort_subtrees(tree)
+    bundle, logs = tree._subtrees[0], tree._subtrees[1]
+    assert isinstance(bundle, ArchiveTree) and not bundle._subtrees
+    view_before = _groups(tree.get_extension_view())
+    assert view_before[('.zip', 'bundle.zip')] == bundle.data_size
+
+    bundle.expand()
+    logs.expand()
+    assert bundle._expanded and tree.data_size == total
+    assert [sub._name for sub in bundle._subtrees] == ['lib', 'empty']
+    assert _sizes_consistent(tree)
+    lib = bundle._subtrees[0]
+    a, b = lib._subtrees
+    assert a.data_size > b.data_size
+    one, two = logs._subtrees[0]._subtrees[0], logs._subtrees[1]
+    assert abs(one.data_size - 3 * two.data_size) <= 1
+    groups = _groups(tree.get_extension_view())
+    assert ('.zip', 'bundle.zip') not in groups
+    assert groups[('.py', 'bundle.zip')] == a.data_size
+    assert groups[('.log', 'logs.tar.gz')] == logs.data_size
+
+    plain = FileSystemTree(str(folder))
+    assert not any(isinstance(sub, ArchiveTree) for sub in plain._subtrees)
+
+    scan = BackgroundScan(str(folder), archives=True)
+    scan.start()
+    scan.join()
+    scan.apply_updates()
+    _sort_subtrees(scan.tree)
+    scanned = scan.tree._subtrees[0]
+    scanned.expand()
+    _sort_subtrees(scanned)
+    _sort_subtrees(bundle)
+    assert _describe(scanned) == _describe(bundle)
+
+
+def test_find_duplicates(tmp_path) -> None:
+    folder = tmp_path / 'folder'
+    (folder / 'sub').mkdir(parents=True)
+    (folder / 'a.txt').write_bytes(b'same' * 5)
+    (folder / 'sub' / 'b.txt').write_bytes(b'same' * 5)
+    (folder / 'c.txt').write_bytes(b'diff' * 5)
+    big = b'x' * 64 + b'middle' + b'y' * 64
+    (folder / 'big1').write_bytes(big)
+    (folder / 'big2').write_bytes(big)
+    (folder / 'big3').write_bytes(big.replace(b'middle', b'MIDDLE'))
+    os.link(folder / 'big1', folder / 'big1-link')
+    (folder / 'empty1').write_bytes(b'')
+    (folder / 'empty2').write_bytes(b'')
+    tree = FileSystemTree(str(folder))
+    _sort_subtrees(tree)
+
+    groups = find_duplicates(tree, str(folder), workers=2, block_size=16)
+    names = [sorted(node._name for node in files) for files in groups]
+    assert names == [['big1', 'big2'], ['a.txt', 'b.txt']]
+    assert reclaimable(groups) == len(big) + 20
+    # Files of up to two blocks are settled by the first pass alone.
+    assert find_duplicates(tree, str(folder), block_size=4096) == groups
+
+    # Files are matched by their sizes in bytes, whichever metric is shown.
+    tree.set_metric('files')
+    by_count = find_duplicates(tree, str(folder), workers=2, block_size=16)
+    assert [sorted(node._name for node in files)
+            for files in by_count] == names
+    assert reclaimable(by_count) == len(big) + 20
+
+    # Files are settled by their sizes when they are read, not when scanned.
+    (folder / 'a.txt').write_bytes(b'p' * 16 + b'A' + b'q' * 16)
+    (folder / 'sub' / 'b.txt').write_bytes(b'p' * 16 + b'B' + b'q' * 16)
+    groups = find_duplicates(tree, str(folder), workers=2, block_size=16)
+    assert [sorted(node._name for node in files)
+            for files in groups] == [['big1', 'big2']]
+
+
+def test_build_tree_from_records(tmp_path) -> None:
+    folder = tmp_path / 'folder'
+    (folder / 'sub' / 'deeper').mkdir(parents=True)
+    (folder / 'empty').mkdir()
+    (folder / 'a.txt').write_bytes(b'a' * 30)
+    (folder / 'sub' / 'b.txt').write_bytes(b'b' * 10)
+    (folder / 'sub' / 'deeper' / 'c.txt').write_bytes(b'c' * 5)
+    expected = FileSystemTree(str(folder))
+    _sort_subtrees(expected)
+
+    # As find would list it, with every folder before what is in it...
+    listing = []
+    for path, folders, files in os.walk(folder):
+        relative = os.path.relpath(path, tmp_path).replace(os.sep, '/')
+        listing.append(f'd\t4096\t1.0\t{relative}\n')
+        listing.extend(f'f\t{os.path.getsize(os.path.join(path, name))}\t'
+                       f'2.0\t{relative}/{name}\n' for name in files)
+    tree = build_tree(parse_find(listing))
+    _sort_subtrees(tree)
+    assert _describe(tree) == _describe(expected)
+    assert tree._mtime == 2 * 10 ** 9
+    assert _sizes_consistent(tree)
+
+    # ... and as du would, with every folder after, in any order of files.
+    du = [f'{size}\t{path}\n' for path, size in
+          [('folder/sub/deeper/c.txt', 5), ('folder/sub/deeper', 4101),
+           ('folder/a.txt', 30), ('folder/sub/b.txt', 10),
+           ('folder/sub', 8211), ('folder/empty', 0), ('folder', 12341)]]
+    tree = build_tree(parse_du(du))
+    _sort_subtrees(tree)
+    assert _describe(tree) == _describe(expected)
+
+    rows = ['"folder","a.txt","30","2024-01-01T00:00:00.000Z"\n',
+            '"folder","sub%2Fb.txt","10","2024-01-01T00:00:00.000Z"\n']
+    tree = build_tree(parse_s3_inventory(rows))
+    assert [sub._name for sub in tree._subtrees] == ['a.txt', 'sub']
+    assert tree.data_size == 40
+
+
+def test_merge_shards(tmp_path) -> None:
+    def scan() -> list:
+        # Two scans of the same folder that overlap in sub, and a third of
+        # another folder mounted deeper.
+        first = FileSystemTree.from_parts('data', [
+            FileSystemTree.from_parts('sub', [
+                FileSystemTree.from_parts('a.txt', [], 5, 3),
+                FileSystemTree.from_parts('b.txt', [], 1)]),
+            FileSystemTree.from_parts('c', [], 2)])
+        second = FileSystemTree.from_parts('data', [
+            FileSystemTree.from_parts('sub', [
+                FileSystemTree.from_parts('b.txt', [], 9),
+                FileSystemTree.from_parts('d.txt', [], 4, 7)]),
+            FileSystemTree.from_parts('c', [
+                FileSystemTree.from_parts('e.txt', [], 1)])])
+        other = FileSystemTree.from_parts('other', [
+            FileSystemTree.from_parts('f.txt', [], 6)])
+        return [first, second, other]
+
+    mounts = [None, 'data', 'more/other2']
+    expected = FileSystemTree.from_parts('root', [
+        FileSystemTree.from_parts('data', [
+            FileSystemTree.from_parts('sub', [
+                FileSystemTree.from_parts('a.txt', [], 5, 3),
+                FileSystemTree.from_parts('b.txt', [], 9),
+                FileSystemTree.from_parts('d.txt', [], 4, 7)]),
+            FileSystemTree.from_parts('c', [
+                FileSystemTree.from_parts('e.txt', [], 1)])]),
+        FileSystemTree.from_parts('more', [
+            FileSystemTree.from_parts('other2', [
+                FileSystemTree.from_parts('f.txt', [], 6)])])])
+    untouched = scan()
+    tree = merge_trees(untouched, mounts, 'root')
+    assert _describe(tree) == _describe(expected)
+    assert tree._mtime == 7
+    assert _sizes_consistent(tree)
+    # What does not overlap is moved, not copied.
+    assert tree._subtrees[0]._subtrees[1] is untouched[1]._subtrees[1]
+
+    files = []
+    for i, shard in enumerate(scan() * 2):
+        files.append(str(tmp_path / f'{i}.snap'))
+        save_snapshot(shard, files[-1])
+    for workers in (1, 2):
+        output = str(tmp_path / f'merged{workers}.snap')
+        merge_shards(files, output, mounts * 2, 'root', workers)
+        with load_snapshot(output) as snapshot:
+            merged = snapshot.to_tree()
+        assert _describe(merged) == _describe(expected)
+        assert merged._mtime == 7
+
+
+def test_names_are_shared(tmp_path) -> None:
+    folder = tmp_path / 'folder'
+    for sub in ('a', 'b', 'c'):
+        (folder / sub).mkdir(parents=True)
+        (folder / sub / '__init__.py').write_bytes(b'x')
+    # Each folder is listed on its own, but its names are kept once.
+    for tree in (FileSystemTree(str(folder)),
+                 build_tree([(f'{sub}/__init__.py', 1) for sub in 'abc'])):
+        names = [sub._subtrees[0]._name for sub in tree._subtrees]
+        assert len(names) == 3
+        assert all(name is names[0] for name in names)
+        assert name_memory(tree)[0] < name_memory(tree)[1]
+
+    filename = str(tmp_path / 'papers.csv')
+    with open(filename, 'w') as file:
+        file.write('Author,Title,Year,Category,Url,Citations\n'
+                   'A. Author,One,2001,Intro: Labs,http://a,1\n'
+                   'A. Author,Two,2002,Intro: Labs,http://b,2\n')
+    papers = PaperTree('papers', [], all_papers=True, data_file=filename)
+    save_snapshot(papers, str(tmp_path / 'papers.snap'))
+    with load_snapshot(str(tmp_path / 'papers.snap')) as snapshot:
+        loaded = snapshot.to_tree()
+    for tree in (papers, loaded):
+        years = tree._subtrees
+        assert years[0]._subtrees[0]._name is years[1]._subtrees[0]._name
+        first, second = [year._subtrees[0]._subtrees[0]._subtrees[0]
+                         for year in years]
+        assert first.authors is second.authors
+
+
+def test_switch_metrics(tmp_path) -> None:
+    folder = tmp_path / 'folder'
+    (folder / 'sub').mkdir(parents=True)
+    (folder / 'empty').mkdir()
+    (folder / 'a.txt').write_bytes(b'a' * 5000)
+    (folder / 'sub' / 'b.txt').write_bytes(b'b' * 10)
+    (folder / 'sub' / 'c.txt').write_bytes(b'c' * 20)
+    scan = BackgroundScan(str(folder))
+    scan.start()
+    scan.join()
+    scan.apply_updates()
+    for tree in (FileSystemTree(str(folder)), scan.tree):
+        _sort_subtrees(tree)
+        assert tree.get_metric() == 'bytes'
+        assert tree.data_size == 5030
+        tree.set_metric('files')
+        assert [sub.data_size for sub in tree._subtrees] == [1, 0, 2]
+        assert tree.data_size == 3
+        assert 'files' in tree._subtrees[2].get_suffix()
+        tree.set_metric('blocks')
+        assert _sizes_consistent(tree)
+        if hasattr(os.stat(folder), 'st_blocks'):
+            assert tree._subtrees[0].data_size % 512 == 0
+
+        # An edit made in one metric is kept when switching back to it.
+        tree.set_metric('bytes')
+        tree._subtrees[0].change_size(100)
+        tree.set_metric('files')
+        tree.set_metric('bytes')
+        assert tree.data_size == 5130
+        assert not tree.start_journal().can_undo()
+        tree.update_rectangles((0, 0, 100, 100))
+
+    tree = FileSystemTree.from_parts('root', [
+        FileSystemTree.from_parts('a.pdf', [], 10),
+        FileSystemTree.from_parts('b.txt', [], 5)])
+    assert tree.get_extension_view().data_size == 15
+    tree.set_metric('files')
+    assert tree.get_extension_view().data_size == 2
+    with pytest.raises(ValueError):
+        tree.set_metric('citations')
+
+    papers = PaperTree('CS1', [], all_papers=True, by_year=False)
+    papers.set_metric('papers')
+    assert papers.data_size == sum(1 for _ in _leaves(papers))
+    assert papers.get_suffix().endswith('papers)')
+
+
+def test_background_scan_drops_deleted_folders(tmp_path) -> None:
+    folder = tmp_path / 'folder'
+    (folder / 'sub' / 'deeper').mkdir(parents=True)
+    (folder / 'a.txt').write_bytes(b'a' * 30)
+    (folder / 'sub' / 'b.txt').write_bytes(b'b' * 10)
+    (folder / 'sub' / 'deeper' / 'c.txt').write_bytes(b'c' * 1500)
+    scan = BackgroundScan(str(folder))
+    scan.start()
+    scan.join()
+    # Add only what is in the root, so sub is still waiting to be listed.
+    folder_id, entries = scan._queue.get_nowait()
+    scan._add_entries(scan._folders.pop(folder_id), entries)
+    sub = [tree for tree in scan.tree._subtrees if tree._name == 'sub'][0]
+    assert sub.delete_self()
+    # Nothing found in sub, or in deeper, is added.
+    assert not scan.apply_updates()
+    assert scan.is_done()
+    assert [tree._name for tree in scan.tree._subtrees] == ['a.txt']
+    assert scan.tree.data_size == 30
+    assert _groups(scan.tree.get_extension_view()) == {('.txt', 'a.txt'): 30}
+
+
+def test_archive_metrics_after_switch(tmp_path) -> None:
+    folder = tmp_path / 'folder'
+    folder.mkdir()
+    (folder / 'a.txt').write_bytes(b'a' * 50)
+    with zipfile.ZipFile(folder / 'bundle.zip', 'w') as archive:
+        archive.writestr('lib/a.py', 'a' * 300)
+        archive.writestr('b.txt', 'b' * 100)
+        archive.writestr('c.txt', 'c' * 100)
+    size = os.path.getsize(folder / 'bundle.zip')
+
+    tree = FileSystemTree(str(folder), archives=True)
+    _sort_subtrees(tree)
+    tree.set_metric('files')
+    bundle = tree._subtrees[1]
+    bundle.expand()
+    assert bundle.data_size == 3 and tree.data_size == 4
+    assert _sizes_consistent(tree)
+    assert _groups(tree.get_extension_view()) == {
+        ('.txt', 'a.txt'): 1, ('.py', 'bundle.zip'): 1,
+        ('.txt', 'bundle.zip'): 2}
+
+    # The members kept their shares of the bytes of the archive.
+    tree.set_metric('bytes')
+    assert bundle.data_size == size and tree.data_size == size + 50
+    assert _sizes_consistent(tree)
+
+    # Snapshots are read back in bytes, so only trees sized in bytes are saved.
+    tree.set_metric('files')
+    with pytest.raises(ValueError):
+        save_snapshot(tree, str(tmp_path / 'tree.snap'))
+
+
+def test_journal_restores_positions_and_expansion(tmp_path) -> None:
+    leaves = [TMTree(str(i), [], 1) for i in range(100)]
+    folder = TMTree('folder', leaves)
+    only = TMTree('only', [], 5)
+    source = TMTree('source', [only])
+    root = TMTree('root', [folder, source])
+    root.expand_all()
+    journal = root.start_journal()
+
+    # Undoing deletions puts each tree back in the slot it left, in order.
+    for leaf in leaves[::2]:
+        leaf.delete_self()
+    while journal.undo():
+        pass
+    assert list(folder._subtrees) == leaves
+    assert list.__len__(folder._subtrees) == len(leaves)
+
+    # Moving the only tree out of a folder collapses it, until undone.
+    only.move(folder)
+    assert not source._expanded
+    journal.undo()
+    assert source._expanded and source._subtrees[0] is only
+
+    # The emptied folder is moved itself, after a move out of it.
+    only.move(folder)
+    source.move(folder)
+    filename = str(tmp_path / 'edits.json')
+    journal.save(filename)
+    with open(filename) as file:
+        edits = json.load(file)['edits']
+    assert [(edit['path'], edit.get('to')) for edit in edits] == [
+        (['source', 'only'], ['folder']), (['source'], ['folder'])]
+
+
+def test_metric_switch_keeps_journal(tmp_path) -> None:
+    x, y, z = TMTree('x', [], 10), TMTree('y', [], 5), TMTree('z', [], 3)
+    a, c = TMTree('a', [x, y]), TMTree('c', [z])
+    root = TMTree('root', [a, TMTree('b', [], 7), c])
+    journal = root.start_journal()
+    x.change_size(5)
+    root.set_metric('leaves')
+    assert root.data_size == 4 and journal.can_undo()
+    y.change_size(2)
+    assert z.delete_self()
+    assert root.data_size == 5 and c.data_size == 0
+
+    # Each edit is undone in the metric it was made in.
+    root.set_metric('size')
+    assert (root.data_size, a.data_size) == (27, 20)
+    for size in (30, 30, 25):
+        assert journal.undo()
+        assert root.data_size == size and _sizes_consistent(root)
+    root.set_metric('leaves')
+    assert (root.data_size, a.data_size, c.data_size) == (4, 2, 1)
+    for _ in range(3):
+        assert journal.redo()
+    assert root.data_size == 5 and _sizes_consistent(root)
+    root.set_metric('size')
+    assert root.data_size == 27 and _sizes_consistent(root)
+
+    journal.save(str(tmp_path / 'edits.json'))
+    with open(tmp_path / 'edits.json') as file:
+        edits = json.load(file)['edits']
+    assert [edit.get('metric') for edit in edits] == ['size', 'leaves', None]
+    x2, y2 = TMTree('x', [], 10), TMTree('y', [], 5)
+    fresh = TMTree('root', [TMTree('a', [x2, y2]), TMTree('b', [], 7),
+                            TMTree('c', [TMTree('z', [], 3)])])
+    assert replay_journal(fresh, str(tmp_path / 'edits.json')) == 3
+    assert fresh.data_size == 27
+    fresh.set_metric('leaves')
+    assert (fresh.data_size, y2.data_size) == (5, 3)
+
+
+def test_background_scan_keeps_pending_folders_empty(tmp_path) -> None:
+    folder = tmp_path / 'folder'
+    (folder / 'sub').mkdir(parents=True)
+    (folder / 'sub' / 'b.txt').write_bytes(b'b' * 10)
+    scan = BackgroundScan(str(folder))
+    scan.start()
+    scan.join()
+    folder_id, entries = scan._queue.get_nowait()
+    scan._add_entries(scan._folders.pop(folder_id), entries)
+    sub = scan.tree._subtrees[0]
+    # sub is empty until it is listed, but it is not a file.
+    sub.change_size(50)
+    assert sub.data_size == 0
+    assert scan.apply_updates()
+    assert scan.tree.data_size == sub.data_size == 10
+    assert _sizes_consistent(scan.tree)
+
+
+def test_diff_sources_scans_by_rules(tmp_path) -> None:
+    pytest.importorskip('pygame')
+    from treemap_visualiser import diff_sources
+    folder = tmp_path / 'folder'
+    folder.mkdir()
+    (folder / 'a.txt').write_bytes(b'a' * 10)
+    save_snapshot(FileSystemTree(str(folder)), str(tmp_path / 'old.snap'))
+    (folder / 'a.txt').write_bytes(b'a' * 20)
+    (folder / 'debug.log').write_bytes(b'l' * 500)
+    diff = diff_sources(str(tmp_path / 'old.snap'), str(folder),
+                        ScanRules(['*.log']))
+    assert [(sub._name, sub.growth) for sub in diff._subtrees] == [
+        ('a.txt', 10)]
+
 ##############################################################################
 # Helpers
 ##############################################################################
@@ -733,6 +1798,39 @@ def is_valid_colour(colour: tuple[int, int, int]) -> bool:
     return True
 
 
+def _leaves(tree: TMTree) -> list[TMTree]:
+    """Return the leaves of <tree>, from left to right.
+    """
+    if not tree._subtrees:
+        return [tree]
+    return [leaf for subtree in tree._subtrees for leaf in _leaves(subtree)]
+
+
+def _sizes_consistent(tree: TMTree) -> bool:
+    """Return True iff every internal tree in <tree> has the total size of
+    its subtrees.
+    """
+    return not tree._subtrees or (
+        tree.data_size == sum(sub.data_size for sub in tree._subtrees)
+        and all(_sizes_consistent(sub) for sub in tree._subtrees))
+
+
+def _groups(view: TMTree) -> dict[tuple[str, str], int]:
+    """Return the size of each (extension, top-level folder) group in <view>.
+    """
+    return {(kind._name, group._name): group.data_size
+            for kind in view._subtrees for group in kind._subtrees}
+
+
+def _describe(tree: TMTree) -> tuple:
+    """Return a nested tuple of the names, sizes, authors and dois in <tree>,
+    for comparing trees built in different ways.
+    """
+    return (tree._name, tree.data_size, getattr(tree, 'authors', None),
+            getattr(tree, 'doi', None),
+            [_describe(subtree) for subtree in tree._subtrees])
+
+
 def _sort_subtrees(tree: TMTree) -> None:
     """Sort the subtrees of <tree> in alphabetical order.
     THIS IS FOR THE PURPOSES OF THE SAMPLE TEST ONLY; YOU SHOULD NOT SORT
@@ -0,0 +1,183 @@
+"""Rules for which files and folders a scan leaves out.
+
+Patterns are written as in a .gitignore file:
+    - a blank line, or a line starting with #, is ignored;
+    - * matches anything but /, ? matches any one character but /, and
+      [abc] or [a-z] match one of a set of characters;
+    - ** matches any number of folders: **/build, logs/** and a/**/b;
+    - a pattern ending in / only matches folders;
+    - a pattern with a / at the start or in the middle is matched against the
+      whole path from the folder being scanned, and any other pattern against
+      the name alone, at any depth;
+    - a pattern starting with ! includes again what an earlier pattern left
+      out, and the last pattern that matches a path decides.
+
+A folder that is left out is never listed, so nothing inside it can be
+included again; to scan only some kinds of file, leave out everything but
+folders and include those files:
+
+    *
+    !*/
+    !*.py
+"""
+from __future__ import annotations
+
+import re
+from typing import Dict, Iterable, List, Optional, Pattern, Tuple
+
+# The name of the file that stands for everything left out of a folder, when
+# the rules collapse what they leave out.
+SKIPPED_NAME = '(skipped)'
+
+# Patterns for folders that most scans are better off without: version
+# control, installed dependencies, caches and virtual environments.
+COMMON_EXCLUDES = ['.git/', '.hg/', '.svn/', 'node_modules/', '__pycache__/',
+                   '.venv/', 'venv/', '.tox/']
+
+
+class ScanRules:
+    """The files and folders a scan leaves out, and how deep it goes.
+
+    === Public Attributes ===
+    max_depth:
+        How many levels of folders are listed, counting the folder being
+        scanned, or None for no limit. Folders below that are each shown as
+        a single file the size of everything in them.
+    same_device:
+        Whether to leave out folders on a different device from the folder
+        being scanned, such as other disks and pseudo-filesystems like /proc.
+    collapse:
+        Whether the files and folders left out of each folder are shown as a
+        single file, called SKIPPED_NAME, the size of all of them.
+
+    === Private Attributes ===
+    _patterns:
+        The patterns, as given.
+    _negated:
+        Whether each pattern starts with !.
+    _matchers:
+        For folders and then files, a regular expression for the patterns
+        matched against the whole path, and one for the patterns matched
+        against the name, or None if there are no such patterns. Each finds
+        the last of its patterns that matches, as a group named after its
+        index; the patterns that only match folders are left out for files.
+    """
+    max_depth: Optional[int]
+    same_device: bool
+    collapse: bool
+    _patterns: List[str]
+    _negated: List[bool]
+    _matchers: Dict[bool, Tuple[Optional[Pattern[str]],
+                                Optional[Pattern[str]]]]
+
+    def __init__(self, patterns: Iterable[str] = (),
+                 max_depth: Optional[int] = None, same_device: bool = False,
+                 collapse: bool = False) -> None:
+        """Initialize rules that leave out the paths matched by <patterns>.
+        """
+        self.max_depth = max_depth
+        self.same_device = same_device
+        self.collapse = collapse
+        self._patterns = []
+        self._negated = []
+        # The patterns for folders and files, on the path and on the name.
+        parts = {(True, True): [], (True, False): [],
+                 (False, True): [], (False, False): []}
+        for line in patterns:
+            pattern = line.strip()
+            if not pattern or pattern.startswith('#'):
+                continue
+            negated = pattern.startswith('!')
+            pattern = pattern[1:] if negated else pattern
+            folders_only = pattern.endswith('/')
+            pattern = pattern.rstrip('/')
+            on_path = '/' in pattern
+            group = f'(?P<p{len(self._patterns)}>' \
+                    f'{_translate(pattern.lstrip("/"))})'
+            self._patterns.append(line.strip())
+            self._negated.append(negated)
+            parts[True, on_path].append(group)
+            if not folders_only:
+                parts[False, on_path].append(group)
+        self._matchers = {
+            is_folder: (_compile(parts[is_folder, True]),
+                        _compile(parts[is_folder, False]))
+            for is_folder in (True, False)}
+
+    @classmethod
+    def from_file(cls, filename: str, **options: object) -> ScanRules:
+        """Return the rules with the patterns in the file <filename>, such as
+        a .gitignore file, and the given <options>.
+        """
+        with open(filename) as file:
+            return cls(file.read().splitlines(), **options)
+
+    def excludes(self, path: str, is_folder: bool) -> bool:
+        """Return whether the file or folder at <path>, relative to the folder
+        being scanned and separated by /, is left out.
+        >>> rules = ScanRules(['*.log', '!keep.log', '/build/', 'docs/**/tmp'])
+        >>> rules.excludes('a/b/debug.log', False)
+        True
+        >>> rules.excludes('a/keep.log', False)
+        False
+        >>> rules.excludes('build', True), rules.excludes('a/build', True)
+        (True, False)
+        >>> rules.excludes('build', False)
+        False
+        >>> rules.excludes('docs/x/y/tmp', True)
+        True
+        """
+        last = -1
+        path_matcher, name_matcher = self._matchers[is_folder]
+        if path_matcher is not None:
+            match = path_matcher.fullmatch(path)
+            if match is not None:
+                last = int(match.lastgroup[1:])
+        if name_matcher is not None:
+            match = name_matcher.fullmatch(path[path.rfind('/') + 1:])
+            if match is not None:
+                last = max(last, int(match.lastgroup[1:]))
+        return last >= 0 and not self._negated[last]
+
+
+def _compile(parts: List[str]) -> Optional[Pattern[str]]:
+    if not parts:
+        return None
+    # Python tries alternatives in order, so putting the last pattern first
+    # finds the last one that matches.
+    return re.compile('|'.join(reversed(parts)), re.DOTALL)
+
+
+def _translate(pattern: str) -> str:
+    """Return a regular expression matching what <pattern> matches.
+    >>> bool(re.fullmatch(_translate('a/**/b'), 'a/x/y/b'))
+    True
+    >>> bool(re.fullmatch(_translate('*.py'), 'src/main.py'))
+    False
+    """
+    regex = []
+    i = 0
+    while i < len(pattern):
+        if pattern.startswith('**/', i):
+            regex.append('(?:.*/)?')
+            i += 3
+        elif pattern.startswith('**', i):
+            regex.append('.*')
+            i += 2
+        elif pattern[i] == '*':
+            regex.append('[^/]*')
+            i += 1
+        elif pattern[i] == '?':
+            regex.append('[^/]')
+            i += 1
+        elif pattern[i] == '[' and ']' in pattern[i + 2:]:
+            end = pattern.index(']', i + 2)
+            chars = pattern[i + 1:end]
+            if chars.startswith('!'):
+                chars = '^' + chars[1:]
+            regex.append('[' + chars.replace('\\', '\\\\') + ']')
+            i = end + 1
+        else:
+            regex.append(re.escape(pattern[i]))
+            i += 1
+    return ''.join(regex)
@@ -0,0 +1,204 @@
+"""Merging scans of parts of a file system into one tree, such as the shards
+of a scan split across machines, or the disks of a machine scanned one by one.
+
+Each scan is put at a mount: a path, separated by /, from a new root. Where
+scans overlap, folders at the same path are merged into one folder holding
+what is in all of them, and of two files at the same path the later scan's is
+kept. Everything that does not overlap is moved into the merged tree as it
+is, so merging costs about as much as the overlap, however big the scans.
+
+merge_trees merges trees already loaded. merge_shards merges snapshot files
+into another snapshot file without loading them as trees, splitting the work
+between a pool of processes when there are many files. From the command line
+of the visualiser:
+
+    python treemap_visualiser.py --merge /=root.snap home=home.snap
+"""
+from __future__ import annotations
+
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from snapshots import merge_snapshots
+from tm_trees import FileSystemTree
+
+
+def merge_trees(trees: Sequence[FileSystemTree],
+                mounts: Optional[Sequence[Optional[str]]] = None,
+                name: str = '') -> FileSystemTree:
+    """Return a new folder called <name> holding <trees>, merged by path.
+
+    Each tree is put at its mount in <mounts>: a path from the new folder,
+    whose last part becomes the name of the tree. A mount of None is the
+    tree's own name, and a mount of '' merges what is in the tree into the
+    new folder itself. Where two trees have a folder at the same path, the
+    folder holds what is in both, and where they have a file at the same
+    path, the later tree's is kept. A folder is kept over a file.
+
+    The trees are moved into the new folder rather than copied, so they are
+    part of it afterwards; only the folders where they overlap have their
+    sizes added up again.
+
+    Raise ValueError if a tree is not of a file system, or is not sized in
+    bytes.
+    >>> home = FileSystemTree.from_parts('home', [
+    ...     FileSystemTree.from_parts('a.txt', [], 5),
+    ...     FileSystemTree.from_parts('b.txt', [], 1)])
+    >>> more = FileSystemTree.from_parts('home', [
+    ...     FileSystemTree.from_parts('b.txt', [], 3),
+    ...     FileSystemTree.from_parts('c.txt', [], 7)])
+    >>> tree = merge_trees([home, more], ['users/home', 'users/home'])
+    >>> tree.data_size
+    15
+    >>> merged = tree._subtrees[0]._subtrees[0]
+    >>> [(sub._name, sub.data_size) for sub in merged._subtrees]
+    [('a.txt', 5), ('b.txt', 3), ('c.txt', 7)]
+    """
+    root = FileSystemTree.from_parts(name, [])
+    merge = _Merge(root)
+    for k, tree in enumerate(trees):
+        if not isinstance(tree, FileSystemTree):
+            raise ValueError(f'{tree._name} is not a tree of a file system')
+        if tree._root()._metric:
+            raise ValueError(f'{tree._name} is sized by {tree.get_metric()}, '
+                             f'not {tree.METRICS[0]}')
+        mount = mounts[k] if mounts is not None else None
+        if mount is None:
+            mount = tree._name
+        parts = [part for part in mount.split('/') if part]
+        if not parts:
+            root._mtime = max(root._mtime, tree._mtime)
+            for sub in list(tree._subtrees):
+                merge.add(root, 0, sub._name, sub)
+            continue
+        folder = root
+        for depth, part in enumerate(parts[:-1]):
+            folder = merge.open(folder, depth, part)
+        tree._extensions = None
+        merge.add(folder, len(parts) - 1, parts[-1], tree)
+    merge.add_up()
+    return root
+
+
+class _Merge:
+    """The trees being merged into a new root by merge_trees.
+
+    === Private Attributes ===
+    _children:
+        The subtrees of each folder that has had a tree merged into it, by
+        name, keyed by the id of the folder.
+    _touched:
+        Each folder that has had a tree merged into it, with its depth below
+        the root.
+    """
+    _children: Dict[int, Dict[str, FileSystemTree]]
+    _touched: List[Tuple[int, FileSystemTree]]
+
+    def __init__(self, root: FileSystemTree) -> None:
+        self._children = {id(root): {}}
+        self._touched = [(0, root)]
+
+    def _index(self, folder: FileSystemTree, depth: int
+               ) -> Dict[str, FileSystemTree]:
+        children = self._children.get(id(folder))
+        if children is None:
+            children = {sub._name: sub for sub in folder._subtrees}
+            self._children[id(folder)] = children
+            self._touched.append((depth, folder))
+        return children
+
+    def open(self, folder: FileSystemTree, depth: int, name: str
+             ) -> FileSystemTree:
+        """Return the folder called <name> in <folder>, at <depth>, making
+        it, in place of any file by that name, if there is none.
+        """
+        existing = self._index(folder, depth).get(name)
+        if existing is not None and existing._subtrees:
+            return existing
+        new = FileSystemTree.from_parts(name, [])
+        self._place(folder, depth, name, new)
+        return new
+
+    def add(self, folder: FileSystemTree, depth: int, name: str,
+            tree: FileSystemTree) -> None:
+        """Merge <tree> into <folder>, at <depth>, under the name <name>.
+        """
+        existing = self._index(folder, depth).get(name)
+        if existing is not None and tree._subtrees and existing._subtrees:
+            self._index(existing, depth + 1)
+            existing._mtime = max(existing._mtime, tree._mtime)
+            for sub in list(tree._subtrees):
+                self.add(existing, depth + 1, sub._name, sub)
+        elif existing is None or tree._subtrees or not existing._subtrees:
+            tree._name = name
+            self._place(folder, depth, name, tree)
+
+    def _place(self, folder: FileSystemTree, depth: int, name: str,
+               tree: FileSystemTree) -> None:
+        """Put <tree> in <folder> as its subtree called <name>, replacing the
+        subtree by that name, if there is one.
+        """
+        children = self._index(folder, depth)
+        existing = children.get(name)
+        tree._parent_tree = folder
+        if existing is None:
+            folder._subtrees.append(tree)
+        else:
+            folder._subtrees.replace(existing, tree)
+        children[name] = tree
+
+    def add_up(self) -> None:
+        """Add up the sizes of the folders trees were merged into, deepest
+        first, and when each was last modified.
+        """
+        self._touched.sort(key=lambda touched: touched[0], reverse=True)
+        for _, folder in self._touched:
+            folder.data_size = sum(sub.data_size for sub in folder._subtrees)
+            folder._mtime = max([folder._mtime] +
+                                [sub._mtime for sub in folder._subtrees])
+
+
+def merge_shards(filenames: Sequence[str], output: str,
+                 mounts: Optional[Sequence[Optional[str]]] = None,
+                 name: str = '', workers: Optional[int] = None) -> None:
+    """Save to <output> the snapshot of a folder called <name> that holds the
+    file systems in the snapshot files <filenames>, merged by path at
+    <mounts>, as for merge_trees.
+
+    The files are split into runs of files next to each other, one run for
+    each of <workers> processes (one per CPU by default), and each run is
+    merged into a temporary snapshot; those are then merged into <output>.
+    Since the runs keep the files in order, the later file's copy of each
+    file is still the one kept.
+
+    Raise ValueError if a snapshot is not of a file system.
+    """
+    filenames = list(filenames)
+    mounts = list(mounts) if mounts is not None else [None] * len(filenames)
+    # A run of one file gains nothing from being merged on its own.
+    runs = min(workers or os.cpu_count() or 1, len(filenames) // 2)
+    if runs < 2:
+        merge_snapshots(filenames, output, mounts, name)
+        return
+
+    bounds = [len(filenames) * i // runs for i in range(runs + 1)]
+    parts = []
+    try:
+        for _ in range(runs):
+            handle, part = tempfile.mkstemp(
+                suffix='.snap', dir=os.path.dirname(os.path.abspath(output)))
+            os.close(handle)
+            parts.append(part)
+        with ProcessPoolExecutor(max_workers=runs) as pool:
+            for future in [pool.submit(merge_snapshots,
+                                       filenames[start:end], part,
+                                       mounts[start:end])
+                           for start, end, part in zip(bounds, bounds[1:],
+                                                       parts)]:
+                future.result()
+        merge_snapshots(parts, output, [''] * runs, name)
+    finally:
+        for part in parts:
+            os.remove(part)
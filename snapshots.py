@@ -0,0 +1,535 @@
+"""A compact binary snapshot format for FileSystemTree and PaperTree.
+
+A snapshot file holds, in order:
+    - a header: magic bytes, the kind of tree, the number of nodes and the
+      number of strings;
+    - one fixed-size record per node in pre-order: the index of its parent
+      (-1 for the root), the index just past its last descendant, its
+      data_size, the indices of its name, authors and doi in the string
+      table, and its modification time (0 for papers);
+    - the string table: the byte offset of every string into the string data,
+      followed by the UTF-8 string data itself. String 0 is always ''.
+
+Because a node's descendants are exactly the records between its own index
+and its end index, a snapshot opened with load_snapshot can be browsed through
+mmap, and any subtree turned back into Python trees with Snapshot.to_tree,
+without reading the rest of the file.
+
+Snapshots of file systems can be merged with merge_snapshots, which copies the
+records of every subtree that does not overlap another snapshot as a block,
+without turning it into trees.
+"""
+import mmap
+import struct
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+
+from papers import PaperTree
+from tm_trees import TMTree, FileSystemTree
+
+try:
+    import numpy as np
+except ImportError:  # numpy only speeds up merge_snapshots
+    np = None
+
+MAGIC = b'TMSNAP01'
+KIND_FILE_SYSTEM = 0
+KIND_PAPERS = 1
+
+_HEADER = struct.Struct('<8sBxxxII')
+_RECORD = struct.Struct('<iiqIIIq')
+_OFFSET = struct.Struct('<Q')
+
+# The bytes taken in a snapshot by each node's record, and by the offset of
+# each distinct string.
+RECORD_SIZE = _RECORD.size
+STRING_OFFSET_SIZE = _OFFSET.size
+
+# The records of _RECORD as numpy sees them.
+_RECORD_FIELDS = [('parent', '<i4'), ('end', '<i4'), ('size', '<i8'),
+                  ('name', '<u4'), ('authors', '<u4'), ('doi', '<u4'),
+                  ('mtime', '<i8')]
+
+# How many records, or bytes of strings, merge_snapshots copies at a time,
+# and the fewest records worth handing to numpy.
+_COPY_RECORDS = 65536
+_COPY_BYTES = 1 << 24
+_NUMPY_RECORDS = 64
+
+
+def save_snapshot(tree: TMTree, filename: str) -> None:
+    """Save the FileSystemTree or PaperTree <tree> to <filename> as a binary
+    snapshot.
+
+    Raise ValueError if <tree> is not sized by the first of its METRICS,
+    the one snapshots are read back in.
+    """
+    if tree._root()._metric:
+        raise ValueError(f'{tree._name} is sized by {tree.get_metric()}, '
+                         f'not {tree.METRICS[0]}')
+    if isinstance(tree, PaperTree):
+        kind = KIND_PAPERS
+    elif isinstance(tree, FileSystemTree):
+        kind = KIND_FILE_SYSTEM
+    else:
+        raise TypeError(f'cannot snapshot a {type(tree).__name__}')
+
+    # Flatten the tree in pre-order, remembering each node's parent.
+    nodes = []
+    parents = []
+    stack = [(tree, -1)]
+    while stack:
+        node, parent = stack.pop()
+        index = len(nodes)
+        nodes.append(node)
+        parents.append(parent)
+        stack.extend((sub, index) for sub in reversed(node._subtrees))
+
+    # A node's subtree ends after its own record and all of its descendants'.
+    ends = list(range(1, len(nodes) + 1))
+    for i in range(len(nodes) - 1, 0, -1):
+        ends[parents[i]] = max(ends[parents[i]], ends[i])
+
+    strings: Dict[str, int] = {'': 0}
+    records = bytearray(_RECORD.size * len(nodes))
+    for i, node in enumerate(nodes):
+        authors = getattr(node, 'authors', '')
+        doi = getattr(node, 'doi', '')
+        _RECORD.pack_into(records, i * _RECORD.size, parents[i], ends[i],
+                          node.data_size,
+                          strings.setdefault(node._name, len(strings)),
+                          strings.setdefault(authors, len(strings)),
+                          strings.setdefault(doi, len(strings)),
+                          getattr(node, '_mtime', 0))
+
+    data = [s.encode('utf-8') for s in strings]
+    offsets = bytearray(_OFFSET.size * (len(data) + 1))
+    position = 0
+    for i, encoded in enumerate(data):
+        _OFFSET.pack_into(offsets, i * _OFFSET.size, position)
+        position += len(encoded)
+    _OFFSET.pack_into(offsets, len(data) * _OFFSET.size, position)
+
+    with open(filename, 'wb') as file:
+        file.write(_HEADER.pack(MAGIC, kind, len(nodes), len(data)))
+        file.write(records)
+        file.write(offsets)
+        file.writelines(data)
+
+
+def is_snapshot(filename: str) -> bool:
+    """Return whether <filename> is a snapshot file.
+    """
+    try:
+        with open(filename, 'rb') as file:
+            return file.read(len(MAGIC)) == MAGIC
+    except OSError:
+        return False
+
+
+def load_snapshot(filename: str) -> 'Snapshot':
+    """Open the snapshot saved in <filename>.
+    """
+    return Snapshot(filename)
+
+
+class Snapshot:
+    """A read-only view of a snapshot file, mapped into memory.
+
+    Nodes are referred to by their pre-order index, with the root at 0.
+    Nothing is read from the file until it is asked for.
+
+    === Public Attributes ===
+    kind:
+        KIND_FILE_SYSTEM or KIND_PAPERS.
+
+    === Private Attributes ===
+    _map:
+        The memory-mapped file.
+    _node_count:
+        The number of nodes in the snapshot.
+    _offsets_start:
+        The position of the string offsets in the file.
+    _data_start:
+        The position of the string data in the file.
+    """
+    kind: int
+    _map: mmap.mmap
+    _node_count: int
+    _offsets_start: int
+    _data_start: int
+
+    def __init__(self, filename: str) -> None:
+        with open(filename, 'rb') as file:
+            self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.kind, self._node_count, string_count = \
+            _HEADER.unpack_from(self._map)
+        if magic != MAGIC:
+            self._map.close()
+            raise ValueError(f'{filename} is not a treemap snapshot')
+        self._offsets_start = _HEADER.size + \
+            _RECORD.size * self._node_count
+        self._data_start = self._offsets_start + \
+            _OFFSET.size * (string_count + 1)
+
+    def __len__(self) -> int:
+        return self._node_count
+
+    def __enter__(self) -> 'Snapshot':
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """Release the file mapping. No nodes can be read afterwards.
+        """
+        self._map.close()
+
+    def _string_count(self) -> int:
+        return (self._data_start - self._offsets_start) // _OFFSET.size - 1
+
+    def _record(self, index: int) -> tuple:
+        if not 0 <= index < self._node_count:
+            raise IndexError(index)
+        return _RECORD.unpack_from(self._map,
+                                   _HEADER.size + _RECORD.size * index)
+
+    def _string(self, string: int) -> str:
+        start = self._offsets_start + _OFFSET.size * string
+        begin, = _OFFSET.unpack_from(self._map, start)
+        end, = _OFFSET.unpack_from(self._map, start + _OFFSET.size)
+        return self._map[self._data_start + begin:
+                         self._data_start + end].decode('utf-8')
+
+    def name(self, index: int) -> str:
+        """Return the name of node <index>.
+        """
+        return self._string(self._record(index)[3])
+
+    def size(self, index: int) -> int:
+        """Return the data_size of node <index>.
+        """
+        return self._record(index)[2]
+
+    def mtime(self, index: int) -> int:
+        """Return when node <index> was last modified, in nanoseconds since
+        the epoch, or 0 if that is not known.
+        """
+        return self._record(index)[6]
+
+    def describe(self, index: int) -> Tuple[str, int, int]:
+        """Return the name, data_size and modification time of node <index>,
+        reading its record only once.
+        """
+        _, _, size, name, _, _, mtime = self._record(index)
+        return self._string(name), size, mtime
+
+    def parent(self, index: int) -> Optional[int]:
+        """Return the index of the parent of node <index>, or None for the
+        root.
+        """
+        parent = self._record(index)[0]
+        return None if parent < 0 else parent
+
+    def children(self, index: int) -> Iterator[int]:
+        """Yield the indices of the children of node <index>, in order.
+        """
+        end = self._record(index)[1]
+        child = index + 1
+        while child < end:
+            yield child
+            child = self._record(child)[1]
+
+    def to_tree(self, index: int = 0) -> TMTree:
+        """Return the subtree rooted at node <index> as a FileSystemTree or
+        PaperTree, building only the nodes inside that subtree. Trees with the
+        same name, or papers by the same authors, share one copy of it.
+        """
+        end = self._record(index)[1]
+        built: Dict[int, List[TMTree]] = {}
+        # Each distinct string is stored once, so it is decoded once and
+        # shared by every tree that uses it.
+        strings: Dict[int, str] = {}
+
+        def string(i: int) -> str:
+            text = strings.get(i)
+            if text is None:
+                text = strings[i] = self._string(i)
+            return text
+
+        # Later siblings come first when walking backwards, so children are
+        # collected in reverse and flipped before their parent is built.
+        for i in range(end - 1, index - 1, -1):
+            parent, _, size, name, authors, doi, mtime = self._record(i)
+            subtrees = built.pop(i, [])
+            subtrees.reverse()
+            if self.kind == KIND_PAPERS:
+                node = PaperTree(string(name), subtrees, string(authors),
+                                 self._string(doi), size, False, False)
+            else:
+                node = FileSystemTree.from_parts(string(name), subtrees,
+                                                 size, mtime)
+            if i == index:
+                return node
+            built.setdefault(parent, []).append(node)
+        raise IndexError(index)
+
+
+def merge_snapshots(filenames: List[str], output: str,
+                    mounts: Optional[List[Optional[str]]] = None,
+                    name: str = '') -> None:
+    """Save to <output> the snapshot of a folder called <name> that holds the
+    file systems in the snapshot files <filenames>, merged by path.
+
+    Each snapshot is put at its mount in <mounts>: a path from the merged
+    folder, separated by /, whose last part becomes the name of the
+    snapshot's root. A mount of None is the name of the snapshot's root, and
+    a mount of '' merges what is in the snapshot's root into the merged
+    folder itself.
+
+    Where two snapshots have a folder at the same path, the folder holds what
+    is in both, and where they have a file at the same path, the file from
+    the later snapshot is kept. A folder is kept over a file. Everything else
+    is copied from its snapshot record by record, and sizes are only added
+    up again for the folders that hold more than one snapshot.
+
+    Raise ValueError if a snapshot is not of a file system.
+    """
+    snapshots = []
+    try:
+        for filename in filenames:
+            snapshots.append(Snapshot(filename))
+            if snapshots[-1].kind != KIND_FILE_SYSTEM:
+                raise ValueError(f'{filename} is not a snapshot of a file '
+                                 f'system')
+        root = _Merged(0)
+        for k, snapshot in enumerate(snapshots):
+            mount = mounts[k] if mounts is not None else None
+            if mount is None:
+                mount = snapshot.name(0)
+            parts = [part for part in mount.split('/') if part]
+            if not parts:
+                root.mtime = max(root.mtime, snapshot.mtime(0))
+                for j in snapshot.children(0):
+                    _plan(root, snapshot.name(j), snapshots, k, j)
+                continue
+            folder = root
+            for part in parts[:-1]:
+                folder = _open(folder, part, snapshots)
+            rename = parts[-1] if parts[-1] != snapshot.name(0) else None
+            _plan(folder, parts[-1], snapshots, k, 0, rename)
+        _count(root, snapshots)
+        _write_merged(root, name, snapshots, output)
+    finally:
+        for snapshot in snapshots:
+            snapshot.close()
+
+
+class _Merged:
+    """A folder in a merge of snapshots that holds nodes from more than one
+    snapshot, as planned by merge_snapshots.
+
+    === Public Attributes ===
+    children:
+        What is in the folder, by name: a _Merged for each folder that also
+        holds nodes from more than one snapshot, and a (snapshot, index,
+        rename) tuple for each node copied whole from a snapshot, where
+        rename is the name to give it, or None to keep its own.
+    mtime:
+        When the folder was last modified, before counting what is in it.
+    count:
+        The number of nodes in the merged folder, once counted.
+    size:
+        The data_size of the merged folder, once counted.
+    """
+    __slots__ = ('children', 'mtime', 'count', 'size')
+    children: Dict[str, Union['_Merged', Tuple[int, int, Optional[str]]]]
+    mtime: int
+    count: int
+    size: int
+
+    def __init__(self, mtime: int) -> None:
+        self.children = {}
+        self.mtime = mtime
+        self.count = 1
+        self.size = 0
+
+
+def _is_folder(snapshot: Snapshot, index: int) -> bool:
+    return snapshot._record(index)[1] > index + 1
+
+
+def _holds(entry: Union[_Merged, tuple], snapshots: List[Snapshot]) -> bool:
+    """Return whether <entry> in a _Merged folder is a folder with something
+    in it.
+    """
+    return isinstance(entry, _Merged) or \
+        _is_folder(snapshots[entry[0]], entry[1])
+
+
+def _open(folder: _Merged, name: str, snapshots: List[Snapshot]) -> _Merged:
+    """Return the folder called <name> in <folder> as a _Merged folder, so
+    more can be merged into it, making it first if there is no such folder.
+    """
+    entry = folder.children.get(name)
+    if isinstance(entry, _Merged):
+        return entry
+    if entry is not None and _holds(entry, snapshots):
+        snapshot = snapshots[entry[0]]
+        merged = _Merged(snapshot.mtime(entry[1]))
+        for j in snapshot.children(entry[1]):
+            merged.children[snapshot.name(j)] = (entry[0], j, None)
+    else:
+        merged = _Merged(0)
+    folder.children[name] = merged
+    return merged
+
+
+def _plan(folder: _Merged, name: str, snapshots: List[Snapshot], k: int,
+          index: int, rename: Optional[str] = None) -> None:
+    """Merge node <index> of snapshot <k>, under the name <name>, into
+    <folder>.
+    """
+    entry = folder.children.get(name)
+    snapshot = snapshots[k]
+    if entry is None:
+        folder.children[name] = (k, index, rename)
+    elif _is_folder(snapshot, index) and _holds(entry, snapshots):
+        merged = _open(folder, name, snapshots)
+        merged.mtime = max(merged.mtime, snapshot.mtime(index))
+        for j in snapshot.children(index):
+            _plan(merged, snapshot.name(j), snapshots, k, j)
+    elif _is_folder(snapshot, index) or not _holds(entry, snapshots):
+        folder.children[name] = (k, index, rename)
+
+
+def _count(folder: _Merged, snapshots: List[Snapshot]) -> None:
+    """Work out the count, size and mtime of <folder> and the _Merged folders
+    in it.
+    """
+    for entry in folder.children.values():
+        if isinstance(entry, _Merged):
+            _count(entry, snapshots)
+            count, size, mtime = entry.count, entry.size, entry.mtime
+        else:
+            _, end, size, _, _, _, mtime = snapshots[entry[0]]._record(
+                entry[1])
+            count = end - entry[1]
+        folder.count += count
+        folder.size += size
+        folder.mtime = max(folder.mtime, mtime)
+
+
+def _write_merged(root: _Merged, name: str, snapshots: List[Snapshot],
+                  output: str) -> None:
+    """Save the merge of <snapshots> planned in <root>, called <name>, to
+    <output>.
+    """
+    # The string table is every snapshot's table in turn, so each record
+    # copied only has to have its string indices shifted, then the names
+    # that are new.
+    bases = []
+    string_count = 0
+    for snapshot in snapshots:
+        bases.append(string_count)
+        string_count += snapshot._string_count()
+    new_strings: Dict[str, int] = {}
+
+    def string(text: str) -> int:
+        return new_strings.setdefault(text, string_count + len(new_strings))
+
+    with open(output, 'wb') as file:
+        file.write(_HEADER.pack(MAGIC, KIND_FILE_SYSTEM, root.count, 0))
+        position = 0
+        # Folders are written before what is in them, in pre-order.
+        stack = [(root, name, -1)]
+        while stack:
+            entry, entry_name, parent = stack.pop()
+            index = position
+            if isinstance(entry, _Merged):
+                file.write(_RECORD.pack(parent, index + entry.count,
+                                        entry.size, string(entry_name), 0, 0,
+                                        entry.mtime))
+                position += 1
+                stack.extend((child, child_name, index) for child_name, child
+                             in reversed(entry.children.items()))
+            else:
+                k, i, rename = entry
+                position += _copy_records(
+                    file, snapshots[k], i, index, parent, bases[k],
+                    None if rename is None else string(rename))
+
+        data_position = 0
+        for snapshot in snapshots:
+            count = snapshot._string_count()
+            offsets = snapshot._map[snapshot._offsets_start:
+                                    snapshot._data_start]
+            file.write(b''.join(
+                _OFFSET.pack(offset + data_position) for offset, in
+                _OFFSET.iter_unpack(offsets[:count * _OFFSET.size])))
+            data_position += _OFFSET.unpack_from(offsets,
+                                                 count * _OFFSET.size)[0]
+        encoded = [text.encode('utf-8') for text in new_strings]
+        for data in encoded:
+            file.write(_OFFSET.pack(data_position))
+            data_position += len(data)
+        file.write(_OFFSET.pack(data_position))
+
+        for snapshot in snapshots:
+            end = snapshot._data_start + _OFFSET.unpack_from(
+                snapshot._map, snapshot._data_start - _OFFSET.size)[0]
+            for start in range(snapshot._data_start, end, _COPY_BYTES):
+                file.write(snapshot._map[start:min(end, start + _COPY_BYTES)])
+        file.writelines(encoded)
+
+        file.seek(0)
+        file.write(_HEADER.pack(MAGIC, KIND_FILE_SYSTEM, root.count,
+                                string_count + len(new_strings)))
+
+
+def _copy_records(file: object, snapshot: Snapshot, index: int, base: int,
+                  parent: int, string_base: int, name: Optional[int]) -> int:
+    """Write the records of the subtree at <index> in <snapshot> to <file>,
+    as the subtree at <base> under <parent>, with the string indices shifted
+    by <string_base> and its root called string <name>, if given. Return the
+    number of records written.
+    """
+    record = snapshot._record(index)
+    end = record[1]
+    shift = base - index
+    if end == index + 1:
+        # A file, the most common thing to copy on its own.
+        file.write(_RECORD.pack(parent, base + 1, record[2],
+                                record[3] + string_base if name is None
+                                else name, record[4] + string_base,
+                                record[5] + string_base, record[6]))
+        return 1
+    for start in range(index, end, _COPY_RECORDS):
+        stop = min(end, start + _COPY_RECORDS)
+        data = snapshot._map[_HEADER.size + _RECORD.size * start:
+                             _HEADER.size + _RECORD.size * stop]
+        if np is not None and stop - start >= _NUMPY_RECORDS:
+            records = np.frombuffer(data, dtype=_RECORD_FIELDS).copy()
+            records['parent'] += shift
+            records['end'] += shift
+            for field in ('name', 'authors', 'doi'):
+                records[field] += string_base
+            out = bytearray(records.tobytes())
+        else:
+            out = bytearray(_RECORD.size * (stop - start))
+            for n, record in enumerate(_RECORD.iter_unpack(data)):
+                _RECORD.pack_into(out, n * _RECORD.size, record[0] + shift,
+                                  record[1] + shift, record[2],
+                                  record[3] + string_base,
+                                  record[4] + string_base,
+                                  record[5] + string_base,
+                                  record[6])
+        if start == index:
+            # The root of the subtree goes under its new parent.
+            root = list(_RECORD.unpack_from(out))
+            root[0] = parent
+            if name is not None:
+                root[3] = name
+            _RECORD.pack_into(out, 0, *root)
+        file.write(out)
+    return end - index
@@ -0,0 +1,191 @@
+"""A local HTTP server that serves a treemap as z/x/y PNG map tiles.
+
+At zoom level z the treemap is laid out on a square of TILE_SIZE * 2**z
+pixels, cut into 2**z by 2**z tiles, and expanded base_depth + z levels deep,
+so zooming in shows more of the tree. Only the subtrees overlapping a tile are
+laid out to render it, and rendered tiles are kept in a bounded LRU cache that
+is emptied whenever the tree is edited or coloured differently.
+"""
+import argparse
+import os
+import re
+import threading
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from typing import Optional, Tuple
+
+import pygame
+from tm_trees import TMTree, rectangle_arrays
+from treemap_visualiser import draw_rectangles, load_tree
+
+TILE_SIZE = 256
+MAX_ZOOM = 20  # keeps every tile coordinate within an int32
+_TILE_PATH = re.compile(r'^/(\d+)/(\d+)/(\d+)\.png$')
+
+
+class TileCache:
+    """A thread-safe, bounded cache of rendered tiles that evicts the least
+    recently used tile when full.
+
+    === Private Attributes ===
+    _tiles:
+        Encoded tiles keyed by (z, x, y), from least to most recently used.
+    _max_tiles:
+        The most tiles kept at once.
+    _version:
+        The version of the tree the cached tiles were rendered from, with
+        anything else that changes how they look.
+    _lock:
+        Guards all of the above.
+    """
+    _tiles: OrderedDict
+    _max_tiles: int
+    _version: Optional[tuple]
+    _lock: threading.Lock
+
+    def __init__(self, max_tiles: int) -> None:
+        self._tiles = OrderedDict()
+        self._max_tiles = max_tiles
+        self._version = None
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._tiles)
+
+    def get(self, key: Tuple[int, int, int],
+            version: tuple) -> Optional[bytes]:
+        """Return the tile cached under <key>, or None if there is none for
+        this <version> of the tree.
+        """
+        with self._lock:
+            if version != self._version:
+                self._tiles.clear()
+                self._version = version
+                return None
+            tile = self._tiles.get(key)
+            if tile is not None:
+                self._tiles.move_to_end(key)
+            return tile
+
+    def put(self, key: Tuple[int, int, int], version: tuple,
+            tile: bytes) -> None:
+        """Cache <tile> under <key> if it was rendered from the current
+        <version> of the tree.
+        """
+        with self._lock:
+            if version != self._version:
+                return
+            self._tiles[key] = tile
+            self._tiles.move_to_end(key)
+            while len(self._tiles) > self._max_tiles:
+                self._tiles.popitem(last=False)
+
+
+class TileServer(ThreadingHTTPServer):
+    """An HTTP server for the tiles of one treemap, answering
+    GET /<z>/<x>/<y>.png.
+
+    === Public Attributes ===
+    tree:
+        The tree being served.
+    base_depth:
+        The number of levels expanded at zoom level 0.
+    cache:
+        The rendered tiles.
+    """
+    tree: TMTree
+    base_depth: int
+    cache: TileCache
+
+    def __init__(self, tree: TMTree, port: int = 0, host: str = '127.0.0.1',
+                 base_depth: int = 1, cache_size: int = 1024) -> None:
+        """Serve <tree> on <host>:<port>, which default to loopback and a free
+        port; the chosen port is in self.server_address.
+        """
+        ThreadingHTTPServer.__init__(self, (host, port), _TileHandler)
+        self.tree = tree
+        self.base_depth = base_depth
+        self.cache = TileCache(cache_size)
+
+    def get_tile(self, z: int, x: int, y: int) -> Optional[bytes]:
+        """Return tile (<x>, <y>) of zoom level <z> as PNG data, or None if
+        there is no such tile.
+        """
+        if z > MAX_ZOOM or x >= 2 ** z or y >= 2 ** z:
+            return None
+        # With the tree shared between threads, edits wait until the tile is
+        # cached; without, a tile the tree changed under is not cached.
+        with self.tree.reading():
+            version = self.get_version()
+            tile = self.cache.get((z, x, y), version)
+            if tile is None:
+                tile = self.render_tile(z, x, y)
+                if self.get_version() == version:
+                    self.cache.put((z, x, y), version, tile)
+        return tile
+
+    def get_version(self) -> tuple:
+        """Return a value that changes whenever the tiles would look
+        different: the version of the tree, and how it is coloured.
+        """
+        return self.tree.get_version(), self.tree._root()._colour_policy
+
+    def render_tile(self, z: int, x: int, y: int) -> bytes:
+        """Render tile (<x>, <y>) of zoom level <z> and return it as PNG data.
+        """
+        world = TILE_SIZE * 2 ** z
+        left, top = x * TILE_SIZE, y * TILE_SIZE
+        tile_rect = (left, top, TILE_SIZE, TILE_SIZE)
+        rectangles = self.tree.iter_layout((0, 0, world, world),
+                                           self.base_depth + z, tile_rect)
+        rects, colours = rectangle_arrays(
+            ((rx - left, ry - top, width, height), colour)
+            for (rx, ry, width, height), colour in rectangles)
+
+        surface = pygame.Surface((TILE_SIZE, TILE_SIZE))
+        draw_rectangles(surface, rects, colours)
+        data = BytesIO()
+        pygame.image.save(surface, data, 'tile.png')
+        return data.getvalue()
+
+
+class _TileHandler(BaseHTTPRequestHandler):
+    """Answers tile requests for the TileServer it belongs to.
+    """
+    server: TileServer
+
+    def do_GET(self) -> None:
+        match = _TILE_PATH.match(self.path)
+        tile = self.server.get_tile(*map(int, match.groups())) \
+            if match else None
+        if tile is None:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/png')
+        self.send_header('Content-Length', str(len(tile)))
+        self.end_headers()
+        self.wfile.write(tile)
+
+    def log_message(self, format: str, *args: object) -> None:
+        pass
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Serve a treemap as z/x/y PNG tiles on this machine.')
+    parser.add_argument('source', help='folder, file, or papers CSV file')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--depth', type=int, default=1,
+                        help='levels expanded at zoom level 0 (default 1)')
+    parser.add_argument('--cache-size', type=int, default=1024,
+                        help='rendered tiles kept in memory (default 1024)')
+    args = parser.parse_args()
+
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    server = TileServer(load_tree(args.source), args.port,
+                        base_depth=args.depth, cache_size=args.cache_size)
+    print('Serving tiles at http://%s:%d/{z}/{x}/{y}.png'
+          % server.server_address)
+    server.serve_forever()
@@ -1,9 +1,62 @@
 from __future__ import annotations
 
+import json
 import math
 import os
-from random import randint
-from typing import List, Tuple, Optional
+import threading
+from heapq import heappop, heappush, heapreplace
+from contextlib import contextmanager, nullcontext
+from itertools import chain
+from queue import Empty, Queue
+from typing import ContextManager, Dict, Iterable, Iterator, List, Tuple, \
+    Optional
+
+from archives import is_archive, list_members
+from colours import ColourPolicy, PathColours
+from scan_rules import SKIPPED_NAME, ScanRules
+
+try:
+    import numpy as np
+except ImportError:  # numpy is only needed for get_rectangle_arrays
+    np = None
+
+# Stands in for a lock on trees that are only used by one thread.
+_NO_LOCK = nullcontext()
+
+# Colours trees that have no other colour policy.
+_PATH_COLOURS = PathColours()
+
+
+class _LazyColour:
+    """Works out the colour of a tree from the colour policy of its whole
+    tree the first time it is read. The colour is then stored on the tree,
+    where later reads find it first.
+
+    Colours are first read while drawing, which several threads may do at
+    once under a shared read lock, so they are worked out one at a time: a
+    policy may keep what it has worked out so far, and a colour is only
+    stored once.
+
+    === Private Attributes ===
+    _lock:
+        Held while a colour is worked out and stored. Reentrant, since a
+        policy may read the colours of other trees.
+    """
+    _lock: threading.RLock
+
+    def __init__(self) -> None:
+        self._lock = threading.RLock()
+
+    def __get__(self, tree: Optional[TMTree], owner: type
+                ) -> Tuple[int, int, int]:
+        if tree is None:
+            return self
+        with self._lock:
+            colour = tree.__dict__.get('_colour')
+            if colour is None:
+                policy = tree._root()._colour_policy or _PATH_COLOURS
+                colour = tree.__dict__['_colour'] = policy.colour(tree)
+            return colour
 
 
 class TMTree:
@@ -12,23 +65,21 @@ class TMTree:
 
     This is an abstract class that should not be instantiated directly.
 
-    You may NOT add any attributes, public or private, to this class.
-    However, part of this assignment will involve you implementing new public
-    *methods* for this interface.
-    You should not add any new public methods other than those required by
-    the client code.
-    You can, however, freely add private methods as needed.
-
     === Public Attributes ===
     rect:
         The pygame rectangle representing this node in the treemap
         visualization.
     data_size:
-        The size of the data represented by this tree.
+        The size of the data represented by this tree, in the metric in use.
+    METRICS:
+        The names of the ways this kind of tree can be sized, the first being
+        the one data_size is given in when the tree is made. The second
+        counts leaves. See set_metric.
 
     === Private Attributes ===
     _colour:
-        The RGB colour value of the root of this tree.
+        The RGB colour value of the root of this tree. Worked out by the
+        colour policy of the whole tree the first time it is read, unless set.
     _name:
         The root value of this tree, or None if this tree is empty.
     _subtrees:
@@ -38,6 +89,33 @@ class TMTree:
         as a subtree, or None if this tree is not part of a larger tree.
     _expanded:
         Whether or not this tree is considered expanded for visualization.
+    _version:
+        The number of times the tree rooted here has been edited by move,
+        change_size or delete_self. Only kept up to date on the root.
+    _lock:
+        The lock shared by every tree in the whole tree containing this one,
+        or None if it is only used by one thread. See enable_concurrency.
+    _batch:
+        The edits of the batch in progress, or None. Only used on the root.
+    _journal:
+        The record of edits for undo and redo, or None if edits are not being
+        recorded. Only used on the root. See start_journal.
+    _colour_policy:
+        How the trees are coloured, or None for colours by path. Only used on
+        the root. See set_colour_policy.
+    _metrics:
+        The size of this leaf in each of METRICS, as last known, or None if
+        it was only ever given a data_size; then it counts 1 leaf and has
+        its data_size in every other metric. Once _summed, the size of a
+        folder in each of METRICS too. The size in the metric in use may be
+        out of date: data_size is kept instead.
+    _metric:
+        The index in METRICS of the metric data_size is in. Only used on the
+        root.
+    _summed:
+        Whether every folder keeps its size in each of METRICS, which is added
+        up the first time the metric is switched, and kept up to date by every
+        edit after that. Only used on the root.
 
     === Representation Invariants ===
     - data_size >= 0
@@ -60,15 +138,25 @@ class TMTree:
 
     rect: Tuple[int, int, int, int]
     data_size: int
-    _colour: Tuple[int, int, int]
+    _colour = _LazyColour()
     _name: str
     _subtrees: List[TMTree]
     _parent_tree: Optional[TMTree]
     _expanded: bool
+    _version: int
+    _lock: Optional[_RWLock]
+    _batch: Optional[_Batch]
+    _journal: Optional[Journal]
+    _colour_policy: Optional[ColourPolicy]
+    METRICS: Tuple[str, ...] = ('size', 'leaves')
+    _metrics: Optional[Tuple[int, ...]] = None
+    _metric: int = 0
+    _summed: bool = False
 
     def __init__(self, name: str, subtrees: List[TMTree],
                  data_size: int = 0) -> None:
-        """Initialize a new TMTree with a random colour and the provided <name>.
+        """Initialize a new TMTree with the provided <name>. Its colour is
+        chosen by the colour policy of its tree when it is first needed.
 
         If <subtrees> is empty, use <data_size> to initialize this tree's
         data_size.
@@ -89,20 +177,18 @@ class TMTree:
         """
         self.rect = (0, 0, 0, 0)
         self._name = name
-        self._subtrees = subtrees[:]
+        self._subtrees = _Subtrees(subtrees)
         self._parent_tree = None
 
         # You will change this in Task 5
         self._expanded = False
+        self._version = 0
+        self._lock = None
+        self._batch = None
+        self._journal = None
 
-        # 1. Initialize self._colour and self.data_size, according to the
-        # docstring.
-        # 2. Set this tree as the parent for each of its subtrees.
+        self._colour_policy = None
 
-        r1 = randint(0, 255)
-        r2 = randint(0, 255)
-        r3 = randint(0, 255)
-        self._colour = (r1, r2, r3)
         # You should not get os.datasize() for folders, only files.
         if self._name is None or not self._subtrees:
             self.data_size = data_size
@@ -146,6 +232,11 @@ class TMTree:
         (0, 0, 50, 60)
 
         """
+        # Laying out writes the rect of every tree, so it is an edit.
+        with self.writing():
+            self._update_rectangles(rect)
+
+    def _update_rectangles(self, rect: Tuple[int, int, int, int]) -> None:
         # Read the handout carefully to help get started identifying base cases,
         # then write the outline of a recursive step.
         #
@@ -158,46 +249,41 @@ class TMTree:
         if self.data_size == 0:
             self.rect = (0, 0, 0, 0)
             for subtree in self._subtrees:
-                subtree.update_rectangles((0, 0, 0, 0))
-        elif not self._subtrees or not self._expanded:
+                subtree._update_rectangles((0, 0, 0, 0))
+        elif not self._expanded or not self._subtrees:
             self.rect = (x, y, width, height)
         else:
-            if width > height:  # horizontal rectangles
-                self._update_horiz_rectangles(rect)
-
-            elif width <= height:  # vertical rectangles
-                self._update_vert_rectangles(rect)
-
-    def _update_horiz_rectangles(self, rect: Tuple[int, int, int, int]) -> None:
-        x, y, width, height = rect
-        curr_width = 0
-        # truncate every subtree but the last
-        for i in range(len(self._subtrees) - 1):
-            if self.data_size == 0:  # avoid ZeroDivisionError
-                new_width = 0
-            else:
-                new_width = int(width * (self._subtrees[i].data_size
-                                         / self.data_size))
-            self._subtrees[i].update_rectangles(
-                (x + curr_width, y, new_width, height))
-            curr_width += new_width
-        self._subtrees[-1].update_rectangles(
-            (x + curr_width, y, width - curr_width, height))
-
-    def _update_vert_rectangles(self, rect: Tuple[int, int, int, int]) -> None:
+            for subtree, sub_rect in zip(self._subtrees,
+                                         self._child_rectangles(rect)):
+                subtree._update_rectangles(sub_rect)
+
+    def _child_rectangles(self, rect: Tuple[int, int, int, int]
+                          ) -> Iterator[Tuple[int, int, int, int]]:
+        """Yield the rectangle of each subtree, in order, when <rect> is split
+        between them in proportion to their data_size.
+
+        The split is horizontal if <rect> is wider than it is tall, and
+        vertical otherwise. Every share but the last is truncated, and the last
+        subtree takes whatever is left over.
+        """
         x, y, width, height = rect
-        curr_height = 0
-        for i in range(len(self._subtrees) - 1):
-            if self.data_size == 0:
-                new_height = 0
+        horizontal = width > height  # horizontal rectangles
+        length = width if horizontal else height
+        curr = 0
+        last = len(self._subtrees) - 1
+        for i, subtree in enumerate(self._subtrees):
+            if i == last:
+                new_length = length - curr
+            elif self.data_size == 0:  # avoid ZeroDivisionError
+                new_length = 0
             else:
-                new_height = int(height * (self._subtrees[i].data_size
+                new_length = int(length * (subtree.data_size
                                            / self.data_size))
-            self._subtrees[i].update_rectangles(
-                (x, y + curr_height, width, new_height))
-            curr_height += new_height
-        self._subtrees[-1].update_rectangles(
-            (x, y + curr_height, width, height - curr_height))
+            if horizontal:
+                yield x + curr, y, new_length, height
+            else:
+                yield x, y + curr, width, new_length
+            curr += new_length
 
     def get_rectangles(self) -> List[Tuple[Tuple[int, int, int, int],
                                            Tuple[int, int, int]]]:
@@ -210,15 +296,97 @@ class TMTree:
         >>> rect[0][0]
         (0, 0, 0, 0)
         """
-        lst = []
-        if self.data_size == 0:
-            return []
-        if not self._subtrees or not self._expanded:  # if leaf
-            return [(self.rect, self._colour)]
-        else:
-            for subtree in self._subtrees:
-                lst.extend(subtree.get_rectangles())
-        return lst
+        return list(self.iter_rectangles())
+
+    def iter_rectangles(self, clip: Optional[Tuple[int, int, int, int]] = None
+                        ) -> Iterator[Tuple[Tuple[int, int, int, int],
+                                            Tuple[int, int, int]]]:
+        """Yield the same (rect, colour) tuples as get_rectangles, in the same
+        order, without building any intermediate lists.
+
+        If <clip> is given, only leaves whose rectangle intersects the pygame
+        rectangle <clip> are yielded, and displayed subtrees lying entirely
+        outside of <clip> are skipped without visiting their descendants.
+
+        The tree is held for reading from the first rectangle until the
+        iterator is used up or closed, so the thread using it must not edit
+        the tree in between, and edits from other threads wait for it.
+        >>> left = TMTree("left", [], 10)
+        >>> right = TMTree("right", [], 10)
+        >>> tree = TMTree("root", [left, right])
+        >>> tree.expand()
+        >>> tree.update_rectangles((0, 0, 100, 50))
+        >>> [rect for rect, _ in tree.iter_rectangles((60, 0, 10, 10))]
+        [(50, 0, 50, 50)]
+        """
+        with self.reading():
+            # An explicit stack keeps this a flat loop regardless of depth.
+            stack = [self]
+            while stack:
+                tree = stack.pop()
+                if tree.data_size == 0:
+                    continue
+                if clip is not None and not _intersects(tree.rect, clip):
+                    continue
+                if not tree._expanded or not tree._subtrees:  # if leaf
+                    yield tree.rect, tree._colour
+                else:
+                    stack.extend(reversed(tree._subtrees))
+
+    def get_rectangle_arrays(self, clip: Optional[Tuple[int, int, int, int]]
+                             = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Return the rectangles and colours of every leaf in the
+        displayed-tree rooted at this tree as a pair of contiguous numpy
+        arrays: an N x 4 int32 array of pygame rectangles, and an N x 3 uint8
+        array of colours. Row i of each array describes the same leaf, in the
+        same order as get_rectangles.
+
+        <clip> has the same meaning as in iter_rectangles.
+        >>> tree = TMTree("1", [], 20)
+        >>> tree.update_rectangles((0, 0, 50, 60))
+        >>> rects, colours = tree.get_rectangle_arrays()
+        >>> rects.tolist()
+        [[0, 0, 50, 60]]
+        >>> colours.shape
+        (1, 3)
+        """
+        return rectangle_arrays(self.iter_rectangles(clip))
+
+    def iter_layout(self, rect: Tuple[int, int, int, int], depth: int,
+                    clip: Optional[Tuple[int, int, int, int]] = None
+                    ) -> Iterator[Tuple[Tuple[int, int, int, int],
+                                        Tuple[int, int, int]]]:
+        """Yield the (rect, colour) tuples that get_rectangles would return if
+        this tree were expanded <depth> levels deep and laid out in <rect>,
+        without changing the rect or expansion of any tree.
+
+        <clip> has the same meaning as in iter_rectangles, and the tree is
+        held for reading while iterating, as it is there.
+        >>> left = TMTree("left", [], 10)
+        >>> right = TMTree("right", [], 30)
+        >>> tree = TMTree("root", [left, right])
+        >>> [r for r, _ in tree.iter_layout((0, 0, 100, 50), 1)]
+        [(0, 0, 25, 50), (25, 0, 75, 50)]
+        >>> [r for r, _ in tree.iter_layout((0, 0, 100, 50), 0)]
+        [(0, 0, 100, 50)]
+        >>> tree.rect
+        (0, 0, 0, 0)
+        """
+        with self.reading():
+            stack = [(self, rect, depth)]
+            while stack:
+                tree, rect, depth = stack.pop()
+                if tree.data_size == 0:
+                    continue
+                if clip is not None and not _intersects(rect, clip):
+                    continue
+                if depth <= 0 or not tree._subtrees:
+                    yield rect, tree._colour
+                else:
+                    children = list(zip(tree._subtrees,
+                                        tree._child_rectangles(rect)))
+                    for subtree, sub_rect in reversed(children):
+                        stack.append((subtree, sub_rect, depth - 1))
 
     def get_tree_at_position(self, pos: Tuple[int, int]) -> Optional[TMTree]:
         """Return the leaf in the displayed-tree rooted at this tree whose
@@ -232,8 +400,11 @@ class TMTree:
         >>> obj._name
         '1'
         """
+        with self.reading():
+            return self._get_tree_at_position(pos)
 
-        if not self._subtrees or not self._expanded:
+    def _get_tree_at_position(self, pos: Tuple[int, int]) -> Optional[TMTree]:
+        if not self._expanded or not self._subtrees:
             mouse_x, mouse_y = pos
             lower_x = self.rect[0]
             lower_y = self.rect[1]
@@ -242,11 +413,117 @@ class TMTree:
                 return self
         else:
             for subtree in self._subtrees:
-                leaf = subtree.get_tree_at_position(pos)
+                leaf = subtree._get_tree_at_position(pos)
                 if leaf is not None:
                     return leaf
         return None
 
+    def get_largest(self, k: int, leaves: bool = True) -> List[TMTree]:
+        """Return the <k> largest leaves in this tree, or the <k> largest
+        trees below this one if <leaves> is False, largest first.
+
+        Trees are visited biggest first, and a subtree is skipped as soon as
+        it is smaller than the k-th largest leaf seen so far, since none of
+        its leaves could make the list.
+        >>> leaves = [TMTree(str(i), [], i) for i in range(1, 6)]
+        >>> tree = TMTree("root", [TMTree("a", leaves[:3]),
+        ...                        TMTree("b", leaves[3:])])
+        >>> [leaf._name for leaf in tree.get_largest(2)]
+        ['5', '4']
+        >>> [sub._name for sub in tree.get_largest(2, leaves=False)]
+        ['b', 'a']
+        """
+        found = []
+        if k <= 0:
+            return found
+        with self.reading():
+            # The trees left to visit, biggest first, with a counter to break
+            # ties in visiting order.
+            frontier = [(-self.data_size, 0, self)]
+            count = 1
+            # The sizes of the k largest leaves seen so far, smallest first.
+            best: List[int] = []
+            while frontier and len(found) < k:
+                _, _, tree = heappop(frontier)
+                if leaves:
+                    if not tree._subtrees:
+                        found.append(tree)
+                        continue
+                elif tree is not self:
+                    found.append(tree)
+                bound = best[0] if leaves and len(best) == k else 0
+                for sub in tree._subtrees:
+                    size = sub.data_size
+                    if size < bound:
+                        continue
+                    if leaves and not sub._subtrees:
+                        if len(best) < k:
+                            heappush(best, size)
+                        elif size > best[0]:
+                            heapreplace(best, size)
+                        if len(best) == k:
+                            bound = best[0]
+                    heappush(frontier, (-size, count, sub))
+                    count += 1
+        return found
+
+    def get_at_least(self, size: int, leaves: bool = True) -> List[TMTree]:
+        """Return every leaf in this tree whose data_size is at least <size>,
+        or every tree below this one if <leaves> is False, largest first.
+
+        Subtrees smaller than <size> are not looked into.
+        >>> leaves = [TMTree(str(i), [], i) for i in range(1, 6)]
+        >>> tree = TMTree("root", [TMTree("a", leaves[:3]),
+        ...                        TMTree("b", leaves[3:])])
+        >>> [leaf._name for leaf in tree.get_at_least(3)]
+        ['5', '4', '3']
+        >>> TMTree('a', [], 1).get_at_least(5)
+        []
+        """
+        found = []
+        with self.reading():
+            stack = [self] if self.data_size >= size else []
+            while stack:
+                tree = stack.pop()
+                if leaves:
+                    if not tree._subtrees:
+                        found.append(tree)
+                        continue
+                elif tree is not self:
+                    found.append(tree)
+                stack.extend(sub for sub in tree._subtrees
+                             if sub.data_size >= size)
+        found.sort(key=lambda tree: tree.data_size, reverse=True)
+        return found
+
+    def get_above_percentile(self, percentile: float,
+                             leaves: bool = True) -> List[TMTree]:
+        """Return the leaves in this tree, or the trees below this one if
+        <leaves> is False, that are larger than <percentile> percent of them,
+        largest first.
+
+        Counting the trees takes one pass over the whole tree; the largest
+        ones are then found as by get_largest.
+        >>> leaves = [TMTree(str(i), [], i) for i in range(1, 11)]
+        >>> tree = TMTree("root", leaves)
+        >>> [leaf._name for leaf in tree.get_above_percentile(80)]
+        ['10', '9']
+        """
+        with self.reading():
+            count = 0
+            stack = [self]
+            while stack:
+                tree = stack.pop()
+                if leaves:
+                    if not tree._subtrees:
+                        count += 1
+                        continue
+                elif tree is not self:
+                    count += 1
+                stack.extend(tree._subtrees)
+            k = count - math.floor(count * percentile / 100)
+            return self.get_largest(k, leaves)
+
     def update_data_sizes(self) -> int:
         """Update the data_size for this tree and its subtrees, based on the
         size of their leaves, and return the new size.
@@ -256,13 +533,16 @@ class TMTree:
         >>> tree.update_data_sizes()
         20
         """
+        with self.writing():
+            return self._update_data_sizes()
 
+    def _update_data_sizes(self) -> int:
         if not self._subtrees:
             return self.data_size
         else:
             size = 0
             for sub in self._subtrees:
-                size += sub.update_data_sizes()
+                size += sub._update_data_sizes()
             self.data_size = size
             return self.data_size
 
@@ -280,14 +560,20 @@ class TMTree:
         >>> dest._subtrees[1]._name
         '1'
         """
-        if not self._subtrees and destination._subtrees:
-            destination._subtrees.append(self)
-            self._parent_tree._subtrees.remove(self)
-            if not self._parent_tree._subtrees:
-                self._parent_tree._expanded = False
-                self._parent_tree.data_size = 0
-            destination._update_all_data_sizes()
-            self._parent_tree = destination
+        with self.writing():
+            if not self._subtrees and destination._subtrees:
+                source = self._parent_tree
+                expanded = source._expanded
+                index = None if self._root()._journal is None \
+                    else source._subtrees.index_of(self)
+                self._detach()
+                self._attach(destination)
+                # Colours may depend on where a tree is, as PathColours do.
+                self.__dict__.pop('_colour', None)
+                if not source._subtrees:
+                    source._expanded = False
+                self._record(('move', self, source, index, destination,
+                              expanded))
 
     def change_size(self, factor: float) -> None:
         """Change the value of this tree's data_size attribute by <factor>.
@@ -302,20 +588,352 @@ class TMTree:
         50
         """
         size = 0
+        with self.writing():
+            if not self._subtrees:
+                if factor >= 0:
+                    size = math.ceil(factor)
+                elif factor < 0:
+                    size = math.floor(factor)
+                self._change_size_by(size)
+
+    def _change_size_by(self, amount: int,
+                        metric: Optional[int] = None) -> None:
+        """Add <amount> to the size of this leaf in the metric at index
+        <metric> of METRICS, or in the metric in use, keeping it at least 1.
+        """
+        active = self._root()._metric
+        if metric is None:
+            metric = active
+        size = self.data_size if metric == active \
+            else self._leaf_metrics(active)[metric]
+        delta = max(1, size + amount) - size
+        self._resize_metric(metric, delta)
+        if delta:
+            self._record(('size', self, delta, metric))
+
+    def _resize_metric(self, metric: int, delta: int) -> None:
+        """Change the size of this leaf in the metric at index <metric> of
+        METRICS by <delta>, and bring the sizes of its ancestors up to date.
+        """
+        root = self._root()
+        if metric == root._metric:
+            self._resize(delta)
+            return
+        change = tuple(delta if index == metric else 0
+                       for index in range(len(self.METRICS)))
+        self._metrics = _plus(self._leaf_metrics(root._metric), change)
+        tree = self._parent_tree
+        while root._summed and tree is not None:
+            tree._metrics = _plus(tree._metrics, change)
+            tree = tree._parent_tree
+        root._version += 1
+
+    def _detach(self) -> None:
+        """Remove this tree from its parent's subtrees, and take its size off
+        its parent and their ancestors. An emptied parent gets size 0, in
+        every metric.
+        """
+        parent = self._parent_tree
+        parent._subtrees.discard(self)
+        self._shift_metrics(-1)
+        if not parent._subtrees:
+            parent._metrics = (0,) * len(parent.METRICS)
+            parent._resize(-parent.data_size)
+        else:
+            parent._resize(-self.data_size)
+
+    def _attach(self, parent: TMTree, index: Optional[int] = None) -> None:
+        """Add this tree to <parent>'s subtrees at <index>, or at the end, and
+        add its size to <parent> and their ancestors.
+        """
+        if index is None:
+            parent._subtrees.append(self)
+        else:
+            parent._subtrees.insert_at(index, self)
+        self._parent_tree = parent
+        self._lock = parent._lock
+        self._shift_metrics(1)
+        if len(parent._subtrees) == 1:
+            parent._resize(self.data_size - parent.data_size)
+        else:
+            parent._resize(self.data_size)
+
+    def _shift_metrics(self, sign: int) -> None:
+        """Add this tree's sizes in each of METRICS, times <sign>, to the
+        sizes its parent and their ancestors keep, if they keep them.
+        """
+        root = self._root()
+        if not root._summed:
+            return
         if not self._subtrees:
-            if factor >= 0:
-                size = math.ceil(factor)
-            elif factor < 0:
-                size = math.floor(factor)
-            self.data_size = max(1, self.data_size + size)
-            self._update_all_data_sizes()
-
-    def _update_all_data_sizes(self) -> None:
-        if self._parent_tree:
-            self._parent_tree._update_all_data_sizes()
+            self._metrics = self._leaf_metrics(root._metric)
+        change = tuple(sign * size for size in self._metrics)
+        tree = self._parent_tree
+        while tree is not None:
+            tree._metrics = _plus(tree._metrics, change)
+            tree = tree._parent_tree
+
+    def _record(self, edit: tuple) -> None:
+        """Tell the journal, if there is one, and the root about <edit>, in
+        the form kept by Journal, which has just been made.
+        """
+        root = self._root()
+        if root._journal is not None:
+            root._journal.record(edit)
+        root._edited(edit, False)
+
+    def _edited(self, edit: tuple, undone: bool) -> None:
+        """Called on the root after <edit>, in the form kept by Journal, has
+        been made, or undone if <undone>. Subclasses that keep data about the
+        whole tree bring it up to date here.
+        """
+
+    def _resize(self, delta: int) -> None:
+        """Change this tree's data_size by <delta>, and bring the sizes of its
+        ancestors up to date, or leave that to the end of the current batch.
+        """
+        self.data_size += delta
+        root = self._root()
+        if root._colour_policy is not None and root._colour_policy.uses_size:
+            tree = self
+            while tree is not None:
+                tree.__dict__.pop('_colour', None)
+                tree = tree._parent_tree
+        if root._batch is not None:
+            if self._parent_tree is not None:
+                root._batch.changed.append(self._parent_tree)
+            return
+        tree = self._parent_tree
+        while tree is not None:
+            tree.data_size += delta
+            tree = tree._parent_tree
+        root._version += 1
+
+    def _root(self) -> TMTree:
+        root = self
+        while root._parent_tree is not None:
+            root = root._parent_tree
+        return root
+
+    @contextmanager
+    def batch(self) -> Iterator[None]:
+        """Return a context manager in which edits by move, change_size and
+        delete_self to the whole tree containing this tree are only partly
+        applied: the sizes of the edited trees' ancestors and the layout are
+        brought up to date once, when the outermost batch ends, touching each
+        affected ancestor only once however many edits were made under it.
+
+        Until then, data_size may be out of date for ancestors of edited trees,
+        and rectangles are not updated. Batches may be nested.
+        >>> leaves = [TMTree(str(i), [], 10) for i in range(3)]
+        >>> tree = TMTree("root", leaves)
+        >>> with tree.batch():
+        ...     for leaf in leaves:
+        ...         leaf.change_size(5)
+        ...     tree.data_size
+        30
+        >>> tree.data_size
+        45
+        """
+        root = self._root()
+        with root.writing():
+            if root._batch is None:
+                root._batch = _Batch()
+            root._batch.depth += 1
+            try:
+                yield
+            finally:
+                root._batch.depth -= 1
+                if root._batch.depth == 0:
+                    batch, root._batch = root._batch, None
+                    batch.apply(root)
+
+    def get_version(self) -> int:
+        """Return a number that changes whenever the whole tree containing
+        this tree is edited by move, change_size or delete_self.
+        >>> tree = TMTree("1", [], 20)
+        >>> tree2 = TMTree("2", [tree], 30)
+        >>> before = tree2.get_version()
+        >>> tree.change_size(5)
+        >>> tree2.get_version() == before
+        False
+        """
+        return self._root()._version
+
+    def set_colour_policy(self, policy: ColourPolicy,
+                          lazy: bool = False) -> None:
+        """Colour the whole tree containing this tree by <policy>, from now
+        on. If <lazy> is True, each tree is only coloured when it is next
+        drawn; otherwise all of them are coloured now, in one pass.
+        >>> from colours import SizeColours
+        >>> tree = TMTree("1", [], 20)
+        >>> tree2 = TMTree("2", [tree], 30)
+        >>> tree.set_colour_policy(SizeColours(10))
+        >>> tree2._colour
+        (127, 64, 127)
+        """
+        root = self._root()
+        with root.writing():
+            root._colour_policy = policy
+            if not lazy:
+                policy.assign(root)
+                return
+            stack = [root]
+            while stack:
+                tree = stack.pop()
+                tree.__dict__.pop('_colour', None)
+                stack.extend(tree._subtrees)
+
+    def get_metric(self) -> str:
+        """Return the name of the metric data_size is in, one of METRICS.
+        >>> TMTree('1', [], 20).get_metric()
+        'size'
+        """
+        return self.METRICS[self._root()._metric]
+
+    def set_metric(self, metric: str) -> None:
+        """Size every tree in the whole tree containing this one by <metric>,
+        one of METRICS, instead of the metric in use. Lay the tree out again
+        afterwards to show it.
+
+        Every leaf already knows its size in every metric, so nothing is read
+        again. The folders are added up from their leaves the first time, and
+        after that every edit keeps their sizes in every metric, so switching
+        only swaps each size for the one kept. Edits made before switching can
+        still be undone, in the metric they were made in.
+
+        Raise ValueError if <metric> is not one of METRICS.
+        >>> tree = TMTree('root', [TMTree('a', [], 10), TMTree('b', [], 5)])
+        >>> tree.set_metric('leaves')
+        >>> tree.data_size
+        2
+        >>> tree.set_metric('size')
+        >>> tree.data_size
+        15
+        """
+        if metric not in self.METRICS:
+            raise ValueError(f'{metric} is not one of '
+                             f'{", ".join(self.METRICS)}')
+        root = self._root()
+        new = self.METRICS.index(metric)
+        with root.writing():
+            old = root._metric
+            if new == old:
+                return
+            uncolour = root._colour_policy is not None and \
+                root._colour_policy.uses_size
+            # Deleted trees can be put back by undo, so they are switched too.
+            trees = [root]
+            if root._journal is not None:
+                trees.extend(root._journal.deleted())
+            if not root._summed:
+                for tree in trees:
+                    tree._sum_metrics(old)
+                root._summed = True
+            stack = trees
+            while stack:
+                tree = stack.pop()
+                metrics = tree._metrics
+                # Only a size changed in the metric in use is out of date.
+                if metrics[old] != tree.data_size:
+                    metrics = list(metrics)
+                    metrics[old] = tree.data_size
+                    tree._metrics = metrics = tuple(metrics)
+                tree.data_size = metrics[new]
+                if uncolour:
+                    tree.__dict__.pop('_colour', None)
+                if tree._subtrees:
+                    stack.extend(tree._subtrees)
+            root._metric = new
+            root._version += 1
+
+    def _sum_metrics(self, active: int) -> Tuple[int, ...]:
+        """Give every tree in this tree its size in each of METRICS, adding
+        up the folders from their leaves, while data_size is in the metric at
+        index <active>, and return the sizes of this tree.
+        """
+        # A folder comes after everything in it in the reverse of a
+        # pre-order walk, so it can be added up from them.
+        order = []
+        stack = [self]
+        while stack:
+            tree = stack.pop()
+            order.append(tree)
+            stack.extend(tree._subtrees)
+        for tree in reversed(order):
+            if tree._subtrees:
+                tree._metrics = tuple(map(sum, zip(
+                    *(sub._metrics for sub in tree._subtrees))))
+            else:
+                tree._metrics = tree._leaf_metrics(active)
+        return self._metrics
+
+    def _leaf_metrics(self, active: int) -> Tuple[int, ...]:
+        """Return the size of this leaf in each of METRICS, while its
+        data_size is in the metric at index <active>.
+        """
+        if self._metrics is None:
+            metrics = [self.data_size] * len(self.METRICS)
+            metrics[1] = 1
         else:
-            self.update_data_sizes()
-        return
+            metrics = list(self._metrics)
+        metrics[active] = self.data_size
+        return tuple(metrics)
+
+    def start_journal(self) -> Journal:
+        """Start recording the edits made by move, change_size and delete_self
+        to the whole tree containing this tree, so that they can be undone, and
+        return the Journal they are recorded in. If they are already being
+        recorded, return the existing Journal.
+        >>> tree = TMTree("1", [], 20)
+        >>> tree2 = TMTree("2", [tree], 30)
+        >>> journal = tree2.start_journal()
+        >>> tree.start_journal() is journal
+        True
+        """
+        root = self._root()
+        if root._journal is None:
+            root._journal = Journal(root)
+        return root._journal
+
+    def enable_concurrency(self) -> None:
+        """Make the whole tree containing this tree safe to share between
+        threads, by giving all of its trees one shared reader/writer lock.
+
+        Afterwards, reading methods such as iter_rectangles and
+        get_tree_at_position may run in several threads at once, while
+        editing methods such as move, change_size, delete_self, expand,
+        collapse and update_rectangles, which writes every rect, wait for all
+        of them and run alone, so no thread ever sees a half-finished edit or
+        layout. A thread may nest calls freely, except that it must not start
+        an edit while it is in the middle of reading.
+        >>> tree = TMTree("1", [], 20)
+        >>> tree2 = TMTree("2", [tree], 30)
+        >>> tree2.enable_concurrency()
+        >>> tree._lock is tree2._lock
+        True
+        """
+        root = self._root()
+        lock = root._lock or _RWLock()
+        stack = [root]
+        while stack:
+            tree = stack.pop()
+            tree._lock = lock
+            stack.extend(tree._subtrees)
+
+    def reading(self) -> ContextManager:
+        """Return a context manager that holds the tree's lock for reading, so
+        that several reads happen without an edit in between. Does nothing
+        unless enable_concurrency has been called.
+        """
+        return _NO_LOCK if self._lock is None else self._lock.reading()
+
+    def writing(self) -> ContextManager:
+        """Return a context manager that holds the tree's lock for editing, so
+        that several edits are seen by other threads all at once. Does nothing
+        unless enable_concurrency has been called.
+        """
+        return _NO_LOCK if self._lock is None else self._lock.writing()
 
     def delete_self(self) -> bool:
         """Removes the current node from the visualization and
@@ -333,14 +951,20 @@ class TMTree:
         >>> tree2._subtrees
         []
         """
-        if self._parent_tree is not None:
-            self._parent_tree._subtrees.remove(self)
-            if not self._parent_tree._subtrees:
-                self._parent_tree.data_size = 0
-            self._parent_tree.update_rectangles(self._parent_tree.rect)
-            self._parent_tree._update_all_data_sizes()
-            return True
-        return False
+        with self.writing():
+            parent = self._parent_tree
+            if parent is not None:
+                index = None if self._root()._journal is None \
+                    else parent._subtrees.index_of(self)
+                self._detach()
+                self._record(('delete', self, parent, index))
+                batch = self._root()._batch
+                if batch is not None:
+                    batch.relayout = True
+                else:
+                    parent.update_rectangles(parent.rect)
+                return True
+            return False
 
     def expand(self) -> None:
         """
@@ -354,9 +978,10 @@ class TMTree:
         >>> tree2._expanded
         True
         """
-        if self._subtrees:
-            self._expanded = True
-        self.update_rectangles(self.rect)
+        with self.writing():
+            if self._subtrees:
+                self._expanded = True
+            self.update_rectangles(self.rect)
 
     def expand_all(self) -> None:
         """
@@ -377,10 +1002,34 @@ class TMTree:
         >>> tree3._expanded
         True
         """
-        if self._subtrees:
-            self.expand()
+        with self.writing():
+            if self._subtrees:
+                self.expand()
+                for subtree in self._subtrees:
+                    subtree.expand_all()
+
+    def expand_to_depth(self, depth: int) -> None:
+        """
+        Expand this tree and its descendants so that the displayed-tree shows
+        at most <depth> levels below this tree. Nothing is laid out; call
+        update_rectangles afterwards.
+        >>> tree = TMTree("1", [], 20)
+        >>> tree2 = TMTree("2", [tree], 30)
+        >>> tree3 = TMTree("3", [tree2], 40)
+        >>> tree3.expand_to_depth(1)
+        >>> tree3._expanded
+        True
+        >>> tree2._expanded
+        False
+        """
+        with self.writing():
+            self._expand_to_depth(depth)
+
+    def _expand_to_depth(self, depth: int) -> None:
+        if depth > 0 and self._subtrees:
+            self._expanded = True
             for subtree in self._subtrees:
-                subtree.expand_all()
+                subtree._expand_to_depth(depth - 1)
 
     def collapse(self) -> None:
         """
@@ -400,8 +1049,9 @@ class TMTree:
         >>> tree5._expanded
         True
         """
-        if self._parent_tree is not None:
-            self._parent_tree._collapse_helper()
+        with self.writing():
+            if self._parent_tree is not None:
+                self._parent_tree._collapse_helper()
 
     def collapse_all(self) -> None:
         """
@@ -421,11 +1071,12 @@ class TMTree:
         >>> tree5._expanded
         False
         """
-        if self._parent_tree is not None:
-            self._parent_tree.collapse_all()
-        else:
-            # sets all of its children's _expanded to false
-            self._collapse_all_helper()
+        with self.writing():
+            if self._parent_tree is not None:
+                self._parent_tree.collapse_all()
+            else:
+                # sets all of its children's _expanded to false
+                self._collapse_all_helper()
 
     def _collapse_helper(self) -> None:
         if self._subtrees:
@@ -465,6 +1116,643 @@ class TMTree:
         raise NotImplementedError
 
 
+class _Batch:
+    """The edits made so far in a batch (see TMTree.batch).
+
+    === Public Attributes ===
+    depth:
+        How many batches are open, counting nested ones.
+    changed:
+        The trees whose subtrees changed in size, or were added or removed.
+    relayout:
+        Whether the tree needs laying out again at the end of the batch.
+    """
+    depth: int
+    changed: List[TMTree]
+    relayout: bool
+
+    def __init__(self) -> None:
+        self.depth = 0
+        self.changed = []
+        self.relayout = False
+
+    def apply(self, root: TMTree) -> None:
+        """Bring the sizes of the changed trees and their ancestors up to date,
+        deepest first, then lay out <root> again if needed.
+        """
+        depths: Dict[TMTree, int] = {}
+        for tree in self.changed:
+            # Climb to the root, or to the first ancestor already seen, then
+            # number the path on the way back down.
+            path = []
+            while tree is not None and tree not in depths:
+                path.append(tree)
+                tree = tree._parent_tree
+            depth = -1 if tree is None else depths[tree]
+            for tree in reversed(path):
+                depth += 1
+                depths[tree] = depth
+
+        for tree in sorted(depths, key=depths.get, reverse=True):
+            if tree._subtrees:
+                tree.data_size = sum(sub.data_size for sub in tree._subtrees)
+        if self.relayout:
+            root.update_rectangles(root.rect)
+        root._version += 1
+
+
+class Journal:
+    """The edits made to a tree by move, change_size and delete_self, kept so
+    that they can be undone, redone, saved and replayed on another tree.
+
+    Each edit is stored as the few values needed to reverse it: the change in
+    size, or the parent and position a tree was moved or deleted from. Undoing
+    or redoing an edit updates sizes along one path to the root, rather than
+    over the whole tree, and does not lay the tree out again. The paths save
+    writes out are taken when each edit is made, so saving changes nothing.
+
+    === Private Attributes ===
+    _root:
+        The root of the tree being edited.
+    _done:
+        The edits that can be undone, oldest first, each with the path it is
+        saved under. Each edit is ('size', tree, change in size, index in
+        METRICS of the metric it is in), ('move', tree, old parent, old
+        position, new parent, whether the old parent was expanded) or
+        ('delete', tree, parent, position). Each path is
+        (the path of the tree's parent, its name, the path of the new parent
+        of a move or None).
+    _undone:
+        The edits that can be redone, most recently undone last, each with
+        the path it is saved under.
+    _paths:
+        The path of names from the root of each parent of an edited tree,
+        as a tuple shared by all of the edits in it.
+    """
+    _root: TMTree
+    _done: List[Tuple[tuple, tuple]]
+    _undone: List[Tuple[tuple, tuple]]
+    _paths: Dict[TMTree, Tuple[str, ...]]
+
+    def __init__(self, root: TMTree) -> None:
+        self._root = root
+        self._done = []
+        self._undone = []
+        self._paths = {}
+
+    def __len__(self) -> int:
+        return len(self._done)
+
+    def record(self, edit: tuple) -> None:
+        """Record <edit>, which has just been made, forgetting any edits that
+        were undone before it.
+        """
+        # Each tree is named by its path of names from the root as it was
+        # just before the edit, which the edit did not change above it.
+        kind, tree = edit[0], edit[1]
+        parent = tree._parent_tree if kind == 'size' else edit[2]
+        path = (self._path(parent), tree._name,
+                self._path(edit[4]) if kind == 'move' else None)
+        if kind == 'move':
+            self._moved(tree)
+        self._done.append((edit, path))
+        self._undone.clear()
+
+    def _path(self, folder: TMTree) -> Tuple[str, ...]:
+        """Return the path of names from the root to <folder>, remembering
+        it, and the paths of the folders above it, for the next edits.
+        """
+        missing = []
+        while folder not in self._paths and folder._parent_tree is not None:
+            missing.append(folder)
+            folder = folder._parent_tree
+        path = self._paths.get(folder, ())
+        for folder in reversed(missing):
+            path = self._paths[folder] = path + (folder._name,)
+        return path
+
+    def _moved(self, tree: TMTree) -> None:
+        """Forget the path of <tree>, which has been moved. Only leaves are
+        moved, but an emptied folder is a leaf, and may have had a path.
+        """
+        self._paths.pop(tree, None)
+
+    def clear(self) -> None:
+        """Forget every edit, so none can be undone or redone."""
+        self._done.clear()
+        self._undone.clear()
+        self._paths.clear()
+
+    def deleted(self) -> List[TMTree]:
+        """Return the trees deleted by the edits that can be undone."""
+        return [edit[1] for edit, _ in self._done if edit[0] == 'delete']
+
+    def can_undo(self) -> bool:
+        """Return whether there is an edit to undo."""
+        return bool(self._done)
+
+    def can_redo(self) -> bool:
+        """Return whether there is an undone edit to redo."""
+        return bool(self._undone)
+
+    def undo(self) -> bool:
+        """Undo the most recent edit, and return whether there was one.
+        >>> leaf = TMTree("1", [], 20)
+        >>> folder = TMTree("2", [leaf])
+        >>> journal = folder.start_journal()
+        >>> leaf.change_size(5)
+        >>> journal.undo()
+        True
+        >>> folder.data_size
+        20
+        >>> journal.redo()
+        True
+        >>> folder.data_size
+        25
+        """
+        with self._root.writing():
+            if not self._done:
+                return False
+            edit, saved = self._done.pop()
+            kind, tree = edit[0], edit[1]
+            if kind == 'size':
+                tree._resize_metric(edit[3], -edit[2])
+            elif kind == 'move':
+                tree._detach()
+                tree._attach(edit[2], edit[3])
+                tree.__dict__.pop('_colour', None)
+                edit[2]._expanded = edit[5]
+                self._moved(tree)
+            else:
+                tree._attach(edit[2], edit[3])
+            self._undone.append((edit, saved))
+            self._root._edited(edit, True)
+            return True
+
+    def redo(self) -> bool:
+        """Make the most recently undone edit again, and return whether there
+        was one.
+        """
+        with self._root.writing():
+            if not self._undone:
+                return False
+            edit, saved = self._undone.pop()
+            kind, tree = edit[0], edit[1]
+            if kind == 'size':
+                tree._resize_metric(edit[3], edit[2])
+            elif kind == 'move':
+                tree._detach()
+                tree._attach(edit[4])
+                tree.__dict__.pop('_colour', None)
+                if not edit[2]._subtrees:
+                    edit[2]._expanded = False
+                self._moved(tree)
+            else:
+                tree._detach()
+            self._done.append((edit, saved))
+            self._root._edited(edit, False)
+            return True
+
+    def save(self, filename: str) -> None:
+        """Save the edits that can be undone to <filename> as JSON, naming
+        each tree by its path of names from the root, so they can be replayed
+        on another tree with replay_journal. The tree is left as it is.
+        """
+        edits = []
+        with self._root.reading():
+            for edit, (parent, name, to) in self._done:
+                saved = {'edit': edit[0], 'path': list(parent) + [name]}
+                if edit[0] == 'size':
+                    saved['delta'] = edit[2]
+                    saved['metric'] = self._root.METRICS[edit[3]]
+                elif edit[0] == 'move':
+                    saved['to'] = list(to)
+                edits.append(saved)
+        with open(filename, 'w') as file:
+            json.dump({'edits': edits}, file, indent=1)
+
+
+def replay_journal(tree: TMTree, filename: str) -> int:
+    """Make the edits saved by Journal.save in <filename> to <tree>, such as
+    a fresh scan of the same folder, and return how many were made.
+
+    Edits to trees that are not found by name in <tree>, or that could not be
+    made there, are skipped. Sizes are changed by the same amounts as before,
+    in the same metric, but never below 1. Lay <tree> out again afterwards.
+    """
+    with open(filename) as file:
+        edits = json.load(file)['edits']
+    # Subtrees by name, for each tree whose subtrees have been looked up.
+    names: Dict[int, Dict[str, TMTree]] = {}
+
+    def find(path: List[str]) -> Optional[TMTree]:
+        node = tree
+        for name in path:
+            if id(node) not in names:
+                names[id(node)] = {}
+                for sub in node._subtrees:
+                    names[id(node)].setdefault(sub._name, sub)
+            node = names[id(node)].get(name)
+            if node is None:
+                return None
+        return node
+
+    made = 0
+    with tree.batch():
+        for edit in edits:
+            node = find(edit['path'])
+            if node is None or node is tree:
+                continue
+            parent = node._parent_tree
+            if edit['edit'] == 'size':
+                metric = edit.get('metric', tree.get_metric())
+                if node._subtrees or metric not in tree.METRICS:
+                    continue
+                node._change_size_by(edit['delta'], tree.METRICS.index(metric))
+            elif edit['edit'] == 'move':
+                destination = find(edit['to'])
+                if destination is None or node._subtrees or \
+                        not destination._subtrees:
+                    continue
+                node.move(destination)
+                names.get(id(destination), {}).setdefault(node._name, node)
+            else:
+                node.delete_self()
+            removed = edit['edit'] == 'delete' or \
+                node._parent_tree is not parent
+            if removed and names[id(parent)].get(node._name) is node:
+                del names[id(parent)][node._name]
+            made += 1
+    return made
+
+
+def in_tree(node: TMTree, root: TMTree) -> bool:
+    """Return whether <node> is in the tree <root>. A deleted tree still
+    knows its parent, but is no longer one of its parent's subtrees.
+    >>> leaf = TMTree('a', [], 1)
+    >>> root = TMTree('root', [leaf, TMTree('b', [], 1)])
+    >>> in_tree(leaf, root)
+    True
+    >>> leaf.delete_self()
+    True
+    >>> in_tree(leaf, root)
+    False
+    """
+    while node is not root:
+        parent = node._parent_tree
+        if parent is None:
+            return False
+        try:
+            parent._subtrees.index_of(node)
+        except ValueError:
+            return False
+        node = parent
+    return True
+
+
+def _names_from_root(tree: TMTree) -> List[str]:
+    """Return the names of the trees on the path from the root down to
+    <tree>, leaving out the root.
+    """
+    names = []
+    while tree._parent_tree is not None:
+        names.append(tree._name)
+        tree = tree._parent_tree
+    names.reverse()
+    return names
+
+
+class _RWLock:
+    """A reader/writer lock that lets any number of threads read at once, or
+    one thread write. Both kinds of hold are reentrant, and the writing thread
+    may also read. Waiting writers are let in before new readers.
+
+    === Private Attributes ===
+    _condition:
+        Guards the other attributes and is notified when the lock is freed.
+    _readers:
+        The number of read holds of each reading thread, by thread id.
+    _writer:
+        The id of the writing thread, or None.
+    _writes:
+        The number of write holds of the writing thread.
+    _waiting_writers:
+        The number of threads waiting to write.
+    """
+    _condition: threading.Condition
+    _readers: Dict[int, int]
+    _writer: Optional[int]
+    _writes: int
+    _waiting_writers: int
+
+    def __init__(self) -> None:
+        self._condition = threading.Condition(threading.Lock())
+        self._readers = {}
+        self._writer = None
+        self._writes = 0
+        self._waiting_writers = 0
+
+    @contextmanager
+    def reading(self) -> Iterator[None]:
+        me = threading.get_ident()
+        with self._condition:
+            if self._writer != me and me not in self._readers:
+                while self._writer is not None or self._waiting_writers:
+                    self._condition.wait()
+            self._readers[me] = self._readers.get(me, 0) + 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._readers[me] -= 1
+                if not self._readers[me]:
+                    del self._readers[me]
+                    self._condition.notify_all()
+
+    @contextmanager
+    def writing(self) -> Iterator[None]:
+        me = threading.get_ident()
+        with self._condition:
+            if self._writer != me:
+                if me in self._readers:
+                    raise RuntimeError('cannot edit a tree while reading it')
+                self._waiting_writers += 1
+                while self._writer is not None or self._readers:
+                    self._condition.wait()
+                self._waiting_writers -= 1
+                self._writer = me
+            self._writes += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._writes -= 1
+                if not self._writes:
+                    self._writer = None
+                    self._condition.notify_all()
+
+
+# Marks the slot of a subtree removed from a _Subtrees list.
+_REMOVED = object()
+
+
+class _Subtrees(list):
+    """The subtrees of a TMTree: a list, in display order, that can also have
+    subtrees appended and discarded in constant time.
+
+    A discarded subtree leaves a _REMOVED placeholder behind, so nothing else
+    has to shift. The placeholders are dropped in one pass by the next edit
+    that moves subtrees around, or once they take up half of the list. Reads
+    skip them without changing the list, so any number of threads may read
+    it at once: while there are placeholders, they read a list of the
+    subtrees without them, made by the first read after each edit. Apart
+    from len() and append, every list operation sees the list without its
+    placeholders.
+
+    === Private Attributes ===
+    _dead:
+        The number of _REMOVED placeholders in the list.
+    _positions:
+        The index of every subtree, by id, or None until the first discard
+        after the list last changed shape.
+    _view:
+        The subtrees without the placeholders, or None until they are next
+        read. Never changed once made, so readers can share it.
+    _counts:
+        A Fenwick tree counting the placeholders, so that the position of a
+        subtree can be found by counting the placeholders before it in
+        O(log n), or None until the first discard after the list last
+        changed shape.
+    """
+    __slots__ = ('_dead', '_positions', '_view', '_counts')
+    _dead: int
+    _positions: Optional[Dict[int, int]]
+    _view: Optional[List[TMTree]]
+    _counts: Optional[List[int]]
+
+    def __init__(self, subtrees: Iterable[TMTree] = ()) -> None:
+        list.__init__(self, subtrees)
+        self._dead = 0
+        self._positions = None
+        self._view = None
+        self._counts = None
+
+    def __reduce__(self) -> Tuple[type, Tuple[List[TMTree]]]:
+        # The slots are not pickled with the list, so it is rebuilt whole.
+        return _Subtrees, (list(self),)
+
+    def __len__(self) -> int:
+        return list.__len__(self) - self._dead
+
+    # The methods used while laying out and drawing are written out in full;
+    # the rest are wrapped below.
+    def __iter__(self) -> Iterator[TMTree]:
+        if self._dead:
+            return iter(self._live())
+        return list.__iter__(self)
+
+    def __reversed__(self) -> Iterator[TMTree]:
+        if self._dead:
+            return reversed(self._live())
+        return list.__reversed__(self)
+
+    def append(self, subtree: TMTree) -> None:
+        if self._positions is not None:
+            self._positions[id(subtree)] = list.__len__(self)
+        if self._counts is not None:
+            # The new node of the Fenwick tree covers the slots ending with
+            # the new one, which holds no placeholder.
+            size = len(self._counts)
+            self._counts.append(self._dead_before(size - 1) -
+                                self._dead_before(size - (size & -size)))
+        list.append(self, subtree)
+        self._view = None
+
+    def discard(self, subtree: TMTree) -> None:
+        """Remove <subtree> from this list, leaving the others in order.
+
+        Raise ValueError if <subtree> is not in this list.
+        """
+        index = self._slot(subtree)
+        del self._positions[id(subtree)]
+        list.__setitem__(self, index, _REMOVED)
+        if self._counts is None:
+            self._counts = [0] * (list.__len__(self) + 1)
+        self._count(index, 1)
+        self._dead += 1
+        self._view = None
+        if self._dead > 16 and 2 * self._dead > list.__len__(self):
+            self._compact()
+
+    def replace(self, old: TMTree, new: TMTree) -> None:
+        """Put <new> in the place of <old> in this list, without moving
+        anything else.
+
+        Raise ValueError if <old> is not in this list.
+        """
+        index = self._slot(old)
+        del self._positions[id(old)]
+        self._positions[id(new)] = index
+        list.__setitem__(self, index, new)
+        self._view = None
+
+    def index_of(self, subtree: TMTree) -> int:
+        """Return the position of <subtree> in this list, as it would be seen
+        by list operations, without dropping any placeholders.
+
+        Raise ValueError if <subtree> is not in this list.
+        """
+        index = self._slot(subtree)
+        if not self._dead:
+            return index
+        return index - self._dead_before(index)
+
+    def insert_at(self, index: int, subtree: TMTree) -> None:
+        """Insert <subtree> at position <index>, as seen by list operations.
+        If a placeholder is there, put it in its slot, so nothing else has to
+        shift, as when a discard is undone.
+        """
+        if self._dead:
+            slot = self._live_slot(index)
+            if slot and list.__getitem__(self, slot - 1) is _REMOVED:
+                list.__setitem__(self, slot - 1, subtree)
+                self._positions[id(subtree)] = slot - 1
+                self._count(slot - 1, -1)
+                self._dead -= 1
+                self._view = None
+                return
+        self.insert(index, subtree)
+
+    def _count(self, slot: int, change: int) -> None:
+        """Add <change> to the number of placeholders in <slot>."""
+        counts = self._counts
+        node = slot + 1
+        while node < len(counts):
+            counts[node] += change
+            node += node & -node
+
+    def _dead_before(self, slot: int) -> int:
+        """Return the number of placeholders before <slot>."""
+        counts = self._counts
+        total = 0
+        while slot:
+            total += counts[slot]
+            slot &= slot - 1
+        return total
+
+    def _live_slot(self, index: int) -> int:
+        """Return the slot of the subtree at position <index>, as seen by
+        list operations, or the length of the list if there is none.
+        """
+        counts = self._counts
+        size = len(counts) - 1
+        slot = 0
+        left = index + 1
+        step = 1 << size.bit_length()
+        while step:
+            node = slot + step
+            if node <= size and step - counts[node] < left:
+                slot = node
+                left -= step - counts[node]
+            step >>= 1
+        return slot
+
+    def _slot(self, subtree: TMTree) -> int:
+        if self._positions is None:
+            self._positions = {id(sub): i
+                               for i, sub in enumerate(list.__iter__(self))
+                               if sub is not _REMOVED}
+        index = self._positions.get(id(subtree))
+        if index is None:
+            raise ValueError('subtree is not in this list')
+        return index
+
+    def _live(self) -> List[TMTree]:
+        """Return the subtrees without the placeholders, as a list that must
+        not be changed."""
+        view = self._view
+        if view is None:
+            # Readers that get here at once each make the same list; the
+            # last one kept is as good as any.
+            view = [sub for sub in list.__iter__(self) if sub is not _REMOVED]
+            self._view = view
+        return view
+
+    def _compact(self) -> None:
+        # Only called by edits, which hold the tree for writing.
+        list.__setitem__(self, slice(None), self._live())
+        self._dead = 0
+        self._positions = None
+        self._view = None
+        self._counts = None
+
+
+def _reading(name: str) -> object:
+    """Return the list method <name>, made to skip any placeholders."""
+    method = getattr(list, name)
+
+    def wrapper(self: _Subtrees, *args: object) -> object:
+        if self._dead:
+            return method(self._live(), *args)
+        return method(self, *args)
+    wrapper.__name__ = name
+    return wrapper
+
+
+def _reshaping(name: str) -> object:
+    """Return the list method <name>, made to drop any placeholders first and
+    forget the positions it may move subtrees from."""
+    method = getattr(list, name)
+
+    def wrapper(self: _Subtrees, *args: object, **kwargs: object) -> object:
+        if self._dead:
+            self._compact()
+        self._positions = None
+        self._view = None
+        self._counts = None
+        return method(self, *args, **kwargs)
+    wrapper.__name__ = name
+    return wrapper
+
+
+for _name in ('__getitem__', '__contains__', '__eq__', '__ne__', '__lt__',
+              '__le__', '__gt__', '__ge__', '__add__', '__mul__', '__rmul__',
+              '__repr__', 'index', 'count', 'copy'):
+    setattr(_Subtrees, _name, _reading(_name))
+for _name in ('__setitem__', '__delitem__', '__iadd__', '__imul__', 'extend',
+              'insert', 'pop', 'remove', 'clear', 'sort', 'reverse'):
+    setattr(_Subtrees, _name, _reshaping(_name))
+del _name
+
+
+def rectangle_arrays(rectangles: Iterable[Tuple[Tuple[int, int, int, int],
+                                                 Tuple[int, int, int]]]
+                     ) -> Tuple[np.ndarray, np.ndarray]:
+    """Return the (rect, colour) tuples in <rectangles> as an N x 4 int32
+    array of rectangles and an N x 3 uint8 array of colours.
+    """
+    if np is None:
+        raise ImportError('rectangle arrays require numpy')
+    pairs = list(rectangles)
+    rects = np.fromiter(chain.from_iterable(rect for rect, _ in pairs),
+                        dtype=np.int32, count=4 * len(pairs))
+    colours = np.fromiter(chain.from_iterable(c for _, c in pairs),
+                          dtype=np.uint8, count=3 * len(pairs))
+    return rects.reshape(-1, 4), colours.reshape(-1, 3)
+
+
+def _intersects(rect: Tuple[int, int, int, int],
+                other: Tuple[int, int, int, int]) -> bool:
+    """Return True iff the pygame rectangles <rect> and <other> share some
+    area. Rectangles with no area never overlap anything.
+    """
+    x, y, width, height = rect
+    other_x, other_y, other_width, other_height = other
+    return width > 0 and height > 0 and \
+        x < other_x + other_width and other_x < x + width and \
+        y < other_y + other_height and other_y < y + height
+
+
 class FileSystemTree(TMTree):
     """A tree representation of files and folders in a file system.
 
@@ -476,10 +1764,39 @@ class FileSystemTree(TMTree):
 
     The data_size attribute for regular files is simply the size of the file,
     as reported by os.path.getsize.
-    """
 
-    def __init__(self, path: str) -> None:
+    A tree can instead be sized by the number of files in it, or by the space
+    allocated to its files on disk, which is collected by the same scan; see
+    set_metric. Files whose allocation is not known, such as ones not scanned
+    one by one, count as taking their size.
+
+    === Private Attributes ===
+    _mtime:
+        When this file, or this folder or anything in it, was last modified
+        before the scan, in nanoseconds since the epoch; 0 if unknown.
+    _extensions:
+        The files of this tree grouped by extension, or None if they have not
+        been grouped yet. Only set on the root. See get_extension_view.
+    _skipped:
+        Whether this tree stands for files and folders that were not scanned,
+        and was sized without listing them one by one. See ScanRules.
+    _pending:
+        Whether this is a folder whose files and folders a BackgroundScan has
+        yet to add. It is empty until then, but is not a file, so its size
+        cannot be changed.
+    """
+    _mtime: int
+    _extensions: Optional[ExtensionTree] = None
+    _skipped: bool = False
+    _pending: bool = False
+    METRICS = ('bytes', 'files', 'blocks')
+
+    def __init__(self, path: str, rules: Optional[ScanRules] = None,
+                 archives: bool = False) -> None:
         """Store the file tree structure contained in the given file or folder.
+        Leave out the files and folders that <rules> leave out, if given. If
+        <archives>, zip and tar files are shown as folders of what is in them;
+        see ArchiveTree.
 
         Precondition: <path> is a valid path for this computer.
         >>> EXAMPLE_PATH = os.path.join(os.getcwd(), 'example-directory', 'workshop')
@@ -489,23 +1806,230 @@ class FileSystemTree(TMTree):
         >>> rects[0][0]
         (0, 0, 1, 1)
         """
+        # The sizes of the files by extension and top-level folder, added up
+        # during the scan for the extension view.
+        totals: Dict[Tuple[str, str], int] = {}
+        self._scan_into(path, totals, None, rules, archives=archives,
+                        names={})
+        if archives and not self._subtrees and is_archive(path):
+            # The files in the archive are grouped when first asked for.
+            _load_archive(self, path)
+        else:
+            self._extensions = ExtensionTree(self, totals)
+
+    def _scan_into(self, path: str, totals: Dict[Tuple[str, str], int],
+                   top: Optional[str], rules: Optional[ScanRules] = None,
+                   relative: str = '', device: Optional[int] = None,
+                   archives: bool = False,
+                   names: Optional[Dict[str, str]] = None) -> None:
+        """Initialize this tree from the file or folder at <path>, which is
+        under the top-level folder <top>, or is at the top if <top> is None.
+        Add the size of each file found to <totals>.
+
+        If <rules> are given, <path> is at <relative> from the folder being
+        scanned, which is on <device> (or <path> is that folder, if None).
+        If <archives>, the archives in the folder are made ArchiveTrees.
+        If <names> are given, every name found is looked up in them, and
+        added if it is not there, so trees with the same name share it.
+        """
         # Remember that you should recursively go through the file system
         # and create new FileSystemTree objects for each file and folder
         # encountered.
         #
         # Also remember to make good use of the superclass constructor!
         _name = os.path.basename(path)
+        if names is not None:
+            _name = names.setdefault(_name, _name)
         if os.path.isdir(path):  # folders
+            info = os.stat(path)
             size = 0
-            subs = []
-            for sub_path in os.listdir(path):
-                subs.append(FileSystemTree(os.path.join(path, sub_path)))
+            if rules is None:
+                subs = []
+                for sub_path in os.listdir(path):
+                    full_path = os.path.join(path, sub_path)
+                    sub = _new_tree(full_path, archives)
+                    sub._scan_into(full_path, totals,
+                                   sub_path if top is None else top,
+                                   archives=archives, names=names)
+                    subs.append(sub)
+            else:
+                subs = self._scan_by_rules(
+                    path, totals, top, rules, relative,
+                    info.st_dev if device is None else device, archives,
+                    names)
             for sub in subs:
                 size += sub.data_size
             TMTree.__init__(self, _name, subs, size)
+            self._mtime = max([info.st_mtime_ns]
+                              + [sub._mtime for sub in subs])
+            if not subs:
+                self._metrics = _EMPTY_FOLDER_METRICS
         else:  # for file
-            _data_size = os.path.getsize(path)
+            info = os.stat(path)
+            _data_size = info.st_size
             TMTree.__init__(self, _name, [], _data_size)
+            self._mtime = info.st_mtime_ns
+            self._metrics = _file_metrics(info)
+            key = (_extension(_name), _name if top is None else top)
+            totals[key] = totals.get(key, 0) + _data_size
+
+    def _scan_by_rules(self, path: str, totals: Dict[Tuple[str, str], int],
+                       top: Optional[str], rules: ScanRules, relative: str,
+                       device: int, archives: bool,
+                       names: Optional[Dict[str, str]] = None
+                       ) -> List[FileSystemTree]:
+        """Return the trees of the files and folders in the folder at <path>
+        that <rules> do not leave out, as for _scan_into.
+        """
+        subs = []
+        entries = []
+        for name in os.listdir(path):
+            sub_path = os.path.join(path, name)
+            entries.append((name, sub_path, os.path.isdir(sub_path)))
+        for name, kind, size, mtime in _apply_rules(entries, rules, relative,
+                                                    device):
+            sub_path = os.path.join(path, name)
+            sub_top = name if top is None else top
+            if kind == _SCAN:
+                sub = _new_tree(sub_path, archives)
+                sub._scan_into(sub_path, totals, sub_top, rules,
+                               f'{relative}/{name}' if relative else name,
+                               device, archives, names)
+            else:
+                if names is not None:
+                    name = names.setdefault(name, name)
+                sub = FileSystemTree.from_parts(name, [], size, mtime)
+                sub._skipped = True
+                key = (_extension(name), sub_top)
+                totals[key] = totals.get(key, 0) + size
+            subs.append(sub)
+        return subs
+
+    @classmethod
+    def from_parts(cls, name: str, subtrees: List[FileSystemTree],
+                   data_size: int = 0, mtime: int = 0) -> FileSystemTree:
+        """Return a new FileSystemTree with the given <name>, <subtrees> and
+        <data_size>, as for TMTree, without reading the file system. It was
+        last modified at <mtime>, or when its latest subtree was, if later.
+        >>> tree = FileSystemTree.from_parts('notes.txt', [], 12)
+        >>> folder = FileSystemTree.from_parts('docs', [tree])
+        >>> folder.data_size
+        12
+        >>> tree.get_parent() is folder
+        True
+        """
+        tree = cls.__new__(cls)
+        TMTree.__init__(tree, name, subtrees, data_size)
+        tree._mtime = max([mtime] + [sub._mtime for sub in subtrees])
+        return tree
+
+    def change_size(self, factor: float) -> None:
+        """Change the size of this file by <factor>, as for TMTree.
+
+        Do nothing if this tree is a folder, even one that is empty because
+        what is in it has not been added yet.
+        """
+        if not self._pending:
+            TMTree.change_size(self, factor)
+
+    def enable_concurrency(self) -> None:
+        """Make the whole tree containing this tree safe to share between
+        threads, as for TMTree. Its view by extension, which is changed along
+        with it, shares its lock.
+        >>> tree = FileSystemTree.from_parts('docs', [
+        ...     FileSystemTree.from_parts('a.pdf', [], 10)])
+        >>> view = tree.get_extension_view()
+        >>> tree.enable_concurrency()
+        >>> view._subtrees[0]._lock is tree._lock
+        True
+        """
+        TMTree.enable_concurrency(self)
+        root = self._root()
+        if root._extensions is not None:
+            stack = [root._extensions]
+            while stack:
+                tree = stack.pop()
+                tree._lock = root._lock
+                stack.extend(tree._subtrees)
+
+    def set_metric(self, metric: str) -> None:
+        """Size every tree in the whole tree containing this one by <metric>,
+        one of METRICS, as for TMTree. The files are grouped by extension
+        again, by the new metric, the next time they are asked for.
+        >>> tree = FileSystemTree.from_parts('docs', [
+        ...     FileSystemTree.from_parts('a.pdf', [], 10),
+        ...     FileSystemTree.from_parts('b.pdf', [], 5)])
+        >>> tree.set_metric('files')
+        >>> tree.get_extension_view().data_size
+        2
+        """
+        TMTree.set_metric(self, metric)
+        root = self._root()
+        if root._extensions is not None:
+            with root.writing():
+                root._extensions = None
+
+    def get_extension_view(self) -> ExtensionTree:
+        """Return the files of the whole tree containing this tree grouped by
+        extension, and then by top-level folder. The view is kept up to date
+        as the tree is edited.
+
+        Trees scanned from the file system are grouped during the scan; other
+        trees are grouped the first time they are asked for.
+        >>> folder = FileSystemTree.from_parts('docs', [
+        ...     FileSystemTree.from_parts('a.pdf', [], 10),
+        ...     FileSystemTree.from_parts('b.pdf', [], 5)])
+        >>> tree = FileSystemTree.from_parts('root', [folder])
+        >>> view = tree.get_extension_view()
+        >>> view._subtrees[0]._name, view._subtrees[0].data_size
+        ('.pdf', 15)
+        """
+        root = self._root()
+        with root.writing():
+            if root._extensions is None:
+                totals: Dict[Tuple[str, str], int] = {}
+                stack = [root]
+                while stack:
+                    tree = stack.pop()
+                    if tree._subtrees:
+                        stack.extend(tree._subtrees)
+                    else:
+                        key = (_extension(tree._name), _top_level(tree))
+                        totals[key] = totals.get(key, 0) + tree.data_size
+                root._extensions = ExtensionTree(root, totals)
+            return root._extensions
+
+    def _edited(self, edit: tuple, undone: bool) -> None:
+        view = self._extensions
+        if view is None:
+            return
+        sign = -1 if undone else 1
+        kind, tree = edit[0], edit[1]
+        if kind == 'size':
+            if edit[3] == self._metric:
+                view.add(_extension(tree._name), _top_level(tree),
+                         sign * edit[2])
+        elif kind == 'move':
+            # The tree is now in the destination, or back in the source if
+            # the move was undone.
+            old_top = _top_level(tree, edit[4] if undone else edit[2])
+            new_top = _top_level(tree)
+            if old_top != new_top:
+                extension = _extension(tree._name)
+                view.add(extension, old_top, -tree.data_size)
+                view.add(extension, new_top, tree.data_size)
+        else:
+            # The deleted tree still knows its parent, so its top-level
+            # folder is the same whether the deletion was undone or not.
+            top = _top_level(tree)
+            stack = [tree]
+            while stack:
+                tree = stack.pop()
+                if tree._subtrees:
+                    stack.extend(tree._subtrees)
+                else:
+                    view.add(_extension(tree._name), top,
+                             -sign * tree.data_size)
 
     def get_separator(self) -> str:
         """Return the file separator for this OS.
@@ -515,28 +2039,703 @@ class FileSystemTree(TMTree):
     def get_suffix(self) -> str:
         """Return the final descriptor of this tree.
         """
-
-        def convert_size(data_size: float, suffix: str = 'B') -> str:
-            suffixes = {'B': 'kB', 'kB': 'MB', 'MB': 'GB', 'GB': 'TB'}
-            if data_size < 1024 or suffix == 'TB':
-                return f'{data_size:.2f}{suffix}'
-            return convert_size(data_size / 1024, suffixes[suffix])
-
         components = []
-        if len(self._subtrees) == 0:
+        if self._skipped:
+            components.append('not scanned')
+        elif len(self._subtrees) == 0:
             components.append('file')
         else:
             components.append('folder')
             components.append(f'{len(self._subtrees)} items')
-        components.append(convert_size(self.data_size))
+        metric = self.get_metric()
+        if metric == 'files':
+            components.append(f'{self.data_size} files')
+        elif metric == 'blocks':
+            components.append(f'{format_size(self.data_size)} allocated')
+        else:
+            components.append(format_size(self.data_size))
         return f' ({", ".join(components)})'
 
 
+class ArchiveTree(FileSystemTree):
+    """A zip or tar file in a file system, shown as a folder of the files and
+    folders in it once it is expanded.
+
+    Until then it is a file like any other, and the archive is not opened.
+    Expanding it, with expand, expand_all or expand_to_depth, lists its
+    members, from the central directory of a zip file
+    or the headers of a tar file, without extracting them (see archives.py).
+    Each member is sized by its share of the size of the archive on disk, in
+    proportion to its size in the archive as listed by list_members, so
+    expanding an archive leaves the sizes of the folders around it as they
+    were, in every metric but the count of files, where each member counts
+    as one file.
+
+    === Private Attributes ===
+    _path:
+        The path of the archive.
+    _loaded:
+        Whether the members of the archive have been listed.
+    """
+    _path: str
+    _loaded: bool = False
+
+    def _scan_into(self, path: str, totals: Dict[Tuple[str, str], int],
+                   top: Optional[str], rules: Optional[ScanRules] = None,
+                   relative: str = '', device: Optional[int] = None,
+                   archives: bool = False,
+                   names: Optional[Dict[str, str]] = None) -> None:
+        FileSystemTree._scan_into(self, path, totals, top, rules, relative,
+                                  device, archives, names)
+        self._path = path
+
+    def expand(self) -> None:
+        """Expand this archive, listing its members first if they have not
+        been listed yet.
+        >>> import zipfile, tempfile
+        >>> path = os.path.join(tempfile.mkdtemp(), 'a.zip')
+        >>> with zipfile.ZipFile(path, 'w') as archive:
+        ...     archive.writestr('docs/a.txt', 'a' * 50)
+        ...     archive.writestr('b.txt', 'b' * 10)
+        >>> tree = ArchiveTree.from_parts('a.zip', [], os.path.getsize(path))
+        >>> tree._path = path
+        >>> tree._subtrees
+        []
+        >>> tree.expand()
+        >>> [sub._name for sub in tree._subtrees], tree._expanded
+        (['docs', 'b.txt'], True)
+        >>> tree.data_size == os.path.getsize(path) == \\
+        ...     sum(sub.data_size for sub in tree._subtrees)
+        True
+        """
+        with self.writing():
+            self._load()
+            FileSystemTree.expand(self)
+
+    def expand_all(self) -> None:
+        """Expand this archive and everything in it, listing its members first
+        if they have not been listed yet.
+        """
+        with self.writing():
+            self._load()
+            FileSystemTree.expand_all(self)
+
+    def _expand_to_depth(self, depth: int) -> None:
+        if depth > 0:
+            self._load()
+        FileSystemTree._expand_to_depth(self, depth)
+
+    def _load(self) -> None:
+        if not self._loaded:
+            self._loaded = True
+            _load_archive(self, self._path)
+
+    def get_suffix(self) -> str:
+        """Return the final descriptor of this tree.
+        """
+        if not self._subtrees:
+            return f' (archive, {format_size(self.data_size)})'
+        return f' (archive, {len(self._subtrees)} items, ' \
+               f'{format_size(self.data_size)})'
+
+
+# The metrics of a folder with nothing in it: no bytes, no files, and no
+# allocated space counted, as a folder's own space never is.
+_EMPTY_FOLDER_METRICS = (0, 0, 0)
+
+
+def _file_metrics(info: os.stat_result) -> Tuple[int, int, int]:
+    """Return the metrics of the file with the status <info>, in the order of
+    FileSystemTree.METRICS.
+    """
+    blocks = getattr(info, 'st_blocks', None)
+    return (info.st_size, 1,
+            info.st_size if blocks is None else blocks * 512)
+
+
+def _new_tree(path: str, archives: bool) -> FileSystemTree:
+    """Return a new, uninitialized tree for the file or folder at <path>: an
+    ArchiveTree if <archives> and it is an archive, or else a FileSystemTree.
+    """
+    if archives and is_archive(path) and not os.path.isdir(path):
+        return ArchiveTree.__new__(ArchiveTree)
+    return FileSystemTree.__new__(FileSystemTree)
+
+
+def _load_archive(tree: FileSystemTree, path: str) -> None:
+    """Give <tree>, a file that is the archive at <path>, the files and
+    folders in the archive as its subtrees, sized by their shares of its size.
+    Leave <tree> as it is if the archive has no files in it.
+    """
+    # The folders of the archive, as dictionaries of what is in them by
+    # name, and its files, as (weight, mtime) pairs.
+    root: Dict[str, object] = {}
+    # Each name in the archive, kept once however many folders it is in.
+    names: Dict[str, str] = {}
+    for name, is_folder, size, mtime in list_members(path):
+        parts = [names.setdefault(part, part) for part in name.split('/')
+                 if part not in ('', '.')]
+        if not parts:
+            continue
+        folder = root
+        for part in parts[:-1]:
+            if not isinstance(folder.get(part), dict):
+                folder[part] = {}
+            folder = folder[part]
+        if not isinstance(folder.get(parts[-1]), dict):
+            folder[parts[-1]] = {} if is_folder else (size, mtime)
+
+    weights = [weight for weight, _ in _archive_files(root)]
+    if not weights:
+        return
+    if not any(weights):
+        weights = [1] * len(weights)
+
+    # Each file counts as one in the metric that counts files, and shares
+    # every other metric of the archive in proportion to its weight.
+    root_tree = tree._root()
+    active = root_tree._metric
+    archive = tree._leaf_metrics(active)
+    counted = tree.METRICS.index('files') \
+        if 'files' in tree.METRICS else None
+    columns = [[1] * len(weights) if m == counted
+               else _split(archive[m], weights)
+               for m in range(len(archive))]
+
+    # The files are built in the same order as _archive_files weighed them.
+    next_metrics = iter(zip(*columns))
+
+    def build(name: str, entry: object) -> FileSystemTree:
+        if isinstance(entry, dict):
+            return FileSystemTree.from_parts(
+                name, [build(sub_name, sub)
+                       for sub_name, sub in entry.items()])
+        metrics = next(next_metrics)
+        file = FileSystemTree.from_parts(name, [], metrics[active], entry[1])
+        file._metrics = metrics
+        return file
+
+    subs = [build(name, entry) for name, entry in root.items()]
+    view = root_tree._extensions
+    if view is not None:
+        top = _top_level(tree)
+        view.add(_extension(tree._name), top, -tree.data_size)
+    stack = list(subs)
+    for sub in subs:
+        sub._parent_tree = tree
+        tree._subtrees.append(sub)
+    while stack:
+        sub = stack.pop()
+        sub._lock = tree._lock
+        if sub._subtrees:
+            stack.extend(sub._subtrees)
+        elif view is not None:
+            view.add(_extension(sub._name), top, sub.data_size)
+    # Only a count of files changes: the archive becomes a folder of them.
+    change = sum(columns[active]) - tree.data_size
+    node = tree
+    while change and node is not None:
+        node.data_size += change
+        node = node._parent_tree
+    if root_tree._summed:
+        shift = tuple(new - old for new, old in
+                      zip(tree._sum_metrics(active), archive))
+        node = tree._parent_tree
+        while node is not None:
+            node._metrics = _plus(node._metrics, shift)
+            node = node._parent_tree
+    root_tree._version += 1
+
+
+def _plus(sizes: Tuple[int, ...], change: Tuple[int, ...]) -> Tuple[int, ...]:
+    """Return <sizes> with each of <change> added to the size at its index.
+    >>> _plus((1, 2, 3), (10, 0, -1))
+    (11, 2, 2)
+    """
+    return tuple(size + more for size, more in zip(sizes, change))
+
+
+def _split(total: int, weights: List[int]) -> List[int]:
+    """Return <total> split into whole shares in proportion to <weights>,
+    giving what is left over after rounding down to the largest remainders.
+    >>> _split(10, [1, 1, 1])
+    [4, 3, 3]
+    """
+    whole = sum(weights)
+    shares = [total * weight // whole for weight in weights]
+    by_remainder = sorted(range(len(weights)), reverse=True,
+                          key=lambda i: total * weights[i] % whole)
+    for i in by_remainder[:total - sum(shares)]:
+        shares[i] += 1
+    return shares
+
+
+def _archive_files(folder: Dict[str, object]) -> Iterator[Tuple[int, int]]:
+    """Yield the files in <folder>, a folder of an archive as built by
+    _load_archive, and in the folders in it, in order, depth first.
+    """
+    for entry in folder.values():
+        if isinstance(entry, dict):
+            yield from _archive_files(entry)
+        else:
+            yield entry
+
+
+class ViewTree(TMTree):
+    """A tree made from another tree, such as a summary of it, that only
+    changes along with the tree it was made from. Edit that tree instead:
+    move, change_size and delete_self do nothing here.
+
+    This is an abstract class that should not be instantiated directly.
+    """
+
+    def move(self, destination: TMTree) -> None:
+        """Do nothing: edit the tree this one was made from instead.
+        """
+
+    def change_size(self, factor: float) -> None:
+        """Do nothing: edit the tree this one was made from instead.
+        """
+
+    def delete_self(self) -> bool:
+        """Do nothing, and return False: edit the tree this one was made from
+        instead.
+        """
+        return False
+
+    def set_metric(self, metric: str) -> None:
+        """Do nothing: size the tree this one was made from instead, and make
+        this tree again.
+        """
+
+
+class ExtensionTree(ViewTree):
+    """The files of a FileSystemTree grouped by extension, and then by the
+    top-level folder they are in. Each leaf stands for all of the files with
+    one extension in one top-level folder, or for one file at the top, and its
+    size is the size of those files put together.
+
+    === Private Attributes ===
+    _groups:
+        The subtrees of this tree, by name.
+    _source:
+        The FileSystemTree that is grouped, or None below the root.
+    """
+    _groups: Dict[str, ExtensionTree]
+    _source: Optional[FileSystemTree]
+
+    def __init__(self, source: Optional[FileSystemTree],
+                 totals: Optional[Dict[Tuple[str, str], int]] = None,
+                 name: str = '') -> None:
+        """Initialize the view of <source> with the sizes in <totals>, by
+        extension and top-level folder, or an empty group called <name> if
+        <source> is None.
+        """
+        if source is not None:
+            name = f'{source._name} by extension'
+        TMTree.__init__(self, name, [])
+        self._groups = {}
+        self._source = source
+        if source is not None:
+            # The view is read and changed along with its source.
+            self._lock = source._lock
+        for (extension, top), size in (totals or {}).items():
+            self.add(extension, top, size)
+
+    def add(self, extension: str, top: str, size: int) -> None:
+        """Add <size>, which may be negative, to the files with <extension>
+        in the top-level folder <top>. Groups are made when they get their
+        first bytes and dropped when they are left with none.
+        >>> view = ExtensionTree(FileSystemTree.from_parts('root', []))
+        >>> view.add('.txt', 'docs', 5)
+        >>> view.data_size, view._subtrees[0]._subtrees[0]._name
+        (5, 'docs')
+        >>> view.add('.txt', 'docs', -5)
+        >>> view._subtrees
+        []
+        """
+        if not size:
+            return
+        kind = self._group(extension)
+        group = kind._group(top)
+        for tree in (group, kind, self):
+            tree.data_size += size
+        if group.data_size <= 0:
+            kind._drop(group)
+            if not kind._subtrees:
+                self._drop(kind)
+        self._version += 1
+
+    def _group(self, name: str) -> ExtensionTree:
+        group = self._groups.get(name)
+        if group is None:
+            group = ExtensionTree(None, name=name)
+            group._parent_tree = self
+            group._lock = self._lock
+            self._subtrees.append(group)
+            self._groups[name] = group
+        return group
+
+    def _drop(self, group: ExtensionTree) -> None:
+        self._subtrees.discard(group)
+        del self._groups[group._name]
+        self.data_size -= group.data_size
+        if not self._subtrees:
+            self._expanded = False
+
+    def get_source(self) -> Optional[FileSystemTree]:
+        """Return the FileSystemTree grouped by this view, or None if this is
+        not the root of the view.
+        """
+        return self._source
+
+    def get_separator(self) -> str:
+        """Return the string used between groups in a path.
+        """
+        return ' / '
+
+    def get_suffix(self) -> str:
+        """Return the total size of the files in this group.
+        """
+        return f' ({format_size(self.data_size)})'
+
+
+# What _apply_rules does with each entry of a folder: scan it as usual, or
+# stand in for it with a file of the size of everything in it.
+_SCAN = 'scan'
+_SKIP = 'skip'
+
+
+def _apply_rules(entries: List[Tuple[str, str, bool]], rules: ScanRules,
+                 relative: str, device: int
+                 ) -> List[Tuple[str, str, int, int]]:
+    """Return what to do with each (name, path, is folder) entry of the
+    folder at <relative> from the folder being scanned, which is on <device>,
+    according to <rules>.
+
+    Each entry that is kept becomes a (name, _SCAN, 0, 0) tuple, except for
+    folders too deep to list, which become a (name, _SKIP, size, mtime) tuple.
+    Entries that are left out are dropped, or collapsed into one more
+    (SKIPPED_NAME, _SKIP, size, 0) tuple.
+    """
+    kept = []
+    skipped = 0
+    collapsed = False
+    depth = relative.count('/') + 1 if relative else 0
+    too_deep = rules.max_depth is not None and depth + 1 >= rules.max_depth
+    for name, path, is_folder in entries:
+        sub_relative = f'{relative}/{name}' if relative else name
+        try:
+            if is_folder and rules.same_device and \
+                    os.stat(path).st_dev != device:
+                continue
+            if rules.excludes(sub_relative, is_folder):
+                if rules.collapse:
+                    skipped += _total_size(path, device, rules.same_device)
+                    collapsed = True
+            elif is_folder and too_deep:
+                kept.append((name, _SKIP,
+                             _total_size(path, device, rules.same_device),
+                             os.stat(path).st_mtime_ns))
+            else:
+                kept.append((name, _SCAN, 0, 0))
+        except OSError:
+            continue
+    if collapsed:
+        kept.append((SKIPPED_NAME, _SKIP, skipped, 0))
+    return kept
+
+
+def _total_size(path: str, device: int, same_device: bool) -> int:
+    """Return the total size of the file at <path>, or of all the files in
+    the folder at <path>, without following links, and leaving out folders
+    that are not on <device> if <same_device>.
+    """
+    if os.path.islink(path) or not os.path.isdir(path):
+        return os.stat(path, follow_symlinks=False).st_size
+    total = 0
+    folders = [path]
+    while folders:
+        try:
+            with os.scandir(folders.pop()) as listing:
+                for entry in listing:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            if not same_device or \
+                                    entry.stat().st_dev == device:
+                                folders.append(entry.path)
+                        else:
+                            total += entry.stat(follow_symlinks=False).st_size
+                    except OSError:
+                        continue
+        except OSError:
+            continue
+    return total
+
+
+def _extension(name: str) -> str:
+    """Return the extension of the file called <name>, in lower case, for
+    grouping files by type.
+    """
+    return os.path.splitext(name)[1].lower() or '(none)'
+
+
+def _top_level(tree: TMTree, parent: Optional[TMTree] = None) -> str:
+    """Return the name of the top-level tree that <tree> is in, or would be in
+    as a subtree of <parent>, if given. A tree at the top is its own top-level
+    tree.
+    """
+    if parent is None:
+        parent = tree._parent_tree
+    if parent is None:
+        return tree._name
+    while parent._parent_tree is not None:
+        tree, parent = parent, parent._parent_tree
+    return tree._name
+
+
+def format_size(data_size: float, suffix: str = 'B') -> str:
+    """Return <data_size> bytes as text, in B, kB, MB, GB or TB.
+    >>> format_size(2048)
+    '2.00kB'
+    """
+    suffixes = {'B': 'kB', 'kB': 'MB', 'MB': 'GB', 'GB': 'TB'}
+    if data_size < 1024 or suffix == 'TB':
+        return f'{data_size:.2f}{suffix}'
+    return format_size(data_size / 1024, suffixes[suffix])
+
+
+class BackgroundScan:
+    """A scan of a file or folder that runs in a background thread and grows
+    a FileSystemTree as it goes, so the tree can be shown before the scan
+    has finished.
+
+    The scanning thread never touches the tree. It lists one folder at a
+    time and queues the folder's entries; they are added to the tree only
+    when apply_updates is called. That should be done from the thread that
+    uses the tree, unless the tree has been made safe to share with
+    enable_concurrency. Until the scan is done, folder sizes only count the
+    entries added so far.
+
+    Folders that cannot be read are left empty, and files that cannot be
+    read are left out.
+
+    === Public Attributes ===
+    tree:
+        The tree built so far.
+    items_found:
+        The number of files and folders added to the tree so far.
+
+    === Private Attributes ===
+    _path:
+        The path being scanned.
+    _rules:
+        The rules for what to leave out of the scan, or None.
+    _archives:
+        Whether archives are added as ArchiveTrees.
+    _queue:
+        Listed folders waiting to be added to the tree, as a (folder id,
+        entries) pair, where each entry is a (name, folder id or None for
+        files, size, mtime, skipped) tuple; followed by None once the scan is
+        finished.
+    _folders:
+        The folders in the tree whose entries have not been added yet, by id.
+    _thread:
+        The scanning thread.
+    _finished:
+        Whether the scanning thread has finished and everything it found has
+        been added to the tree.
+    _names:
+        Every name added to the tree so far, so trees with the same name
+        share it. Emptied when the scan finishes.
+    """
+    tree: FileSystemTree
+    items_found: int
+    _path: str
+    _rules: Optional[ScanRules]
+    _archives: bool
+    _queue: Queue
+    _folders: Dict[int, FileSystemTree]
+    _thread: threading.Thread
+    _finished: bool
+    _names: Dict[str, str]
+
+    def __init__(self, path: str, rules: Optional[ScanRules] = None,
+                 archives: bool = False) -> None:
+        """Prepare to scan <path>, leaving out the files and folders that
+        <rules> leave out, if given, and showing zip and tar files as folders
+        if <archives>, as FileSystemTree does; the scan begins when start is
+        called.
+
+        Precondition: <path> is a valid path for this computer.
+        """
+        self._path = path
+        self._rules = rules
+        self._archives = archives
+        self._queue = Queue()
+        self._thread = threading.Thread(target=self._scan, daemon=True)
+        self._names = {}
+        self.items_found = 0
+        if os.path.isdir(path):
+            self.tree = FileSystemTree.from_parts(
+                os.path.basename(path), [], 0, os.stat(path).st_mtime_ns)
+            self.tree._extensions = ExtensionTree(self.tree)
+            self.tree._pending = True
+            self._folders = {0: self.tree}
+            self._finished = False
+        else:
+            self.tree = FileSystemTree(path, rules, archives)
+            self._folders = {}
+            self._finished = True
+
+    def start(self) -> None:
+        """Start scanning in the background.
+        """
+        if not self._finished:
+            self._thread.start()
+
+    def join(self, timeout: Optional[float] = None) -> None:
+        """Wait up to <timeout> seconds, or forever if None, for the scanning
+        thread to finish. The tree is not updated; use apply_updates.
+        """
+        if self._thread.is_alive():
+            self._thread.join(timeout)
+
+    def is_done(self) -> bool:
+        """Return whether the scan has finished and all of it is in the tree.
+        """
+        return self._finished
+
+    def apply_updates(self) -> bool:
+        """Add everything found since the last call to the tree, and return
+        whether the tree changed.
+        """
+        changed = False
+        while True:
+            try:
+                update = self._queue.get_nowait()
+            except Empty:
+                break
+            if update is None:
+                self._finished = True
+                self._names = {}
+                break
+            folder_id, entries = update
+            with self.tree.writing():
+                # A folder deleted while it was waiting to be listed, or one
+                # inside it, stays deleted: what is found in it is dropped.
+                folder = self._folders.pop(folder_id, None)
+                if folder is None or not in_tree(folder, self.tree):
+                    continue
+                self._add_entries(folder, entries)
+                self.tree._version += 1
+            changed = True
+        return changed
+
+    def _add_entries(self, folder: FileSystemTree,
+                     entries: List[Tuple[str, Optional[int], int, int, bool,
+                                         Optional[Tuple[int, int, int]]]]
+                     ) -> None:
+        total = 0
+        latest = 0
+        folder._pending = False
+        view = self.tree._extensions
+        top = None if folder is self.tree else _top_level(folder)
+        # The entries are sized in bytes, whichever metric is in use.
+        active = self.tree._metric
+        summed = self.tree._summed
+        sums = (0,) * len(self.tree.METRICS)
+        for name, child_id, size, mtime, skipped, metrics in entries:
+            name = self._names.setdefault(name, name)
+            archive = self._archives and child_id is None and not skipped \
+                and is_archive(name)
+            child = (ArchiveTree if archive else FileSystemTree).from_parts(
+                name, [], size, mtime)
+            child._skipped = skipped
+            if metrics is not None:
+                child._metrics = metrics
+            if active:
+                child._metrics = child._leaf_metrics(0)
+                size = child.data_size = child._metrics[active]
+            if summed:
+                child._metrics = child._leaf_metrics(active)
+                sums = _plus(sums, child._metrics)
+            child._parent_tree = folder
+            child._lock = folder._lock
+            folder._subtrees.append(child)
+            if archive:
+                child._path = os.path.join(self._path,
+                                           *_names_from_root(child))
+            if child_id is not None:
+                child._pending = True
+                self._folders[child_id] = child
+            else:
+                view.add(_extension(name), top or name, size)
+            total += size
+            latest = max(latest, mtime)
+        self.items_found += len(entries)
+        while folder is not None:
+            folder.data_size += total
+            folder._mtime = max(folder._mtime, latest)
+            if summed:
+                folder._metrics = _plus(folder._metrics, sums)
+            folder = folder._parent_tree
+
+    def _scan(self) -> None:
+        next_id = 1
+        rules = self._rules
+        device = os.stat(self._path).st_dev
+        folders = [(0, self._path, '')]
+        while folders:
+            folder_id, path, relative = folders.pop()
+            entries = []
+            try:
+                with os.scandir(path) as listing:
+                    listed = list(listing)
+            except OSError:
+                listed = []
+            if rules is not None:
+                actions = _apply_rules(
+                    [(entry.name, entry.path, entry.is_dir())
+                     for entry in listed], rules, relative, device)
+                by_name = {entry.name: entry for entry in listed}
+                listed = []
+                for name, kind, size, mtime in actions:
+                    if kind == _SCAN:
+                        listed.append(by_name[name])
+                    else:
+                        entries.append((name, None, size, mtime, True, None))
+            for entry in listed:
+                try:
+                    info = entry.stat()
+                except OSError:
+                    if entry.is_dir():  # still show the folder
+                        info = None
+                    else:
+                        continue
+                mtime = 0 if info is None else info.st_mtime_ns
+                if entry.is_dir():
+                    # Empty until what is in it is added.
+                    entries.append((entry.name, next_id, 0, mtime, False,
+                                    _EMPTY_FOLDER_METRICS))
+                    folders.append((next_id, entry.path,
+                                    f'{relative}/{entry.name}' if relative
+                                    else entry.name))
+                    next_id += 1
+                else:
+                    entries.append((entry.name, None, info.st_size, mtime,
+                                    False, _file_metrics(info)))
+            self._queue.put((folder_id, entries))
+        self._queue.put(None)
+
+
 if __name__ == '__main__':
     import python_ta
 
     python_ta.check_all(config={
         'allowed-import-modules': [
-            'python_ta', 'typing', 'math', 'random', 'os', '__future__'
+            'python_ta', 'typing', 'math', 'random', 'os', '__future__',
+            'itertools', 'numpy', 'threading', 'queue', 'contextlib',
+            'json', 'colours', 'scan_rules', 'archives', 'heapq'
         ]
     })
@@ -1,11 +1,63 @@
 from os import getcwd
+import argparse
 import os
+import tempfile
+from concurrent.futures import Future, ProcessPoolExecutor, \
+    ThreadPoolExecutor
+from contextlib import nullcontext
+from itertools import chain, islice
 from sys import platform
-from typing import Optional
+from typing import ContextManager, Iterable, List, Optional, Tuple
 
 import pygame
+from colours import CategoryColours, ColourPolicy, DiffColours, PathColours, \
+    SizeColours
+from diffs import DiffTree, diff_trees
+from duplicates import hash_candidates, reclaimable, size_candidates
+from history import SnapshotStore, blend, copy_expansion
 from papers import PaperTree
-from tm_trees import TMTree, FileSystemTree
+from profiling import Profiler
+from records import FORMATS, load_records
+from scan_rules import COMMON_EXCLUDES, ScanRules
+from shards import merge_shards, merge_trees
+from snapshots import is_snapshot, load_snapshot
+from tm_trees import TMTree, FileSystemTree, BackgroundScan, format_size, \
+    in_tree, rectangle_arrays, replay_journal
+
+try:
+    import numpy as np
+except ImportError:  # fall back to drawing one rectangle at a time
+    np = None
+
+# Above this many rectangles, a frame is rasterised in one vectorised fill
+# rather than with one pygame.draw.rect call per rectangle.
+BULK_FILL_THRESHOLD = 2000
+
+# How often, in milliseconds, to show the progress of a background scan.
+SCAN_REFRESH_INTERVAL = 250
+
+# Where the "S" key saves the edits made in the window.
+JOURNAL_FILE = 'treemap_edits.json'
+
+# How many of the largest files the "T" key highlights.
+HIGHLIGHT_COUNT = 10
+
+# Where the "P" key saves the trace of the stages timed while profiling.
+PROFILE_FILE = 'treemap_profile.json'
+
+# Stands in for a profiler stage when nothing is being profiled.
+_NOT_PROFILING = nullcontext()
+
+# How many frames, and how many milliseconds each, the "[" and "]" keys take
+# to animate from one date's scan to another.
+ANIMATION_FRAMES = 12
+ANIMATION_FRAME_TIME = 25
+
+# The colour policies the "K" key cycles through, and the ones it cycles
+# through for a tree of what changed between two scans.
+COLOUR_POLICIES: List[ColourPolicy] = [PathColours(), CategoryColours(),
+                                       SizeColours()]
+DIFF_COLOUR_POLICIES: List[ColourPolicy] = [DiffColours()] + COLOUR_POLICIES
 
 
 class Visualiser:
@@ -19,6 +71,18 @@ class Visualiser:
     screen: Optional[pygame.Surface]
     hover_node: Optional[TMTree]
     selected_node: Optional[TMTree]
+    scan: Optional[BackgroundScan]
+    colour_policy: int
+    highlighted: Optional[List[TMTree]]
+    highlighted_version: int
+    source: Optional[str]
+    duplicates: Optional[List[List[TMTree]]]
+    duplicates_version: int
+    duplicates_search: Optional[Future]
+    primary: Optional[TMTree]
+    history: Optional[SnapshotStore]
+    history_date: Optional[str]
+    profiler: Optional[Profiler]
 
     def __init__(self) -> None:
         # You may adjust the height and width as you'd like, depending on your screen resolution
@@ -31,6 +95,18 @@ class Visualiser:
         self.screen = None
         self.hover_node = None
         self.selected_node = None
+        self.scan = None
+        self.colour_policy = 0
+        self.highlighted = None
+        self.highlighted_version = 0
+        self.source = None
+        self.duplicates = None
+        self.duplicates_version = 0
+        self.duplicates_search = None
+        self.primary = None
+        self.history = None
+        self.history_date = None
+        self.profiler = None
 
     def run_visualisation(self, tree: TMTree) -> None:
         """Display an interactive graphical display of the given tree's treemap.
@@ -40,6 +116,7 @@ class Visualiser:
         pygame.init()
         self.screen = pygame.display.set_mode((self.width, self.height), pygame.RESIZABLE)
         self.tree = tree
+        tree.start_journal()
 
         # Render the initial display of the static treemap.
         self.render_display()
@@ -54,6 +131,14 @@ class Visualiser:
         Use the constants TREEMAP_HEIGHT and FONT_HEIGHT to divide the
         screen vertically into the treemap and text comments.
         """
+        with self._stage('render'):
+            drawn = self._render_display()
+        if self.profiler is not None and drawn:
+            self.profiler.end_frame()
+
+    def _render_display(self) -> bool:
+        """Render the display, and return whether there was room to.
+        """
         # First, clear the screen
         pygame.draw.rect(self.screen, pygame.Color('black'),
                          (0, 0, self.width, self.height))
@@ -61,11 +146,32 @@ class Visualiser:
         try:
             subscreen = self.screen.subsurface((0, 0, self.width, self.height - self.font_height))
         except ValueError:
-            return
-
-        for rect, colour in self.tree.get_rectangles():
-            # Note that the arguments are in the opposite order
-            pygame.draw.rect(subscreen, colour, rect)
+            return False
+
+        # Stream the rectangles straight to the screen, skipping anything
+        # outside of the drawable area.
+        clip = (0, 0, self.width, self.height - self.font_height)
+        with self._stage('draw'):
+            drawn = draw_rectangle_stream(subscreen,
+                                          self.tree.iter_rectangles(clip))
+
+        # outline the largest files, or the folders that hide them
+        if self.highlighted is not None:
+            if self.highlighted_version != self.tree.get_version():
+                self.highlight_largest()
+            for node in self.highlighted:
+                pygame.draw.rect(subscreen, (255, 255, 0), self._shown(node).rect, 3)
+
+        # outline the files that have copies elsewhere
+        if self.duplicates is not None:
+            if self.duplicates_version != self.tree.get_version():
+                self._prune_duplicates()
+            zoomed = self.tree.get_parent() is not None
+            shown = {id(self._shown(node)): self._shown(node)
+                     for files in self.duplicates for node in files
+                     if not zoomed or in_tree(node, self.tree)}
+            for node in shown.values():
+                pygame.draw.rect(subscreen, (0, 255, 255), node.rect, 2)
 
         # add the hover rectangle
         if self.selected_node is not None:
@@ -74,20 +180,160 @@ class Visualiser:
             pygame.draw.rect(subscreen, (255, 255, 255), self.hover_node.rect, 2)
 
         self._render_text()
+        if self.profiler is not None:
+            self.profiler.count('rectangles_drawn', drawn)
+            self._render_profile()
 
         # This must be called *after* all other pygame functions have run.
-        pygame.display.flip()
+        if self.screen is pygame.display.get_surface():
+            pygame.display.flip()
+        return True
+
+    def _stage(self, name: str) -> ContextManager[None]:
+        """Return a context manager that times the stage <name> of this frame
+        if profiling, and does nothing otherwise.
+        """
+        if self.profiler is None:
+            return _NOT_PROFILING
+        return self.profiler.stage(name)
+
+    def toggle_profiling(self) -> None:
+        """Start timing the stages of every frame and showing the times over
+        the treemap, or stop and save the times to PROFILE_FILE.
+        """
+        if self.profiler is None:
+            self.profiler = Profiler()
+            self.profiler.instrument()
+        else:
+            self.profiler.uninstrument()
+            self.profiler.save_trace(PROFILE_FILE)
+            print(f'Saved the profile to {PROFILE_FILE}')
+            self.profiler = None
+
+    def _render_profile(self) -> None:
+        """Render the frame rate and the time spent in each stage of a frame
+        over the top left of the treemap.
+        """
+        font = pygame.font.SysFont('Consolas', 14)
+        lines = [font.render(line, True, pygame.Color('white'))
+                 for line in self.profiler.get_lines()]
+        if not lines:
+            return
+        width = max(line.get_width() for line in lines) + 8
+        height = sum(line.get_height() for line in lines) + 8
+        background = pygame.Surface((width, height), pygame.SRCALPHA)
+        background.fill((0, 0, 0, 180))
+        self.screen.blit(background, (0, 0))
+        y = 4
+        for line in lines:
+            self.screen.blit(line, (4, y))
+            y += line.get_height()
+
+    def highlight_largest(self) -> None:
+        """Highlight the HIGHLIGHT_COUNT largest files in the tree on display
+        from now on, keeping up with any edits.
+        """
+        self.highlighted = self.tree.get_largest(HIGHLIGHT_COUNT)
+        self.highlighted_version = self.tree.get_version()
+
+    def next_metric(self) -> None:
+        """Size the tree on display, or the tree its view was made from, by
+        the next of its metrics, and lay it out again. Nothing is scanned
+        again.
+        """
+        tree = self.primary if self.primary is not None else self.tree
+        metrics = tree.METRICS
+        metric = metrics[(metrics.index(tree.get_metric()) + 1) % len(metrics)]
+        tree.set_metric(metric)
+        self.tree.update_rectangles(
+            (0, 0, self.width, self.height - self.font_height))
+        print(f'Sized by {metric}')
+
+    def find_duplicates(self) -> None:
+        """Start looking for files with the same contents in the folder on
+        display, in the background; they are outlined once they are found.
+        """
+        root = self.tree._root()
+        candidates = size_candidates(root, self.source)
+        pool = ThreadPoolExecutor(max_workers=1)
+        self.duplicates_search = pool.submit(hash_candidates, candidates)
+        # The pool's thread finishes the search; shutdown does not wait.
+        pool.shutdown(wait=False)
+
+    def _prune_duplicates(self) -> None:
+        """Forget the duplicates deleted since they were found, and the groups
+        left with one file.
+        """
+        root = self.tree._root()
+        self.duplicates = [group for group in
+                           ([node for node in files if in_tree(node, root)]
+                            for files in self.duplicates)
+                           if len(group) > 1]
+        self.duplicates_version = self.tree.get_version()
+
+    def _shown(self, node: TMTree) -> TMTree:
+        """Return the tree whose rectangle contains <node> on the display:
+        <node> itself, or the outermost collapsed folder around it.
+        """
+        path = []
+        while node is not self.tree and node is not None:
+            path.append(node)
+            node = node.get_parent()
+        path.append(self.tree)
+        for tree in reversed(path):
+            if not tree._expanded:
+                return tree
+        return path[0]
+
+    def show_date(self, date: str) -> TMTree:
+        """Animate from the tree on display to the scan from <date> in the
+        history, expanded in the same way, and return that scan's tree.
+        """
+        old = self.tree._root()
+        new = self.history.get_tree(date)
+        copy_expansion(old, new)
+        if old._colour_policy is not None:
+            new.set_colour_policy(old._colour_policy, lazy=True)
+        self.selected_node = self.hover_node = self.highlighted = None
+
+        rect = (0, 0, self.width, self.height - self.font_height)
+        for frame in range(1, ANIMATION_FRAMES):
+            self.tree = blend(old, new, frame / ANIMATION_FRAMES)
+            if old._colour_policy is not None:
+                self.tree.set_colour_policy(old._colour_policy, lazy=True)
+            self.tree.update_rectangles(rect)
+            self.render_display()
+            pygame.time.wait(ANIMATION_FRAME_TIME)
+        self.history_date = date
+        return new
+
+    def render_to_file(self, tree: TMTree, filename: str) -> None:
+        """Render the treemap of <tree>, as currently expanded, to an off-screen
+        surface and save it as an image to <filename>.
+
+        No window is opened, so this works without a display server; the file
+        format is picked by pygame from the extension of <filename>.
+        """
+        pygame.font.init()
+        self.screen = pygame.Surface((self.width, self.height))
+        self.tree = tree
+        # Nothing is selected or hovered over, so no frame is drawn.
+        self.selected_node = self.hover_node = None
+        tree.update_rectangles((0, 0, self.width, self.height - self.font_height))
+        self.render_display()
+        pygame.image.save(self.screen, filename)
 
     def _render_text(self) -> None:
         """Render text at the bottom of the display.
         """
-        # The font we want to use
-        font = pygame.font.SysFont('Consolas', self.font_height - 8)
-        text_surface = font.render(self._get_display_text(), True, pygame.Color('white'))
+        with self._stage('text'):
+            # The font we want to use
+            font = pygame.font.SysFont('Consolas', self.font_height - 8)
+            text_surface = font.render(self._get_display_text(), True, pygame.Color('white'))
 
-        # Where to render the text_surface
-        text_pos = (0, self.height - self.font_height + 4)
-        self.screen.blit(text_surface, text_pos)
+            # Where to render the text_surface
+            text_pos = (0, self.height - self.font_height + 4)
+            self.screen.blit(text_surface, text_pos)
 
     def event_loop(self) -> None:
         """Respond to events (mouse clicks, key presses) and update the display.
@@ -98,12 +344,26 @@ class Visualiser:
         This loop ends only when the user closes the window.
         """
         selected_node = self.tree
+        next_refresh = 0
 
         while True:
             # Wait for an event
             event = pygame.event.poll()
             if event.type == pygame.QUIT:
+                if self.profiler is not None:
+                    self.toggle_profiling()
                 return
+            if event.type != pygame.NOEVENT and self.profiler is not None:
+                self.profiler.event()
+
+            # show whatever a background scan has found since the last refresh
+            if self.scan is not None and pygame.time.get_ticks() >= next_refresh:
+                next_refresh = pygame.time.get_ticks() + SCAN_REFRESH_INTERVAL
+                if self.scan.apply_updates():
+                    self.tree.update_rectangles(
+                        (0, 0, self.width, self.height - self.font_height))
+                if self.scan.is_done():
+                    self.scan = None
 
             if event.type == pygame.VIDEORESIZE:
                 self.width = int(event.w) if event.w else self.width
@@ -123,23 +383,19 @@ class Visualiser:
                 k = event.key
                 if k == pygame.K_UP:
                     selected_node.change_size(0.01)
-                    self.tree.update_data_sizes()
                     self.tree.update_rectangles((0, 0, self.width, drawable_height))
 
                 elif k == pygame.K_DOWN:
                     selected_node.change_size(-0.01)
-                    self.tree.update_data_sizes()
                     self.tree.update_rectangles((0, 0, self.width, drawable_height))
 
                 elif k == pygame.K_DELETE or platform == 'darwin' and k == pygame.K_BACKSPACE:
                     if selected_node.delete_self():
-                        self.tree.update_data_sizes()
                         self.tree.update_rectangles((0, 0, self.width, drawable_height))
                         selected_node = None
 
                 elif k == pygame.K_m:
                     selected_node.move(hover_node)
-                    self.tree.update_data_sizes()
                     self.tree.update_rectangles((0, 0, self.width, drawable_height))
                     selected_node = hover_node
 
@@ -164,6 +420,93 @@ class Visualiser:
                     self.run_visualisation(selected_node)
                     return
 
+            if event.type == pygame.KEYUP and event.key in (pygame.K_u, pygame.K_r):
+                journal = self.tree.start_journal()
+                if journal.undo() if event.key == pygame.K_u else journal.redo():
+                    self.tree.update_rectangles(
+                        (0, 0, self.width, self.height - self.font_height))
+
+            if event.type == pygame.KEYUP and event.key == pygame.K_t:
+                if self.highlighted is None:
+                    self.highlight_largest()
+                    for node in self.highlighted:
+                        print(node.data_size, node.get_path_string())
+                else:
+                    self.highlighted = None
+
+            if event.type == pygame.KEYUP and event.key == pygame.K_d:
+                if self.duplicates is not None or \
+                        self.duplicates_search is not None:
+                    self.duplicates = self.duplicates_search = None
+                elif self.scan is not None:
+                    print('Duplicates can be found once the scan is done')
+                elif isinstance(self.tree, FileSystemTree) and \
+                        self.source is not None:
+                    self.find_duplicates()
+
+            # show the duplicates once they have all been found
+            if self.duplicates_search is not None and \
+                    self.duplicates_search.done():
+                self.duplicates = self.duplicates_search.result()
+                self.duplicates_version = self.tree.get_version()
+                self.duplicates_search = None
+                for files in self.duplicates:
+                    print(files[0].data_size,
+                          *(node.get_path_string() for node in files))
+                print(f'{format_size(reclaimable(self.duplicates))} '
+                      f'could be freed by deleting duplicates')
+
+            if event.type == pygame.KEYUP and event.key == pygame.K_v:
+                # switch between the folders and the files grouped by type
+                if self.primary is not None:
+                    tree, self.primary = self.primary, None
+                    self.run_visualisation(tree)
+                    return
+                elif isinstance(self.tree, FileSystemTree):
+                    self.primary = self.tree
+                    view = self.tree.get_extension_view()
+                    view.expand_all()
+                    self.run_visualisation(view)
+                    return
+
+            if event.type == pygame.KEYUP and self.history is not None and \
+                    self.primary is None and \
+                    event.key in (pygame.K_LEFTBRACKET, pygame.K_RIGHTBRACKET):
+                # step to the scan before or after the one on display
+                dates = self.history.get_dates()
+                i = dates.index(self.history_date)
+                i += 1 if event.key == pygame.K_RIGHTBRACKET else -1
+                if 0 <= i < len(dates):
+                    self.run_visualisation(self.show_date(dates[i]))
+                    return
+
+            if event.type == pygame.KEYUP and event.key == pygame.K_p:
+                self.toggle_profiling()
+
+            if event.type == pygame.KEYUP and event.key == pygame.K_k:
+                policies = DIFF_COLOUR_POLICIES \
+                    if isinstance(self.tree, DiffTree) else COLOUR_POLICIES
+                self.colour_policy = (self.colour_policy + 1) % len(policies)
+                # Only what is on screen needs colouring.
+                self.tree.set_colour_policy(policies[self.colour_policy],
+                                            lazy=True)
+
+            if event.type == pygame.KEYUP and event.key == pygame.K_n:
+                if self.scan is not None:
+                    print('The metric can be changed once the scan is done')
+                else:
+                    self.next_metric()
+                    if self.primary is not None:
+                        # the view is grouped again by the new metric
+                        view = self.primary.get_extension_view()
+                        view.expand_all()
+                        self.run_visualisation(view)
+                        return
+
+            if event.type == pygame.KEYUP and event.key == pygame.K_s:
+                self.tree.start_journal().save(JOURNAL_FILE)
+                print(f'Saved the edits to {JOURNAL_FILE}')
+
             if event.type == pygame.KEYUP and event.key == pygame.K_b:
                 if self.tree.get_parent():
                     self.tree.get_parent().collapse_all()
@@ -198,9 +541,27 @@ class Visualiser:
             return old_selected_leaf
 
     def _get_display_text(self) -> str:
-        """Return the display text of this leaf.
+        """Return the display text of this leaf, after the progress of the
+        background scan if one is running, the duplicates found, and the date
+        of the scan on display if it is from a history.
+        """
+        text = self._get_selection_text()
+        if self.history_date is not None:
+            text = f'[{self.history_date}] ' + text
+        if self.duplicates_search is not None:
+            text = '[finding duplicates] ' + text
+        elif self.duplicates is not None:
+            copies = sum(len(files) - 1 for files in self.duplicates)
+            text = f'[{copies} duplicates, ' \
+                   f'{format_size(reclaimable(self.duplicates))} to free] ' \
+                   + text
+        if self.scan is not None:
+            text = f'[scanning: {self.scan.items_found} found] ' + text
+        return text
+
+    def _get_selection_text(self) -> str:
+        """Return the path and suffix of the selected leaf, shortened to fit.
         """
-
         leaf = self.selected_node
         if leaf is None:
             return ''
@@ -218,8 +579,173 @@ class Visualiser:
             return leaf_path + leaf.get_suffix()
 
 
-def run_treemap_file_system(path: str) -> None:
-    """Run a treemap visualisation for the given path's file structure.
+def draw_rectangle_stream(surface: pygame.Surface,
+                          rectangles: Iterable[Tuple[Tuple[int, int, int, int],
+                                                     Tuple[int, int, int]]]
+                          ) -> int:
+    """Draw the (rect, colour) pairs in <rectangles> onto <surface>, and
+    return how many there were.
+
+    The first BULK_FILL_THRESHOLD pairs are held back; if that is all there
+    are, or numpy is missing, they and the rest are drawn one at a time.
+    Otherwise the whole frame goes through fill_rectangles, so <surface>
+    should already be cleared to black.
+    """
+    rectangles = iter(rectangles)
+    first = list(islice(rectangles, BULK_FILL_THRESHOLD + 1))
+    if np is None or len(first) <= BULK_FILL_THRESHOLD:
+        drawn = 0
+        for rect, colour in chain(first, rectangles):
+            # Note that the arguments are in the opposite order
+            pygame.draw.rect(surface, colour, rect)
+            drawn += 1
+        return drawn
+    rects, colours = rectangle_arrays(chain(first, rectangles))
+    fill_rectangles(surface, rects, colours)
+    return len(rects)
+
+
+def draw_rectangles(surface: pygame.Surface, rects: np.ndarray,
+                    colours: np.ndarray) -> None:
+    """Draw the pygame rectangles in the N x 4 array <rects> onto <surface>,
+    each filled with the matching colour in the N x 3 array <colours>.
+
+    Large batches go through fill_rectangles, so <surface> should already be
+    cleared to black.
+    """
+    if len(rects) > BULK_FILL_THRESHOLD:
+        fill_rectangles(surface, rects, colours)
+    else:
+        for rect, colour in zip(rects.tolist(), colours.tolist()):
+            # Note that the arguments are in the opposite order
+            pygame.draw.rect(surface, colour, rect)
+
+
+def fill_rectangles(surface: pygame.Surface, rects: np.ndarray,
+                    colours: np.ndarray) -> None:
+    """Fill each of the non-overlapping pygame rectangles in the N x 4 array
+    <rects> with the matching colour in the N x 3 array <colours>, all in a
+    single write to <surface>'s pixels.
+
+    Pixels not covered by any rectangle are painted black, so this is meant to
+    be used on a freshly cleared surface.
+    """
+    width, height = surface.get_size()
+    rects = rects.astype(np.int64)
+    x0 = np.clip(rects[:, 0], 0, width)
+    y0 = np.clip(rects[:, 1], 0, height)
+    x1 = np.clip(rects[:, 0] + rects[:, 2], 0, width)
+    y1 = np.clip(rects[:, 1] + rects[:, 3], 0, height)
+    visible = (x0 < x1) & (y0 < y1)
+
+    # Label each rectangle 1..N and mark its corners in a 2D difference array.
+    # Since treemap rectangles never overlap, the running sums along both axes
+    # leave every pixel holding the label of the rectangle covering it, or 0.
+    labels = np.arange(1, len(rects) + 1, dtype=np.int32)[visible]
+    x0, y0, x1, y1 = x0[visible], y0[visible], x1[visible], y1[visible]
+    diff = np.zeros((width + 1, height + 1), dtype=np.int32)
+    np.add.at(diff, (x0, y0), labels)
+    np.add.at(diff, (x1, y0), -labels)
+    np.add.at(diff, (x0, y1), -labels)
+    np.add.at(diff, (x1, y1), labels)
+    index = diff.cumsum(axis=0).cumsum(axis=1)[:width, :height]
+
+    palette = np.zeros((len(rects) + 1, 3), dtype=np.uint8)
+    palette[1:] = colours
+    pygame.surfarray.blit_array(surface, palette[index])
+
+
+def load_tree(source: str, rules: Optional[ScanRules] = None,
+              archives: bool = False, records: Optional[str] = None) -> TMTree:
+    """Return the tree for <source>: the files it lists if <records> is given,
+    as the name of the format of the listing in records.FORMATS; a PaperTree
+    if it is a CSV file of papers in the format of DATA_FILE; the saved tree
+    if it is a snapshot file; and a FileSystemTree for any other file or
+    folder, scanned by <rules> if given and showing archives as folders if
+    <archives>.
+    """
+    if records is not None:
+        return load_records(source, records)
+    if os.path.isfile(source) and is_snapshot(source):
+        with load_snapshot(source) as snapshot:
+            return snapshot.to_tree()
+    if os.path.isfile(source) and source.lower().endswith('.csv'):
+        name = os.path.splitext(os.path.basename(source))[0]
+        return PaperTree(name, [], all_papers=True, by_year=False,
+                         data_file=source)
+    return FileSystemTree(source, rules, archives)
+
+
+def render_treemap_file(source: str, filename: str, size: tuple[int, int],
+                        depth: int, journal: Optional[str] = None,
+                        rules: Optional[ScanRules] = None,
+                        archives: bool = False,
+                        records: Optional[str] = None) -> str:
+    """Render the treemap of <source>, expanded <depth> levels deep, to an
+    image of the given <size> saved at <filename>, and return <filename>.
+    If <journal> is given, the edits saved in that file are replayed first.
+    Folders are scanned by <rules>, if given, and archives within <depth> are
+    shown as folders if <archives>. If <records> is given, <source> is a
+    listing in that format, as for load_tree.
+
+    This never opens a window: SDL's dummy video driver is used unless another
+    driver has been chosen explicitly.
+    """
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    tree = load_tree(source, rules, archives, records)
+    if journal is not None:
+        replay_journal(tree, journal)
+    tree.expand_to_depth(depth)
+    visualiser = Visualiser()
+    visualiser.width, visualiser.height = size
+    visualiser.render_to_file(tree, filename)
+    return filename
+
+
+def render_batch(sources: List[str], out_dir: str, size: tuple[int, int],
+                 depth: int, workers: Optional[int] = None,
+                 journal: Optional[str] = None,
+                 rules: Optional[ScanRules] = None,
+                 archives: bool = False,
+                 records: Optional[str] = None) -> List[str]:
+    """Render a PNG treemap for every path in <sources> into <out_dir>, using
+    a pool of <workers> processes (one per CPU by default), and return the
+    paths of the images in the same order as <sources>. If <journal> is given,
+    the edits saved in that file are replayed on every tree first. Folders
+    are scanned by <rules>, if given, and archives are shown as folders if
+    <archives>. If <records> is given, the sources are listings in that
+    format, as for load_tree.
+
+    Each image is named after its source; repeated names are numbered.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    filenames = []
+    taken = set()
+    for source in sources:
+        stem = os.path.splitext(os.path.basename(os.path.normpath(source)))[0]
+        name, i = stem, 1
+        while name in taken:
+            name = f'{stem}-{i}'
+            i += 1
+        taken.add(name)
+        filenames.append(os.path.join(out_dir, name + '.png'))
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(render_treemap_file, sources, filenames,
+                             [size] * len(sources), [depth] * len(sources),
+                             [journal] * len(sources),
+                             [rules] * len(sources),
+                             [archives] * len(sources),
+                             [records] * len(sources)))
+
+
+def run_treemap_file_system(path: str,
+                            rules: Optional[ScanRules] = None,
+                            archives: bool = False,
+                            visualizer: Optional[Visualiser] = None) -> None:
+    """Run a treemap visualisation for the given path's file structure,
+    scanned by <rules> if given, with archives that open as folders when
+    expanded if <archives>, in <visualizer> or a new Visualiser.
     Precondition: <path> is a valid path to a file or folder.
     """
     instructions = '\n==== Instructions for use ====\n' \
@@ -233,25 +759,238 @@ def run_treemap_file_system(path: str) -> None:
                    '"Up" and "Down" arrow keys to change the size of a file (in visualization)\n' \
                    '"M" to move a file (while selecting a file and hovering over a folder)\n' \
                    '"Del" to delete a file or folder from the visualization\n' \
+                   '"U" and "R" to undo and redo an edit, "S" to save the edits\n' \
+                   '"K" to colour by path, by file type, or by size\n' \
+                   '"N" to size by bytes, number of files, or space on disk\n' \
+                   '"T" to highlight the largest files\n' \
+                   '"D" to outline files with the same contents as others\n' \
+                   '"V" to switch to files grouped by type, and back\n' \
+                   '"P" to show where the time of each frame goes, and again to save it\n' \
                    '(Drag window to resize)'
-    file_tree = FileSystemTree(path)
+    scan = BackgroundScan(path, rules, archives)
+    scan.start()
     print(instructions)
-    visualizer.run_visualisation(file_tree)
-
-
-def run_treemap_papers() -> None:
-    """Run a treemap visualization for CS Education research papers data.
+    if visualizer is None:
+        visualizer = Visualiser()
+    visualizer.scan = scan
+    visualizer.source = path
+    visualizer.run_visualisation(scan.tree)
+
+
+def merge_sources(sources: List[str], rules: Optional[ScanRules] = None,
+                  archives: bool = False, records: Optional[str] = None,
+                  workers: Optional[int] = None) -> TMTree:
+    """Return the tree of <sources> merged by path under one root, as for
+    shards.merge_trees. Each source may be written MOUNT=SOURCE to put it at
+    the path MOUNT, such as /=root.snap or home=home.snap; / merges it into
+    the root.
+
+    If every source is a snapshot file, they are merged as snapshots by a
+    pool of <workers> processes; otherwise each is loaded, as for load_tree,
+    and the trees are merged.
+    """
+    mounts = []
+    paths = []
+    for source in sources:
+        mount, equals, path = source.partition('=')
+        if not equals or os.path.exists(source):
+            mount, path = None, source
+        mounts.append(mount)
+        paths.append(path)
+    if records is None and all(os.path.isfile(path) and is_snapshot(path)
+                               for path in paths):
+        handle, merged = tempfile.mkstemp(suffix='.snap')
+        os.close(handle)
+        try:
+            merge_shards(paths, merged, mounts, workers=workers)
+            with load_snapshot(merged) as snapshot:
+                return snapshot.to_tree()
+        finally:
+            os.remove(merged)
+    return merge_trees([load_tree(path, rules, archives, records)
+                        for path in paths], mounts)
+
+
+def diff_sources(old: str, new: str, rules: Optional[ScanRules] = None,
+                 archives: bool = False) -> TMTree:
+    """Return the treemap of what changed from the scan <old> to the scan
+    <new>, each a folder or a snapshot file. Folders are scanned by <rules>,
+    if given, and show archives as folders if <archives>.
+
+    Snapshots are compared without loading them, so only the parts that
+    changed are read.
+    """
+    scans = [load_snapshot(source) if is_snapshot(source)
+             else FileSystemTree(source, rules, archives)
+             for source in (old, new)]
+    try:
+        return diff_trees(*scans)
+    finally:
+        for scan in scans:
+            if not isinstance(scan, TMTree):
+                scan.close()
+
+
+def run_treemap_history(path: str,
+                        visualizer: Optional[Visualiser] = None) -> None:
+    """Run a treemap visualisation of the latest scan in the SnapshotStore
+    saved in the folder <path>, in <visualizer> or a new Visualiser,
+    stepping through its other scans with the "[" and "]" keys.
+    """
+    store = SnapshotStore(path)
+    dates = store.get_dates()
+    if not dates:
+        print(f'There are no scans in {path}')
+        return
+    print('"[" and "]" to step back and forward through the scans')
+    if visualizer is None:
+        visualizer = Visualiser()
+    visualizer.history = store
+    visualizer.history_date = dates[-1]
+    visualizer.run_visualisation(store.get_tree(dates[-1]))
+
+
+def run_treemap_papers(visualizer: Optional[Visualiser] = None) -> None:
+    """Run a treemap visualization for CS Education research papers data, in
+    <visualizer> or a new Visualiser.
 
     You can try changing the value of the named argument by_year, but the
     others should stay the same.
     """
     paper_tree = PaperTree('CS1', [], all_papers=True, by_year=False)
+    if visualizer is None:
+        visualizer = Visualiser()
     visualizer.run_visualisation(paper_tree)
 
 
-if __name__ == '__main__':
+def _scan_rules(args: argparse.Namespace) -> Optional[ScanRules]:
+    """Return the scan rules asked for on the command line, or None if there
+    are none.
+    """
+    patterns = list(args.exclude)
+    if args.skip_common:
+        patterns = COMMON_EXCLUDES + patterns
+    if args.exclude_from:
+        with open(args.exclude_from) as file:
+            patterns += file.read().splitlines()
+    if not patterns and args.max_depth is None and \
+            not args.one_file_system:
+        return None
+    return ScanRules(patterns, args.max_depth, args.one_file_system,
+                     args.collapse_skipped)
+
+
+def _parse_size(text: str) -> tuple[int, int]:
+    width, _, height = text.lower().partition('x')
+    return int(width), int(height)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """Entry point for the command line.
+
+    With no sources, show the papers dataset. With one or more sources and
+    --out, render each of them to a PNG without a display. With --diff, show
+    what changed in the first source since the earlier scan. With --record or
+    --history, add a scan of the first source to a history or browse one.
+    With --merge, show all the sources merged into one tree. Otherwise, show
+    the first source interactively.
+    """
+    parser = argparse.ArgumentParser(
+        description='Visualise folders or paper datasets as treemaps.')
+    parser.add_argument('sources', nargs='*',
+                        help='folders, files, or papers CSV files to show')
+    parser.add_argument('--out', help='render PNGs into this folder '
+                                      'instead of opening a window')
+    parser.add_argument('--size', type=_parse_size, default=(1200, 700),
+                        help='image size as WIDTHxHEIGHT (default 1200x700)')
+    parser.add_argument('--depth', type=int, default=1,
+                        help='levels to expand in rendered images (default 1)')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='rendering processes (default: one per CPU)')
+    parser.add_argument('--replay', metavar='JOURNAL',
+                        help='replay edits saved with the "S" key first')
+    parser.add_argument('--diff', metavar='OLD',
+                        help='show what changed since OLD, an earlier scan '
+                             'of the source as a folder or snapshot')
+    parser.add_argument('--record', metavar='STORE',
+                        help='add a scan of the source to the history saved '
+                             'in the folder STORE, dated today')
+    parser.add_argument('--history', metavar='STORE',
+                        help='step through the scans saved in STORE')
+    parser.add_argument('--profile', action='store_true',
+                        help='start with profiling on, as if "P" was '
+                             'pressed')
+    parser.add_argument('--exclude', metavar='PATTERN', action='append',
+                        default=[],
+                        help='leave out files and folders matching this '
+                             '.gitignore-style pattern; "!PATTERN" puts '
+                             'them back (may be repeated)')
+    parser.add_argument('--exclude-from', metavar='FILE',
+                        help='leave out what the patterns in FILE, such as a '
+                             '.gitignore file, match')
+    parser.add_argument('--skip-common', action='store_true',
+                        help='leave out version control, dependency and '
+                             'virtual environment folders such as .git and '
+                             'node_modules')
+    parser.add_argument('--max-depth', type=int, metavar='N',
+                        help='list only N levels of folders, and show '
+                             'deeper folders as one block each')
+    parser.add_argument('--one-file-system', action='store_true',
+                        help='leave out folders on other devices')
+    parser.add_argument('--collapse-skipped', action='store_true',
+                        help='show what is left out of each folder as one '
+                             'block, instead of not at all')
+    parser.add_argument('--archives', action='store_true',
+                        help='show zip and tar files as folders of what is '
+                             'in them, read when they are expanded')
+    parser.add_argument('--records', choices=sorted(FORMATS),
+                        help='read the sources as listings of files in this '
+                             'format, such as the output of du -ab, instead '
+                             'of scanning them')
+    parser.add_argument('--merge', action='store_true',
+                        help='show the sources merged into one tree by '
+                             'path; write a source as MOUNT=SOURCE to put it '
+                             'at the path MOUNT, or /=SOURCE for the root')
+    args = parser.parse_args(argv)
     visualizer = Visualiser()
-    EXAMPLE_PATH = os.path.join(os.getcwd(), 'example-directory', 'workshop')
-    PATH_TO_VISUALISE = EXAMPLE_PATH  # enter a custom path here if you wish
-    # run_treemap_file_system(PATH_TO_VISUALISE or getcwd())
-    run_treemap_papers()
+    if args.profile:
+        visualizer.toggle_profiling()
+    rules = _scan_rules(args)
+
+    if args.sources and args.out:
+        for filename in render_batch(args.sources, args.out, args.size,
+                                     args.depth, args.workers, args.replay,
+                                     rules, args.archives, args.records):
+            print(filename)
+    elif args.sources and args.record:
+        if args.records is not None:
+            tree = load_records(args.sources[0], args.records)
+        else:
+            tree = FileSystemTree(args.sources[0], rules)
+        SnapshotStore(args.record).add(tree)
+    elif args.history:
+        run_treemap_history(args.history, visualizer)
+    elif args.sources and args.diff:
+        visualizer.run_visualisation(diff_sources(
+            args.diff, args.sources[0], rules, args.archives))
+    elif args.sources and args.merge:
+        visualizer.run_visualisation(merge_sources(
+            args.sources, rules, args.archives, args.records, args.workers))
+    elif args.sources and args.replay:
+        # The edits need the whole tree, so scan it before showing it.
+        tree = load_tree(args.sources[0], rules, args.archives, args.records)
+        replay_journal(tree, args.replay)
+        visualizer.run_visualisation(tree)
+    elif args.sources and (args.records is not None or
+                           args.sources[0].lower().endswith('.csv')):
+        visualizer.run_visualisation(load_tree(args.sources[0],
+                                               records=args.records))
+    elif args.sources:
+        run_treemap_file_system(args.sources[0], rules, args.archives,
+                                visualizer)
+    else:
+        run_treemap_papers(visualizer)
+
+
+if __name__ == '__main__':
+    main()